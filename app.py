@@ -1,30 +1,28 @@
+import time
+_T0 = time.perf_counter()  # início desta execução do script (medição de partida, ver _registrar_partida)
 import streamlit as st
 import pandas as pd
-import gspread
-from gspread.exceptions import APIError
-from datetime import datetime, timedelta
-import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 import os
+import sys
+import threading
 import json
-import psycopg2
-from sqlalchemy import create_engine
-from dotenv import load_dotenv
-load_dotenv()
-try:
-    import tomllib
-except ImportError:
-    import tomli as tomllib
-
-def load_config():
-    try:
-        with open("config.toml", "rb") as f:
-            return tomllib.load(f)
-    except Exception as e:
-        # Fallback para st.secrets ou env se o arquivo não existir ou falhar
-        print(f"❌ [DEBUG] Error loading config.toml: {e}")
-        return {}
+import pg_engine
+import fleet_state
+import snapshot_store
+import write_queue
+import repositorio
+import instrumentacao
+import configuracao
+# Clientes pesados ficam para o primeiro uso do backend: gspread/sheets_client em
+# _get_connection, telemetria (SQLAlchemy + psycopg2) em get_dataframe/versoes. Servindo
+# o snapshot em disco, a primeira tela sai antes desses imports (feitos pela revalidação).
 
-CONFIG = load_config()
+# .env, config.toml e secrets resolvidos uma vez por processo (configuracao, o mesmo
+# módulo dos scripts): o script é reexecutado a cada rerun, o módulo não
+CONFIG = configuracao.config()
+_T_IMPORTS = time.perf_counter() - _T0
 
 # --- 1. CONFIGURAÇÃO DA PÁGINA ---
 st.set_page_config(
@@ -56,279 +54,792 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- 3. BANCO DE DADOS ---
+# Fontes do repositório (planilha ou Postgres) lidas juntas a cada atualização
+SHEETS_LEITURA = repositorio.ABAS
+
+def _segredos_app():
+    # st.secrets como dict ({} sem secrets.toml)
+    try:
+        return st.secrets.to_dict()
+    except Exception:
+        return {}
+
+@st.cache_resource(show_spinner=False)
+def _config_banco():
+    # (URL, opções do pool) do Postgres, resolvidos uma vez por processo e não a cada
+    # _get_pg_engine: st.secrets -> config.toml -> env (ordem em configuracao)
+    db_url = configuracao.url_banco(segredos=_segredos_app())
+    if not db_url:
+        print("❌ [DEBUG] DATABASE_URL não encontrada (secrets, config ou env)!")
+    return db_url, configuracao.opcoes_pool()
+
 class FleetDatabase:
     def __init__(self, sheet_name="frota_db"):
         self.sheet_name = sheet_name
-        self.log_cols = ["id", "placa", "tipo_servico", "km_realizada", "data_realizada", "proxima_km", "responsavel", "valor", "obs", "status"]
+        self.log_cols = list(repositorio.LOG_COLS)
+        self.default_services = list(repositorio.DEFAULT_SERVICES)
 
-    def _get_pg_engine(self):
+    def _get_pg_engine(self, criar=True):
+        # criar=False: só o engine já aberto (painel de desempenho), sem importar o SQLAlchemy
+        db_url, opts = _config_banco()
+        if not db_url:
+            return None
+        if not criar:
+            return pg_engine.engine_existente(db_url)
         try:
-            db_url = None
-            
-            # 1. Tenta pegar dos st.secrets (Produção/Streamlit Cloud)
-            try:
-                if "database" in st.secrets:
-                    db_sec = st.secrets["database"]
-                    if "url" in db_sec:
-                        db_url = db_sec["url"]
-                    elif "host" in db_sec and "user" in db_sec:
-                        # Monta URL a partir dos componentes
-                        from urllib.parse import quote_plus
-                        encoded_pass = quote_plus(db_sec["password"]) if "password" in db_sec else ""
-                        db_url = f"postgresql://{db_sec['user']}:{encoded_pass}@{db_sec['host']}:{db_sec.get('port', 5432)}/{db_sec.get('database', 'postgres')}"
-            except FileNotFoundError:
-                pass 
-            except Exception:
-                pass
-            
-            # 2. Se não achou, tenta do config.toml (Local)
-            if not db_url:
-                db_url = CONFIG.get("database", {}).get("url")
-            
-            # 3. Fallback para variáveis de ambiente
-            if not db_url:
-                db_url = os.getenv("DATABASE_URL")
-            
-            if not db_url:
-                print("❌ [DEBUG] DATABASE_URL não encontrada (secrets, config ou env)!")
-                return None
-
-            # SQLAlchemy Engine
-            return create_engine(db_url)
+            # SQLAlchemy Engine (um pool por processo, reaproveitado entre reruns e sessões)
+            return pg_engine.get_engine(db_url, **opts)
         except Exception as e:
             st.error(f"Erro ao criar engine Postgres: {e}")
             return None
 
     @st.cache_resource
     def _get_connection(_self):
+        # st.secrets (Streamlit Cloud) ou GCP_CREDENTIALS / variáveis soltas no .env
         creds_dict = None
-        # 1. Tenta pegar dos st.secrets (Streamlit Cloud)
         try:
-            if "gcp_service_account" in st.secrets:
-                creds_dict = st.secrets["gcp_service_account"]
-        except: pass
-        
-        # 2. Fallback: Variável de Ambiente GCP_CREDENTIALS (String JSON)
-        if not creds_dict:
-            env_json = os.getenv("GCP_CREDENTIALS")
-            if env_json:
-                try:
-                    creds_dict = json.loads(env_json)
-                except Exception as e:
-                    st.error(f"Erro ao fazer parse do JSON em GCP_CREDENTIALS: {e}")
-            
-            # 3. Fallback: Variáveis de Ambiente individuais (Formato atual do user)
-            elif os.getenv("private_key"): 
-                try:
-                    # Reconstrói o dicionário a partir das variáveis soltas no .env
-                    creds_dict = {
-                        "type": os.getenv("type"),
-                        "project_id": os.getenv("project_id"),
-                        "private_key_id": os.getenv("private_key_id"),
-                        "private_key": os.getenv("private_key").replace("\\n", "\n") if os.getenv("private_key") else None,
-                        "client_email": os.getenv("client_email"),
-                        "client_id": os.getenv("client_id"),
-                        "auth_uri": os.getenv("auth_uri"),
-                        "token_uri": os.getenv("token_uri"),
-                        "auth_provider_x509_cert_url": os.getenv("auth_provider_x509_cert_url"),
-                        "client_x509_cert_url": os.getenv("client_x509_cert_url"),
-                        "universe_domain": os.getenv("universe_domain")
-                    }
-                except Exception as e:
-                     st.error(f"Erro ao montar credenciais via variáveis soltas: {e}")
+            creds_dict = configuracao.credenciais_google(segredos=_segredos_app())
+        except Exception as e:
+            st.error(f"Erro ao montar credenciais a partir do ambiente: {e}")
 
         if not creds_dict:
             st.error("Credenciais do Google Sheets não encontradas (st.secrets ou env GCP_CREDENTIALS).")
             return None
 
         try:
-            gc = gspread.service_account_from_dict(creds_dict)
+            import gspread
+            import sheets_client
+            # Todo o tráfego passa pelo limitador de cota compartilhado (sheets_client)
+            gc = gspread.service_account_from_dict(creds_dict, http_client=sheets_client.QuotaHTTPClient)
             return gc.open(_self.sheet_name)
         except Exception as e:
             st.error(f"Erro conexão Sheets: {e}")
             return None
 
-    def _safe_get_worksheet(self, sh, title):
-        for attempt in range(4):
-            try: return sh.worksheet(title)
-            except APIError: time.sleep(2 * (attempt + 1))
-            except: return None
-        return None
+    @st.cache_resource
+    def _get_repositorio(_self):
+        # Onde ficam manutenções, KM manual e serviços: "sheets" (padrão) ou "postgres",
+        # por [storage] backend no config.toml ou STORAGE_BACKEND. Um por processo.
+        # Backend indisponível levanta exceção, para a falha não ficar cacheada.
+        if configuracao.backend() == "postgres":
+            engine = _self._get_pg_engine()
+            if engine is None: raise RuntimeError("Postgres indisponível")
+            repo = repositorio.PostgresRepositorio(engine)
+            repo.criar_esquema()
+            return repo
+        return repositorio.SheetsRepositorio(_self._get_connection, _self._get_pg_engine)
+
+    def get_sheets_batch(self, nomes=SHEETS_LEITURA, strict=False):
+        # Lê as fontes pedidas do repositório (na planilha, UMA chamada values:batchGet).
+        # service_types volta como lista de serviços; as demais como DataFrame.
+        try:
+            return self._get_repositorio().carregar(tuple(nomes))
+        except Exception as e:
+            if strict: raise
+            print(f"❌ [DEBUG] Falha ao ler {', '.join(nomes)}: {e}")
+            return {}
+
+    def historico(self, df_logs, filtros, limite, deslocamento=0):
+        # (página de O.S. concluídas, total filtrado): consulta indexada no Postgres, ou
+        # fleet_state sobre o maintenance_logs já carregado quando o repositório é a planilha
+        try:
+            r = self._get_repositorio().historico(filtros, limite, deslocamento)
+        except Exception as e:
+            print(f"❌ [DEBUG] Falha ao consultar o histórico: {e}")
+            r = None
+        if r is not None: return r
+        h = fleet_state.filtrar_historico(df_logs, **filtros)
+        if h.empty: h = pd.DataFrame(columns=self.log_cols)
+        return h.iloc[deslocamento:deslocamento + limite], len(h)
+
+    def agregados_historico(self, df_logs, filtros):
+        try:
+            r = self._get_repositorio().agregados_historico(filtros)
+        except Exception as e:
+            print(f"❌ [DEBUG] Falha ao agregar o histórico: {e}")
+            r = None
+        if r is not None: return r
+        return fleet_state.agregar_historico(fleet_state.filtrar_historico(df_logs, **filtros))
     
-    def get_dataframe(self, worksheet_name):
+    def _vazio(self, motivo, strict):
+        # strict=True: o chamador (carga paralela) precisa saber que a fonte falhou
+        if strict: raise RuntimeError(motivo)
+        return pd.DataFrame()
+
+    def get_dataframe(self, worksheet_name, strict=False):
         # Rota para Postgres (Dados de Rastreamento)
         if worksheet_name == "vehicles":
             engine = self._get_pg_engine()
-            if not engine: return pd.DataFrame()
+            if not engine: return self._vazio("Postgres indisponível", strict)
             try:
-                # Query com JOIN para pegar o último odômetro
-                query = """
-                    SELECT v.id_sascar as id_veiculo, v.placa, p.odometro 
-                    FROM veiculos v
-                    LEFT JOIN (
-                        SELECT DISTINCT ON (id_veiculo) id_veiculo, odometro
-                        FROM posicoes_raw
-                        ORDER BY id_veiculo, data_hora DESC
-                    ) p ON v.id_sascar = p.id_veiculo
-                """
-                with engine.connect() as conn:
-                    df = pd.read_sql_query(query, conn)
-                return df
+                import telemetria
+                return telemetria.ler_veiculos(engine)
             except Exception as e:
+                if strict: raise
                 st.error(f"Erro ao ler veículos do DB: {e}")
                 return pd.DataFrame()
 
         if worksheet_name == "positions":
             engine = self._get_pg_engine()
-            if not engine: return pd.DataFrame()
+            if not engine: return self._vazio("Postgres indisponível", strict)
             try:
-                query_opt = """
-                    SELECT DISTINCT ON (id_veiculo) 
-                        id_veiculo, 
-                        data_hora as timestamp, 
-                        odometro, 
-                        latitude, 
-                        longitude 
-                    FROM posicoes_raw 
-                    ORDER BY id_veiculo, data_hora DESC
-                """
-                with engine.connect() as conn:
-                    df = pd.read_sql_query(query_opt, conn)
-                return df
+                import telemetria
+                return telemetria.ler_posicoes(engine)
             except Exception as e:
+                if strict: raise
                 st.error(f"Erro ao ler posições do DB: {e}")
                 return pd.DataFrame()
 
+        if worksheet_name == "km_dia":
+            engine = self._get_pg_engine()
+            if not engine: return self._vazio("Postgres indisponível", strict)
+            try:
+                import telemetria
+                return telemetria.ler_uso_diario(engine)
+            except Exception as e:
+                if strict: raise
+                st.error(f"Erro ao ler o uso diário do DB: {e}")
+                return pd.DataFrame()
+
         # Rota Original (Google Sheets)
-        sh = self._get_connection()
-        if not sh: return pd.DataFrame()
-        try:
-            ws = self._safe_get_worksheet(sh, worksheet_name)
-            if not ws: return pd.DataFrame()
-            data = ws.get_all_records()
-            df = pd.DataFrame(data)
-            if worksheet_name == "maintenance_logs":
-                if df.empty: return pd.DataFrame(columns=self.log_cols)
-                for col in self.log_cols:
-                    if col not in df.columns: df[col] = ""
+        dados = self.get_sheets_batch([worksheet_name], strict=strict)
+        if worksheet_name not in dados: return self._vazio(f"Aba {worksheet_name} indisponível", strict)
+        return dados[worksheet_name]
+
+    def versoes(self, nomes):
+        # Versão barata de cada fonte (watermarks no Postgres, modifiedTime da planilha); fonte
+        # sem versão (None ou ausente) é recarregada. Falha na sondagem = recarrega como antes.
+        out = {}
+        telemetria_pedida = [n for n in nomes if n in ("vehicles", "positions", "km_dia")]
+        engine = self._get_pg_engine() if telemetria_pedida else None
+        if engine:
+            try:
+                import telemetria
+                out.update(telemetria.versoes(engine, telemetria_pedida))
+            except Exception as e:
+                print(f"❌ [DEBUG] Falha ao sondar a telemetria: {e}")
+        abas = [n for n in nomes if n in SHEETS_LEITURA]
+        if abas:
+            try:
+                out.update(self._get_repositorio().versoes(tuple(abas)) or {})
+            except Exception as e:
+                print(f"❌ [DEBUG] Falha ao sondar {', '.join(abas)}: {e}")
+        return out
+
+    def get_services_list(self, strict=False):
+        return self.get_sheets_batch(["service_types"], strict=strict).get("service_types", self.default_services)
+
+    # --- escrita (write-behind) ---
+    # Cada escrita vira uma operação no journal local (write_queue) e é aplicada na hora no
+    # cache (resultado otimista); o worker grava na planilha em segundo plano. _efeito() é a
+    # mesma correção usada no cache e, após cada recarga, para as operações ainda pendentes.
+    def _efeito_df(self, mascara_fn, valores, nova_linha=None):
+        def aplicar(df):
+            df = df.copy()
+            mascara = mascara_fn(df) if not df.empty else pd.Series(False, index=df.index)
+            if not mascara.any():
+                if nova_linha is None: return df
+                return pd.concat([df, pd.DataFrame([nova_linha])], ignore_index=True)
+            for col, v in valores.items():
+                if col not in df.columns: df[col] = ""
+                df[col] = df[col].astype(object)
+                df.loc[mascara, col] = v
             return df
-        except: return pd.DataFrame()
+        return aplicar
+
+    def _efeito(self, operacao, payload):
+        # (fonte do cache, função DataFrame -> DataFrame). Idempotente: reaplicar não duplica.
+        if operacao == "manual_km":
+            placa, km = payload["placa"], payload["km"]
+            return "veiculos_manuais", self._efeito_df(lambda df: df['placa'].astype(str) == str(placa),
+                                                       {'odometro': km}, nova_linha={'placa': placa, 'odometro': km})
+        if operacao == "append_log":
+            row = payload["row"]
+            return "maintenance_logs", self._efeito_df(lambda df: df['id'].astype(str) == str(row[0]), {},
+                                                       nova_linha=dict(zip(self.log_cols, row)))
+        if operacao == "append_logs":
+            def incluir(df):
+                existentes = set(df['id'].astype(str)) if not df.empty else set()
+                novas = [dict(zip(self.log_cols, r)) for r in payload["rows"] if str(r[0]) not in existentes]
+                return pd.concat([df, pd.DataFrame(novas)], ignore_index=True) if novas else df
+            return "maintenance_logs", incluir
+        if operacao == "update_logs":
+            efeitos = [self._efeito("update_log", item)[1] for item in payload["itens"]]
+            def atualizar(df):
+                for efeito in efeitos: df = efeito(df)
+                return df
+            return "maintenance_logs", atualizar
+        log_id = payload["log_id"]
+        if operacao == "update_log":
+            # valores usa o número da coluna da planilha (1 = id), como em _update_row
+            valores = {self.log_cols[int(c) - 1]: v for c, v in payload["valores"].items()}
+            return "maintenance_logs", self._efeito_df(lambda df: df['id'].astype(str) == str(log_id), valores)
+        if operacao == "delete_log":
+            return "maintenance_logs", lambda df: df[df['id'].astype(str) != str(log_id)] if not df.empty else df
+        raise ValueError(f"Operação desconhecida: {operacao}")
 
-    def get_services_list(self):
-        defaults = ["Troca de Óleo Motor", "Troca de Óleo Cambio e Diferencial", "Pneus", "Freios", "Correia", "Filtros", "Suspensão", "Elétrica", "Outros"]
-        sh = self._get_connection()
-        if not sh: return defaults
+    def _enfileirar(self, operacao, chave, payload):
+        # Normaliza pelo JSON para o cache e o journal verem exatamente os mesmos valores
+        payload = json.loads(json.dumps(payload, default=str))
+        nome, efeito = self._efeito(operacao, payload)
         try:
-            ws = self._safe_get_worksheet(sh, "service_types")
-            if not ws: return defaults
-            vals = ws.col_values(2) 
-            if len(vals) > 1: return vals[1:]
-            return defaults
-        except: return defaults
+            _get_write_queue().enfileirar(operacao, chave, payload)
+        except Exception as e:
+            # Journal indisponível (ex.: disco): grava direto na planilha, como antes
+            print(f"❌ [DEBUG] Journal indisponível, gravando {operacao} direto: {e}")
+            try:
+                if not self._aplicar_operacao(operacao, payload):
+                    return False
+            except Exception as e:
+                print(f"❌ [DEBUG] Falha ao gravar {operacao}: {e}")
+                return False
+        _get_cache_fontes().patch(nome, efeito)
+        return True
 
     def update_manual_km(self, placa, novo_km):
-        sh = self._get_connection()
-        ws = self._safe_get_worksheet(sh, "veiculos_manuais")
-        if not ws: return False
+        return self._enfileirar("manual_km", f"manual:{placa}", {"placa": placa, "km": novo_km})
+
+    def _reservar_ids(self, n):
+        # Os ids são reservados já (sequence/contador), para edições seguintes poderem apontar para eles
         try:
-            cell = ws.find(placa, in_column=1)
-            if cell:
-                ws.update_cell(cell.row, 2, novo_km)
-            else:
-                ws.append_row([placa, novo_km])
-            carregar_dados_gerais.clear()
-            return True
-        except: return False
+            return self._get_repositorio().reservar_ids(n)
+        except Exception as e:
+            print(f"❌ [DEBUG] Falha ao reservar id da manutenção: {e}")
+            return None
+
+    def _linha_log(self, log_id, d):
+        return [log_id, d['placa'], d['tipo'], d['km'], str(d['data']), d['prox_km'], d['resp'], d['valor'], d['obs'], d['status']]
 
     def add_log(self, data_dict):
-        sh = self._get_connection()
-        ws = self._safe_get_worksheet(sh, "maintenance_logs")
-        if not ws: return
-        col_ids = ws.col_values(1)
-        next_id = 1
-        if len(col_ids) > 1:
-            ids = [int(x) for x in col_ids[1:] if str(x).isdigit()]
-            if ids: next_id = max(ids) + 1
-        row = [next_id, data_dict['placa'], data_dict['tipo'], data_dict['km'], str(data_dict['data']), data_dict['prox_km'], data_dict['resp'], data_dict['valor'], data_dict['obs'], data_dict['status']]
-        ws.append_row(row)
-        carregar_dados_gerais.clear()
-
-    def update_log_status(self, log_id, data_real, valor_final, obs_final, resp_final, km_final):
-        sh = self._get_connection()
-        ws = self._safe_get_worksheet(sh, "maintenance_logs")
-        if not ws: return
+        ids = self._reservar_ids(1)
+        if not ids: return False
+        return self._enfileirar("append_log", f"log:{ids[0]}", {"row": self._linha_log(ids[0], data_dict)})
+
+    def add_logs(self, lista):
+        # Campanha: um bloco de ids e UMA operação no journal (um append_rows na planilha)
+        if not lista: return True
+        ids = self._reservar_ids(len(lista))
+        if not ids: return False
+        rows = [self._linha_log(i, d) for i, d in zip(ids, lista)]
+        return self._enfileirar("append_logs", f"lote:{ids[0]}-{ids[-1]}", {"rows": rows})
+
+    def _obs_carregada(self, log_id):
+        # obs atual a partir do maintenance_logs já carregado (cache), sem ler a célula
+        df_logs = _get_cache_fontes().get("maintenance_logs")
+        if df_logs is None or df_logs.empty: return ""
+        linha = df_logs[df_logs['id'].astype(str) == str(log_id)]
+        return linha.iloc[0]['obs'] if not linha.empty else ""
+
+    def _valores_baixa(self, log_id, data_real, valor_final, obs_final, resp_final, km_final, obs_anterior=None):
+        old_obs = obs_anterior if obs_anterior is not None else self._obs_carregada(log_id)
+        new_obs = f"{old_obs} | Baixa: {obs_final}" if old_obs else obs_final
+        return {4: km_final, 5: str(data_real), 7: resp_final, 8: valor_final, 9: new_obs, 10: "Concluido"}
+
+    def update_log_status(self, log_id, data_real, valor_final, obs_final, resp_final, km_final, obs_anterior=None):
+        valores = self._valores_baixa(log_id, data_real, valor_final, obs_final, resp_final, km_final, obs_anterior)
+        return self._enfileirar("update_log", f"log:{log_id}", {"log_id": str(log_id), "valores": valores})
+
+    def update_logs_status(self, baixas):
+        # Baixa em lote: baixas = [{log_id, data_real, valor_final, obs_final, resp_final, km_final,
+        # obs_anterior}]. Uma operação no journal (uma leitura de ids + um batchUpdate na planilha).
+        # Devolve (ok, ids que não existem mais no backend): esses ficam fora do lote.
+        if not baixas: return True, []
         try:
-            cell = ws.find(str(log_id), in_column=1)
-            if cell:
-                ws.update_cell(cell.row, 4, km_final)
-                ws.update_cell(cell.row, 5, str(data_real))
-                ws.update_cell(cell.row, 7, resp_final)
-                ws.update_cell(cell.row, 8, valor_final)
-                old_obs = ws.cell(cell.row, 9).value
-                new_obs = f"{old_obs} | Baixa: {obs_final}" if old_obs else obs_final
-                ws.update_cell(cell.row, 9, new_obs)
-                ws.update_cell(cell.row, 10, "Concluido")
-                carregar_dados_gerais.clear()
-        except: pass
+            faltando = self._get_repositorio().logs_inexistentes([str(b["log_id"]) for b in baixas])
+        except Exception as e:
+            # Sem como conferir agora: o worker ainda registra as que não achar
+            print(f"❌ [DEBUG] Falha ao conferir as O.S. do lote: {e}")
+            faltando = []
+        itens = [{"log_id": str(b["log_id"]), "valores": self._valores_baixa(**b)}
+                 for b in baixas if str(b["log_id"]) not in faltando]
+        if not itens: return True, faltando
+        ok = self._enfileirar("update_logs", f"baixa:{itens[0]['log_id']}-{itens[-1]['log_id']}", {"itens": itens})
+        return ok, faltando
 
     def delete_log(self, log_id):
-        sh = self._get_connection()
-        ws = self._safe_get_worksheet(sh, "maintenance_logs")
-        if not ws: return False
-        try:
-            cell = ws.find(str(log_id), in_column=1)
-            if cell: 
-                ws.delete_rows(cell.row)
-                carregar_dados_gerais.clear()
-                return True
-        except: return False
+        return self._enfileirar("delete_log", f"log:{log_id}", {"log_id": str(log_id)})
 
     def edit_log_full(self, log_id, novos_dados):
-        sh = self._get_connection()
-        ws = self._safe_get_worksheet(sh, "maintenance_logs")
-        if not ws: return False
-        try:
-            cell = ws.find(str(log_id), in_column=1)
-            if cell:
-                r = cell.row
-                ws.update_cell(r, 2, novos_dados['placa'])
-                ws.update_cell(r, 3, novos_dados['tipo'])
-                ws.update_cell(r, 4, novos_dados['km'])
-                ws.update_cell(r, 6, novos_dados['prox_km'])
-                ws.update_cell(r, 7, novos_dados['resp'])
-                ws.update_cell(r, 8, novos_dados['valor'])
-                ws.update_cell(r, 9, novos_dados['obs'])
-                carregar_dados_gerais.clear()
-                return True
-        except: return False
+        valores = {
+            2: novos_dados['placa'], 3: novos_dados['tipo'], 4: novos_dados['km'],
+            6: novos_dados['prox_km'], 7: novos_dados['resp'], 8: novos_dados['valor'], 9: novos_dados['obs']
+        }
+        return self._enfileirar("update_log", f"log:{log_id}", {"log_id": str(log_id), "valores": valores})
+
+    def _aplicar_operacao(self, operacao, payload, replay=False):
+        # Chamado pelo worker do journal (ver Repositorio.aplicar)
+        return self._get_repositorio().aplicar(operacao, payload, replay)
+
+@st.cache_resource
+def _get_write_queue():
+    # Um journal e um worker por processo, compartilhados por todas as sessões
+    caminho = os.getenv("JOURNAL_PATH") or CONFIG.get("journal", {}).get("path") or write_queue.caminho_padrao()
+    return write_queue.WriteQueue(FleetDatabase()._aplicar_operacao, repositorio.coalescer, caminho=caminho).iniciar()
 
 # --- CACHE ---
-@st.cache_data(ttl=300)
+# Fontes carregadas em paralelo: (rótulo na tela, timeout padrão em segundos)
+FONTES_CARGA = {
+    "vehicles": ("Veículos (Postgres)", 20),
+    "positions": ("Posições (Postgres)", 20),
+    "km_dia": ("Uso diário (Postgres)", 20),
+    "sheets": ("Planilha (manuais, manutenções, serviços)", 15),
+}
+
+@st.cache_resource
+def _get_pool_carga():
+    # Pool compartilhado por todas as sessões: limita quantas leituras simultâneas
+    # o processo faz no Postgres/Sheets, mesmo com muitos usuários no painel.
+    max_workers = int(os.getenv("CARGA_MAX_WORKERS", CONFIG.get("carga", {}).get("max_workers", 8)))
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="carga")
+
+def carregar_em_paralelo(tarefas, timeouts):
+    # tarefas: {nome: função sem argumentos}. Devolve (resultados, falhas) sem esperar
+    # além do timeout de cada fonte; o que estourar fica em falhas e segue em segundo plano.
+    pool = _get_pool_carga()
+    inicio = time.monotonic()
+    futuros = {nome: pool.submit(instrumentacao.cronometrar(fn, "fonte", fonte=nome)) for nome, fn in tarefas.items()}
+    resultados, falhas = {}, {}
+    for nome, fut in futuros.items():
+        restante = max(0.0, inicio + timeouts[nome] - time.monotonic())
+        try:
+            resultados[nome] = fut.result(timeout=restante)
+        except FuturesTimeout:
+            fut.cancel()
+            falhas[nome] = f"sem resposta em {timeouts[nome]:g}s"
+        except Exception as e:
+            falhas[nome] = str(e) or type(e).__name__
+    return resultados, falhas
+
+# TTL padrão por fonte (segundos); sobrescreva em config.toml [cache.ttl]. Vencido o TTL,
+# a revalidação primeiro sonda a versão da fonte (FleetDatabase.versoes) e só relê o que
+# mudou, por isso os intervalos podem ser curtos. IDADE_MAXIMA ([cache] idade_maxima):
+# releitura completa mesmo sem mudança detectada, contra sondagem que deixe passar algo.
+TTL_FONTES = {
+    "vehicles": 60,
+    "positions": 60,
+    "km_dia": 900,
+    "veiculos_manuais": 60,
+    "maintenance_logs": 60,
+    "service_types": 3600,
+}
+IDADE_MAXIMA = float(CONFIG.get("cache", {}).get("idade_maxima", 1800))
+
+class SourceCache:
+    # Cache por fonte, compartilhado pelas sessões do processo. Diferente do st.cache_data,
+    # permite corrigir o valor guardado depois de uma escrita (write-through), em vez de
+    # descartar tudo. Os valores são tratados como imutáveis: patch() troca por uma cópia.
+    def __init__(self, ttls, idade_maxima=None):
+        self._lock = threading.Lock()
+        self._ttls = dict(ttls)
+        self._idade_maxima = idade_maxima
+        self._dados = {}     # nome -> (valor, validado_em)
+        self._versoes = {}   # nome -> (versão da fonte lida antes da carga, carregado_em)
+        self._geracao = {}   # nome -> contador de escritas/invalidações
+        self._revisao = {}   # nome -> contador de trocas do valor guardado (chave de caches derivados)
+        self._snapshot = {}  # nome -> horário (epoch) do snapshot em disco que está sendo servido
+        self._revalidando = set()
+        self._falhas_revalidacao = {}  # tarefa de carga -> motivo
+
+    def get(self, nome, default=None):
+        with self._lock:
+            item = self._dados.get(nome)
+        return item[0] if item else default
+
+    def tem(self, nome):
+        with self._lock:
+            return nome in self._dados
+
+    def put_snapshot(self, nome, valor, salvo_em):
+        # Valor vindo do disco: servido na hora, mas já vencido para ser revalidado
+        with self._lock:
+            self._dados[nome] = (valor, float("-inf"))
+            self._snapshot[nome] = salvo_em
+            self._trocou(nome)
+
+    def _trocou(self, nome):
+        # Chamado com o lock: o valor de nome foi substituído
+        self._revisao[nome] = self._revisao.get(nome, 0) + 1
+
+    def revisao(self, nome):
+        with self._lock:
+            return self._revisao.get(nome, 0)
+
+    def reservar_revalidacao(self, nomes):
+        # Devolve só as fontes que ainda não estão sendo recarregadas em segundo plano
+        with self._lock:
+            livres = [n for n in nomes if n not in self._revalidando]
+            self._revalidando.update(livres)
+            return livres
+
+    def concluir_revalidacao(self, nomes, falhas):
+        with self._lock:
+            self._revalidando.difference_update(nomes)
+            self._falhas_revalidacao = dict(falhas)
+
+    def estado(self):
+        with self._lock:
+            return {
+                "snapshot": dict(self._snapshot),
+                "revalidando": set(self._revalidando),
+                "falhas": dict(self._falhas_revalidacao),
+            }
+
+    def expirados(self, nomes=None):
+        agora = time.monotonic()
+        with self._lock:
+            return [n for n in (nomes or self._ttls)
+                    if n not in self._dados or agora - self._dados[n][1] >= self._ttls.get(n, 300)]
+
+    def marca(self, nome):
+        with self._lock:
+            return self._geracao.get(nome, 0)
+
+    def put(self, nome, valor, marca=None, versao=None):
+        # marca = geração lida antes da carga. Se houve escrita no meio, o valor lido pode
+        # não conter essa escrita: guarda assim mesmo, mas já vencido, para recarregar.
+        # versao = versão da fonte sondada antes da carga (None = sem versão).
+        with self._lock:
+            vencido = marca is not None and marca != self._geracao.get(nome, 0)
+            agora = time.monotonic()
+            self._dados[nome] = (valor, float("-inf") if vencido else agora)
+            self._versoes[nome] = (versao, agora)
+            self._snapshot.pop(nome, None)
+            self._trocou(nome)
+
+    def renovar(self, nomes, versoes):
+        # Fontes cuja versão não mudou desde a carga voltam a valer por mais um TTL, sem
+        # reler. Devolve as que precisam de recarga (versão nova, desconhecida ou velha demais).
+        agora = time.monotonic()
+        recarregar = []
+        with self._lock:
+            for nome in nomes:
+                versao, carregado_em = self._versoes.get(nome, (None, None))
+                item = self._dados.get(nome)
+                igual = versao is not None and versoes.get(nome) == versao
+                jovem = carregado_em is not None and (self._idade_maxima is None or agora - carregado_em < self._idade_maxima)
+                if item is not None and item[1] != float("-inf") and igual and jovem:
+                    self._dados[nome] = (item[0], agora)
+                else:
+                    recarregar.append(nome)
+        return recarregar
+
+    def patch(self, nome, fn):
+        with self._lock:
+            self._geracao[nome] = self._geracao.get(nome, 0) + 1
+            item = self._dados.get(nome)
+            if item is None: return
+            self._trocou(nome)
+            try:
+                self._dados[nome] = (fn(item[0]), item[1])
+            except Exception as e:
+                print(f"❌ [DEBUG] Falha no write-through de {nome}, descartando cache: {e}")
+                del self._dados[nome]
+
+    def invalidate(self, nomes=None):
+        with self._lock:
+            for n in (nomes or list(self._dados)):
+                self._geracao[n] = self._geracao.get(n, 0) + 1
+                self._trocou(n)
+                self._dados.pop(n, None)
+                self._versoes.pop(n, None)
+                self._snapshot.pop(n, None)
+
+@st.cache_resource
+def _get_cache_fontes():
+    ttls = {**TTL_FONTES, **CONFIG.get("cache", {}).get("ttl", {})}
+    cache = SourceCache(ttls, IDADE_MAXIMA)
+    # Partida a frio: começa com o último snapshot bom do disco (se houver)
+    snapshot = {nome: item for nome, item in snapshot_store.carregar().items() if nome in ttls}
+    valores = _com_escritas_pendentes(FleetDatabase(), {nome: valor for nome, (valor, _) in snapshot.items()})
+    for nome, (_, salvo_em) in snapshot.items():
+        cache.put_snapshot(nome, valores[nome], salvo_em)
+    return cache
+
+def _escritas_pendentes():
+    try:
+        return _get_write_queue().pendentes()
+    except Exception as e:
+        print(f"❌ [DEBUG] Falha ao ler o journal de escritas: {e}")
+        return []
+
+def _com_escritas_pendentes(db, valores, lidas_antes=()):
+    # Reaplica sobre dados recém-lidos as escritas que o worker ainda não gravou na planilha,
+    # para uma recarga (ou o snapshot) não desfazer o que o usuário acabou de salvar.
+    # lidas_antes: pendentes no início da carga (o worker pode ter gravado alguma no meio
+    # da leitura); reaplicar uma escrita já gravada não muda nada.
+    pendentes = {e["seq"]: e for e in list(lidas_antes) + _escritas_pendentes()}
+    valores = dict(valores)
+    for _, entrada in sorted(pendentes.items()):
+        nome, efeito = db._efeito(entrada["operacao"], entrada["payload"])
+        if nome in valores:
+            try:
+                valores[nome] = efeito(valores[nome])
+            except Exception as e:
+                print(f"❌ [DEBUG] Falha ao reaplicar escrita pendente {entrada['seq']}: {e}")
+    return valores
+
+@st.cache_resource
+def _get_pool_revalidacao():
+    # Uma revalidação por vez; as leituras em si vão para o pool de carga
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="revalidacao")
+
+def _recarregar_fontes(db_temp, cache, nomes, sondar=False):
+    # Busca as fontes pedidas (Sheets vencidas juntas num único batchGet), guarda no cache
+    # e no snapshot em disco. Devolve as falhas por tarefa de carga.
+    # sondar=True (revalidação): antes, consulta a versão de cada fonte e só relê as que
+    # mudaram; as demais são renovadas. A versão é lida antes da carga: mudança no meio
+    # da leitura aparece como versão nova na próxima sondagem (relê de novo, nunca perde).
+    versoes = {}
+    if sondar:
+        with instrumentacao.span("sondagem"):
+            versoes = db_temp.versoes(nomes)
+        mudaram = cache.renovar(nomes, versoes)
+        for nome in nomes:
+            instrumentacao.contar("sondagem", fonte=nome, resultado="mudou" if nome in mudaram else "igual")
+        nomes = mudaram
+    marcas = {nome: cache.marca(nome) for nome in nomes}
+    pendentes_antes = _escritas_pendentes()
+    tarefas = {}
+    for nome in ("vehicles", "positions", "km_dia"):
+        if nome in nomes:
+            tarefas[nome] = lambda nome=nome: db_temp.get_dataframe(nome, strict=True)
+    sheets_vencidas = tuple(n for n in SHEETS_LEITURA if n in nomes)
+    if sheets_vencidas:
+        tarefas["sheets"] = lambda: db_temp.get_sheets_batch(sheets_vencidas, strict=True)
+    if not tarefas:
+        return {}
+
+    cfg_timeouts = CONFIG.get("carga", {}).get("timeouts", {})
+    timeouts = {nome: float(cfg_timeouts.get(nome, padrao)) for nome, (_, padrao) in FONTES_CARGA.items()}
+    resultados, falhas = carregar_em_paralelo(tarefas, timeouts)
+    novos = {**resultados.pop("sheets", {}), **resultados}
+    for nome, valor in novos.items():
+        instrumentacao.valor("linhas", len(valor), fonte=nome)
+    snapshot_store.salvar(novos)
+    for nome, valor in _com_escritas_pendentes(db_temp, novos, pendentes_antes).items():
+        cache.put(nome, valor, marcas[nome], versoes.get(nome))
+    # Fonte que falhou não entra no cache: continua vencida e a próxima execução tenta de novo.
+    # Enquanto isso, se houver, segue servindo o último valor bom.
+    for nome, motivo in falhas.items():
+        print(f"❌ [DEBUG] Falha ao carregar {nome}: {motivo}")
+    return falhas
+
+def _revalidar(nomes):
+    cache = _get_cache_fontes()
+    falhas = {}
+    try:
+        falhas = _recarregar_fontes(FleetDatabase(), cache, nomes, sondar=True)
+    except Exception as e:
+        falhas = {"revalidacao": str(e)}
+    finally:
+        cache.concluir_revalidacao(nomes, falhas)
+
 def carregar_dados_gerais():
+    # Stale-while-revalidate: fonte vencida que já tem valor (inclusive o snapshot do disco)
+    # é servida na hora e recarregada em segundo plano; só bloqueia quem não tem valor nenhum.
     db_temp = FleetDatabase()
+    cache = _get_cache_fontes()
+    vencidas = cache.expirados()
+    sem_valor = [n for n in vencidas if not cache.tem(n)]
+    # hit = valor válido; stale = servido vencido e revalidado em segundo plano; miss = bloqueia na carga
+    for nome in TTL_FONTES:
+        resultado = "miss" if nome in sem_valor else "stale" if nome in vencidas else "hit"
+        instrumentacao.contar("cache", fonte=nome, resultado=resultado)
+    falhas = _recarregar_fontes(db_temp, cache, sem_valor) if sem_valor else {}
+
+    a_revalidar = cache.reservar_revalidacao([n for n in vencidas if n not in sem_valor])
+    if a_revalidar:
+        _get_pool_revalidacao().submit(_revalidar, a_revalidar)
+    falhas = {**cache.estado()["falhas"], **falhas}
+
     return (
-        db_temp.get_dataframe("vehicles"),
-        db_temp.get_dataframe("positions"),
-        db_temp.get_dataframe("veiculos_manuais"),
-        db_temp.get_dataframe("maintenance_logs"),
-        db_temp.get_services_list()
+        cache.get("vehicles", pd.DataFrame()),
+        cache.get("positions", pd.DataFrame()),
+        cache.get("veiculos_manuais", pd.DataFrame()),
+        cache.get("maintenance_logs", pd.DataFrame(columns=db_temp.log_cols)),
+        cache.get("service_types", db_temp.default_services),
+        cache.get("km_dia", pd.DataFrame()),
+        falhas
     )
 
+# Histórico: só a página e os agregados vão para o navegador. Guardados por filtro até o
+# maintenance_logs em memória mudar (revisão do SourceCache, a cada recarga/escrita) ou a
+# fila de escritas andar; o TTL cobre o que outra instância gravou no Postgres.
+TTL_HISTORICO = int(CONFIG.get("cache", {}).get("ttl_historico", 120))
+
+def _versao_historico():
+    return _get_cache_fontes().revisao("maintenance_logs"), len(_escritas_pendentes())
+
+@st.cache_data(ttl=TTL_HISTORICO, max_entries=64, show_spinner=False)
+def _pagina_historico(filtros, limite, deslocamento, versao, _df_logs):
+    with instrumentacao.span("historico", parte="pagina"):
+        return FleetDatabase().historico(_df_logs, filtros, limite, deslocamento)
+
+@st.cache_data(ttl=TTL_HISTORICO, max_entries=64, show_spinner=False)
+def _agregados_historico(filtros, versao, _df_logs):
+    with instrumentacao.span("historico", parte="agregados"):
+        return FleetDatabase().agregados_historico(_df_logs, filtros)
+
 # --- 4. APP PRINCIPAL ---
+@st.fragment(run_every=2)
+def _aviso_snapshot():
+    # Enquanto houver dado vindo do snapshot em disco, marca a tela como desatualizada e
+    # confere a cada 2s; quando a revalidação termina bem, recarrega a página inteira.
+    estado = _get_cache_fontes().estado()
+    if not estado["snapshot"]:
+        st.rerun()
+    salvo = datetime.fromtimestamp(min(estado["snapshot"].values()))
+    if estado["revalidando"]:
+        st.info(f"🕒 Exibindo dados salvos em {salvo:%d/%m %H:%M} — atualizando em segundo plano...")
+    else:
+        motivos = ", ".join(f"{FONTES_CARGA.get(n, (n,))[0]} ({m})" for n, m in estado["falhas"].items())
+        st.warning(f"⚠️ Dados desatualizados (salvos em {salvo:%d/%m %H:%M}). Falha ao atualizar: {motivos or 'desconhecida'}. Clique em Atualizar para tentar de novo.")
+
+@st.fragment(run_every=3)
+def _indicador_escritas():
+    # Enquanto houver escrita na fila, mostra quantas faltam gravar na planilha e confere a
+    # cada 3s; quando a fila esvazia, recarrega a página (e o indicador some).
+    resumo = _get_write_queue().resumo()
+    if not resumo["pendentes"]:
+        st.rerun()
+    msg = f"⏳ {resumo['pendentes']} alteração(ões) aguardando gravação na planilha"
+    if resumo["ultimo_erro"]:
+        msg += f" — nova tentativa em {resumo['proxima_tentativa_s']:.0f}s ({resumo['ultimo_erro']})"
+    st.caption(msg)
+
+def _escritas_com_erro():
+    # Operações que o worker desistiu de gravar (ex.: O.S. excluída por outra pessoa)
+    fila = _get_write_queue()
+    erros = fila.erros()
+    if not erros: return
+    with st.expander(f"❌ {len(erros)} alteração(ões) não gravada(s)", expanded=True):
+        for e in erros:
+            st.caption(f"{e['operacao']} {e['chave']} — {e['ultimo_erro']}")
+            c1, c2 = st.columns(2)
+            if c1.button("Tentar de novo", key=f"wq_retry_{e['seq']}"):
+                fila.tentar_de_novo(e["seq"]); st.rerun()
+            if c2.button("Descartar", key=f"wq_drop_{e['seq']}"):
+                fila.descartar(e["seq"])
+                # O cache ainda mostra a alteração descartada: recarrega da planilha
+                _get_cache_fontes().invalidate(["veiculos_manuais", "maintenance_logs"])
+                st.rerun()
+
+def _avisar(msg):
+    # Toast que sobrevive ao st.rerun() seguinte (exibido no início de main)
+    st.session_state["_aviso"] = msg
+
+# Classe CSS, ícone e cor da borda de cada status de prazo
+ESTILO_STATUS = {
+    fleet_state.VENCIDO: ("status-vencido", "🚨", "#d9534f"),
+    fleet_state.ATENCAO: ("status-atencao", "⚠️", "#f0ad4e"),
+    fleet_state.NO_PRAZO: ("status-ok", "🟢", "#5cb85c"),
+}
+
+def _stats_sheets():
+    # Só se o cliente da planilha já foi carregado: o painel não força o import do gspread
+    modulo = sys.modules.get("sheets_client")
+    return modulo.stats() if modulo else None
+
+def _extras_metricas(db):
+    # Estado do pool, da cota do Sheets e da fila de escrita, junto das medições exportadas
+    extras = {"sheets": _stats_sheets() or {}}
+    engine = db._get_pg_engine(criar=False)
+    if engine is not None:
+        extras["pg_pool"] = pg_engine.pool_stats(engine)
+    try:
+        extras["journal"] = _get_write_queue().resumo()
+    except Exception as e:
+        print(f"❌ [DEBUG] Falha ao ler o journal de escritas: {e}")
+    return extras
+
+def _painel_desempenho(db):
+    # Onde vai o tempo, medido pelo próprio processo (instrumentacao); não abre conexão nova
+    with st.expander("📊 Desempenho"):
+        engine = db._get_pg_engine(criar=False)
+        if _config_banco()[0] is None:
+            st.error("❌ Postgres não configurado. Verifique logs/console.")
+        elif engine is None:
+            st.caption("Pool: ainda não aberto")
+        else:
+            stats = pg_engine.pool_stats(engine)
+            st.caption(
+                f"Pool: {stats.get('checkedout', 0)} em uso / {stats.get('size', 0)} | "
+                f"overflow {stats.get('overflow', 0)} | "
+                f"espera média {stats.get('espera_media_ms', 0)} ms (máx {1000 * stats.get('espera_max_s', 0):.0f} ms) | "
+                f"conexões abertas {stats.get('conexoes_abertas', 0)} ({stats.get('conexoes_invalidas', 0)} inválidas)"
+            )
+        sh_stats = _stats_sheets()
+        if sh_stats is None:
+            st.caption("Sheets: cliente ainda não carregado")
+        else:
+            st.caption(
+                f"Sheets: {sh_stats['chamadas']} chamadas | {sh_stats['novas_tentativas']} novas tentativas "
+                f"({sh_stats['erros_429']}× 429, {sh_stats['erros_5xx']}× 5xx) | {sh_stats['falhas']} falhas | "
+                f"segurado pelo limitador {sh_stats['espera_limitador_s']:.1f}s, backoff {sh_stats['espera_backoff_s']:.1f}s"
+            )
+
+        spans = instrumentacao.resumo_spans()
+        if spans:
+            st.dataframe(pd.DataFrame([{
+                "trecho": s["span"], "detalhe": ", ".join(str(v) for v in s["rotulos"].values()),
+                "n": s["contagem"], "p50 ms": round(s["p50_ms"], 1), "p95 ms": round(s["p95_ms"], 1),
+                "máx ms": round(s["max_ms"], 1), "erros": s["erros"],
+            } for s in spans]), hide_index=True, use_container_width=True)
+
+        cache = {}
+        for c in instrumentacao.contadores():
+            if c["nome"] in ("cache", "sondagem"):
+                cache.setdefault(c["rotulos"]["fonte"], {})[c["rotulos"]["resultado"]] = c["valor"]
+        linhas = {v["rotulos"].get("fonte"): v["valor"] for v in instrumentacao.valores() if v["nome"] == "linhas"}
+        if cache or linhas:
+            st.dataframe(pd.DataFrame([{
+                "fonte": nome, "hit": cache.get(nome, {}).get("hit", 0), "stale": cache.get(nome, {}).get("stale", 0),
+                "miss": cache.get(nome, {}).get("miss", 0), "sem mudança": cache.get(nome, {}).get("igual", 0),
+                "relida": cache.get(nome, {}).get("mudou", 0), "linhas": linhas.get(nome),
+            } for nome in sorted(set(cache) | set(linhas))]), hide_index=True, use_container_width=True)
+
+        c1, c2 = st.columns(2)
+        c1.download_button("JSON", data=lambda: instrumentacao.exportar_json(_extras_metricas(db)),
+                           file_name="frota_metricas.json", mime="application/json", use_container_width=True)
+        c2.download_button("Prometheus", data=lambda: instrumentacao.exportar_prometheus(_extras_metricas(db)),
+                           file_name="frota_metricas.prom", mime="text/plain", use_container_width=True)
+
+@st.cache_resource(show_spinner=False)
+def _estado_partida():
+    return {"fria": True, "lock": threading.Lock()}
+
+def _registrar_partida():
+    # Partida medida pelo próprio script: "imports" (módulos + configuração) e "script" (do
+    # início à última fase do render). A 1ª execução do processo é a fria (tempo até a primeira
+    # tela, sem o boot do servidor); as quentes mostram o custo fixo de cada rerun.
+    estado = _estado_partida()
+    with estado["lock"]:
+        execucao = "fria" if estado["fria"] else "quente"
+        estado["fria"] = False
+    instrumentacao.registrar_span("partida", _T_IMPORTS, fase="imports", execucao=execucao)
+    instrumentacao.registrar_span("partida", time.perf_counter() - _T0, fase="script", execucao=execucao)
+
 def main():
     db = FleetDatabase()
+    render = instrumentacao.Cronometro("render")
+    if "_aviso" in st.session_state:
+        st.toast(st.session_state.pop("_aviso"))
     
     with st.sidebar:
         st.header("Gestão de Frota")
         st.caption("🔄 Sincronização automática via GitHub")
         
         if st.button("Atualizar Tela (F5)", use_container_width=True):
-            carregar_dados_gerais.clear()
+            _get_cache_fontes().invalidate()
             st.rerun()
             
+        if _get_write_queue().resumo()["pendentes"]:
+            _indicador_escritas()
+        _escritas_com_erro()
         st.divider()
         
-        df_v_sascar, df_pos_sascar, df_v_manual, df_logs, lista_servicos_db = carregar_dados_gerais()
+        df_v_sascar, df_pos_sascar, df_v_manual, df_logs, lista_servicos_db, df_km_dia, fontes_falhas = carregar_dados_gerais()
+        render.fase("dados")
 
         with st.expander("🚗 Atualizar KM Manual", expanded=True):
             lista_manuais = df_v_manual['placa'].tolist() if not df_v_manual.empty else []
@@ -344,90 +855,162 @@ def main():
                     if novo_km_manual is None:
                         st.error("Digite o valor.")
                     elif db.update_manual_km(placa_manual, novo_km_manual):
-                        st.success("Atualizado!")
-                        time.sleep(1); st.rerun()
+                        _avisar("✅ KM atualizado!"); st.rerun()
+                    else:
+                        st.error("❌ Falha ao salvar o KM. Tente novamente.")
             
             with st.popover("➕ Cadastrar Novo Manual"):
                 novo_placa = st.text_input("Nova Placa")
                 novo_km_ini = st.number_input("KM Inicial", value=0.0)
                 if st.button("Criar"):
                     if db.update_manual_km(novo_placa, novo_km_ini):
-                        st.success("Criado!"); time.sleep(1); st.rerun()
+                        _avisar("✅ Veículo manual criado!"); st.rerun()
+                    st.error("❌ Falha ao criar. Tente novamente.")
 
     st.title("🚛 Painel de Controle")
+    if _get_cache_fontes().estado()["snapshot"]:
+        _aviso_snapshot()
+    elif fontes_falhas:
+        faltando = ", ".join(f"{FONTES_CARGA.get(nome, (nome,))[0]} ({motivo})" for nome, motivo in fontes_falhas.items())
+        st.warning(f"⚠️ Dados parciais — fontes indisponíveis: {faltando}. Clique em Atualizar para tentar de novo.")
 
-    # --- PROCESSAMENTO ---
-    mapa_km_total = {}
-
-    # --- DEBUG INCONDICIONAL ---
     with st.sidebar:
         st.divider()
-        st.write("🐞 DEBUG CHECK")
-        
-        # Testar conexão diretamente para exibir erro se houver
-        # db._get_pg_engine() retorna um engine, não uma conexão raw
-        engine_test = db._get_pg_engine()
-        if engine_test is None:
-            st.error("❌ FALHA CONEXÃO POSTGRES! Verifique logs/console.")
-        else:
-            try:
-                with engine_test.connect() as conn:
-                    st.success("✅ Conexão DB OK")
-            except Exception as e:
-                st.error(f"❌ Erro ao conectar: {e}")
-        
-
-
-        st.write(f"Veículos (DB): {len(df_v_sascar)}")
-        st.write(f"Posições (DB): {len(df_pos_sascar)}")
-        st.write(f"Manuais: {len(df_v_manual)}")
-        
-
-    # ---------------------------
-
-    if not df_v_sascar.empty:
-        # Agora o odômetro já vem na query de veículos (join)
-        for _, row in df_v_sascar.iterrows():
-            if pd.notna(row.get('odometro')):
-                mapa_km_total[row['placa']] = row['odometro']
-    
-    # Manuais sobrescrevem automaticos
-    if not df_v_manual.empty:
-        for _, row in df_v_manual.iterrows():
-             mapa_km_total[row['placa']] = float(row['odometro'])
+        _painel_desempenho(db)
+    render.fase("sidebar")
 
-    todas_placas = list(mapa_km_total.keys())
-    todas_placas.sort()
+    # --- PROCESSAMENTO ---
+    # KM atual por placa (telemetria, com manuais sobrescrevendo) e situação das pendências
+    mapa_km_total = fleet_state.mapa_km_total(df_v_sascar, df_v_manual)
+    todas_placas = mapa_km_total.index.tolist()
 
     tab_pend, tab_novo, tab_hist = st.tabs(["🚦 Pendências", "➕ Novo Lançamento", "📚 Histórico"])
 
     # --- ABA 1: PENDÊNCIAS (GRID) ---
     with tab_pend:
         if not df_logs.empty and 'status' in df_logs.columns:
-            pendentes = df_logs[df_logs['status'] != 'Concluido'].copy()
+            pendentes = fleet_state.calcular_pendencias(df_logs, mapa_km_total)
+            # Data prevista de cada ordem pelo KM/dia recente do veículo (rollup odometro_diario)
+            hoje = configuracao.hoje()
+            km_dia = fleet_state.mapa_km_dia(df_v_sascar, df_km_dia)
+            pendentes = fleet_state.projetar_vencimento(pendentes, km_dia, hoje)
             if not pendentes.empty:
-                pendentes['km_restante'] = pd.to_numeric(pendentes['proxima_km'], errors='coerce') - pendentes['placa'].map(mapa_km_total).fillna(0)
-                pendentes = pendentes.sort_values('km_restante')
+                # FILTROS
+                f1, f2, f3, f4 = st.columns(4)
+                f_status = f1.multiselect("Status", fleet_state.NIVEIS_STATUS, key="pend_f_status")
+                f_placas = f2.multiselect("Placa", sorted(pendentes['placa'].astype(str).unique()), key="pend_f_placa")
+                f_servs = f3.multiselect("Serviço", sorted(pendentes['tipo_servico'].astype(str).unique()), key="pend_f_serv")
+                f_resps = f4.multiselect("Responsável", sorted(pendentes['responsavel'].astype(str).unique()), key="pend_f_resp")
+                filtradas = fleet_state.filtrar_pendencias(pendentes, status=f_status, placas=f_placas, servicos=f_servs, responsaveis=f_resps)
+                o1, o2 = st.columns([1, 3])
+                ordem = o1.selectbox("Ordenar por", ["Urgência (KM)", "Data prevista"], key="pend_ordem")
+                if ordem == "Data prevista":
+                    filtradas = filtradas.sort_values(["data_prevista", "km_restante"], na_position="last", kind="stable")
+                proximas = filtradas[filtradas["dias_restantes"].between(0, fleet_state.LIMITE_ALERTA_DIAS)]
+                if not proximas.empty:
+                    o2.warning(f"⏰ {len(proximas)} ordem(ns) devem vencer nos próximos {fleet_state.LIMITE_ALERTA_DIAS} dias.")
+
+                # PAGINAÇÃO
+                total = len(filtradas)
+                p1, p2, p3 = st.columns([1, 1, 3])
+                por_pagina = p1.selectbox("Por página", [12, 24, 48, 96], key="pend_por_pagina")
+                n_paginas = max(1, -(-total // por_pagina))
+                if st.session_state.get("pend_pagina", 1) > n_paginas:
+                    st.session_state["pend_pagina"] = n_paginas
+                pagina = p2.number_input("Página", min_value=1, max_value=n_paginas, step=1, key="pend_pagina")
+                ini = (pagina - 1) * por_pagina
+                pagina_df = filtradas.iloc[ini:ini + por_pagina]
+                contagem = fleet_state.resumo_status(filtradas)
+                p3.caption(
+                    f"{ini + 1 if total else 0}–{ini + len(pagina_df)} de {total} pendências  |  "
+                    + "  ".join(f"{ESTILO_STATUS[nivel][1]} {qtd}" for nivel, qtd in contagem.items())
+                )
+                if pagina_df.empty:
+                    st.info("Nenhuma pendência com esses filtros.")
+
+                # BAIXA EM LOTE (O.S. filtradas; uma gravação só na planilha). Só monta a lista
+                # de O.S. quando ligada: desligada, o rerun continua custando só a página.
+                if st.toggle("✅ Baixa em lote", key="bx_lote_on"):
+                    if st.session_state.get("bx_lote_faltando"):
+                        faltando = st.session_state.pop("bx_lote_faltando")
+                        st.warning(f"⚠️ O.S. não encontradas (excluídas em outra sessão?), ficaram sem baixa: "
+                                   f"{', '.join(f'#{i}' for i in faltando)}")
+                    rotulos = {f"{r.placa} — {r.tipo_servico} (#{r.id})": str(r.id) for r in filtradas.itertuples()}
+                    escolhidas = st.multiselect("O.S.", list(rotulos), key="bx_lote_os")
+                    if escolhidas:
+                        sel = filtradas[filtradas['id'].astype(str).isin([rotulos[r] for r in escolhidas])]
+                        tab_bx = pd.DataFrame({"id": sel['id'].astype(str), "placa": sel['placa'].astype(str),
+                                               "servico": sel['tipo_servico'].astype(str),
+                                               "km": sel['placa'].astype(str).map(mapa_km_total), "valor": 0.0})
+                        # KM realizado começa no KM atual de cada veículo (vazio se não há leitura:
+                        # km_atual das pendências vira 0); KM e valor editáveis por O.S.
+                        tab_bx = st.data_editor(tab_bx, key=f"bx_lote_tab_{hash(tuple(tab_bx['id']))}", hide_index=True,
+                                                use_container_width=True, disabled=["id", "placa", "servico"],
+                                                column_config={"km": st.column_config.NumberColumn("KM realizado", format="%.0f"),
+                                                               "valor": st.column_config.NumberColumn("Valor (R$)", format="%.2f")})
+                        b1, b2, b3 = st.columns(3)
+                        bx_data = b1.date_input("Data Real", configuracao.hoje(), key="bx_lote_data")
+                        bx_resp = b2.text_input("Responsável", placeholder="Mantém o de cada O.S.", key="bx_lote_resp")
+                        bx_obs = b3.text_input("Obs", key="bx_lote_obs")
+                        bx_reag = st.checkbox("🔄 Reagendar as próximas?", key="bx_lote_reag")
+                        bx_int = st.number_input("Intervalo (KM)", value=None, placeholder="Digite o intervalo...", step=1000.0, key="bx_lote_int") if bx_reag else None
+                        if st.button(f"Concluir {len(tab_bx)} O.S.", key="bx_lote_ok"):
+                            if tab_bx['km'].isna().any():
+                                st.error(f"Informe o KM realizado de: {', '.join(tab_bx[tab_bx['km'].isna()]['placa'])}")
+                            elif bx_reag and bx_int is None:
+                                st.error("Preencha o Intervalo!")
+                            else:
+                                obs_por_id = dict(zip(sel['id'].astype(str), sel['obs']))
+                                resp_por_id = dict(zip(sel['id'].astype(str), sel['responsavel']))
+                                baixas = [{"log_id": r.id, "data_real": bx_data, "valor_final": 0.0 if pd.isna(r.valor) else float(r.valor),
+                                           "obs_final": bx_obs, "resp_final": bx_resp or resp_por_id.get(r.id, ""),
+                                           "km_final": float(r.km), "obs_anterior": obs_por_id.get(r.id, "")}
+                                          for r in tab_bx.itertuples(index=False)]
+                                ok, faltando = db.update_logs_status(baixas)
+                                baixas = [b for b in baixas if str(b["log_id"]) not in faltando]
+                                if not ok:
+                                    st.error("❌ Falha ao salvar as baixas. Tente novamente.")
+                                elif not baixas:
+                                    st.warning(f"⚠️ Nenhuma das O.S. foi encontrada (excluídas em outra sessão?): "
+                                               f"{', '.join(f'#{i}' for i in faltando)}")
+                                else:
+                                    # Aviso exibido depois do rerun, no topo da baixa em lote
+                                    if faltando: st.session_state["bx_lote_faltando"] = faltando
+                                    if bx_reag:
+                                        novas = [{"placa": r.placa, "tipo": r.servico, "km": "", "data": "", "prox_km": float(r.km) + bx_int,
+                                                  "valor": 0, "obs": "Reagendamento automático na baixa.",
+                                                  "resp": bx_resp or resp_por_id.get(r.id, ""), "status": "Agendado"}
+                                                 for r in tab_bx.itertuples(index=False) if str(r.id) not in faltando]
+                                        if db.add_logs(novas):
+                                            _avisar(f"✅ {len(baixas)} O.S. baixadas e reagendadas!")
+                                        else:
+                                            _avisar("⚠️ O.S. baixadas, mas o reagendamento falhou. Lance as próximas manualmente.")
+                                    else:
+                                        _avisar(f"✅ {len(baixas)} O.S. baixadas!")
+                                    st.rerun()
 
                 # GRID 3 POR LINHA
                 cols_num = 3
-                rows = [pendentes.iloc[i:i+cols_num] for i in range(0, len(pendentes), cols_num)]
+                rows = [pagina_df.iloc[i:i+cols_num] for i in range(0, len(pagina_df), cols_num)]
 
                 for row_chunk in rows:
                     cols = st.columns(cols_num)
                     for idx, (index, row) in enumerate(row_chunk.iterrows()):
                         with cols[idx]: 
                             placa = row['placa']
-                            km_atual = float(mapa_km_total.get(placa, 0))
-                            meta_km = float(row['proxima_km']) if row['proxima_km'] != '' else 0
-                            restante = meta_km - km_atual
-                            
-                            if restante < 0:
-                                s_cls = "status-vencido"; s_txt = f"🚨 VENCIDO ({abs(restante):,.0f} KM)"; b_col = "#d9534f"
-                            elif restante < 3000:
-                                s_cls = "status-atencao"; s_txt = f"⚠️ ATENÇÃO ({restante:,.0f} KM)"; b_col = "#f0ad4e"
+                            km_atual = row['km_atual']
+                            meta_km = row['meta_km']
+                            restante = row['km_restante']
+                            s_cls, s_icon, b_col = ESTILO_STATUS[row['status_prazo']]
+                            s_txt = f"{s_icon} {row['status_prazo']} ({abs(restante):,.0f} KM)"
+                            dias = row['dias_restantes']
+                            if pd.isna(dias):
+                                previsao = "Previsão: sem telemetria de uso"
+                            elif dias < 0:
+                                previsao = f"Previsão: venceu ~{row['data_prevista']:%d/%m/%Y}"
                             else:
-                                s_cls = "status-ok"; s_txt = f"🟢 NO PRAZO ({restante:,.0f} KM)"; b_col = "#5cb85c"
+                                alerta = "⏰ " if dias <= fleet_state.LIMITE_ALERTA_DIAS else ""
+                                previsao = f"{alerta}Previsão: {row['data_prevista']:%d/%m/%Y} (em {dias:.0f} dias, {row['km_dia']:,.0f} KM/dia)"
 
                             st.markdown(f"""
                             <div class="status-card" style="border-left: 5px solid {b_col}">
@@ -438,72 +1021,86 @@ def main():
                                 <div style="margin: 5px 0;"><b>{row['tipo_servico']}</b></div>
                                 <div class="meta-info">Resp: {row['responsavel']}</div>
                                 <div class="meta-info">Meta: {meta_km:,.0f} | Atual: {km_atual:,.0f}</div>
+                                <div class="meta-info">{previsao}</div>
                             </div>
                             """, unsafe_allow_html=True)
                             
-                            # BOX DE BAIXA LIMPO
-                            with st.expander("✅ Baixar O.S."):
-                                with st.form(key=f"bx_{row['id']}"):
-                                    # value=None deixa o campo VAZIO
-                                    km_real_bx = st.number_input("KM Realizado (Painel)", value=None, placeholder="Digite o KM...", step=100.0)
-                                    dt_bx = st.date_input("Data Real", datetime.now() - timedelta(hours=3))
-                                    vl_bx = st.number_input("Valor R$", value=None, placeholder="0.00", step=10.0)
-                                    resp_bx = st.text_input("Responsável", value=row['responsavel']) 
-                                    obs_bx = st.text_input("Obs")
+                            # Formulários só para o card aberto: o custo do rerun não cresce com o backlog
+                            aberta = st.session_state.get("pend_aberta") == str(row['id'])
+                            if st.button("✖️ Fechar" if aberta else "⚙️ Ações", key=f"abrir_{row['id']}", use_container_width=True):
+                                st.session_state["pend_aberta"] = None if aberta else str(row['id'])
+                                st.rerun()
+                            if aberta:
+                                # BOX DE BAIXA LIMPO
+                                with st.expander("✅ Baixar O.S."):
+                                    with st.form(key=f"bx_{row['id']}"):
+                                        # value=None deixa o campo VAZIO
+                                        km_real_bx = st.number_input("KM Realizado (Painel)", value=None, placeholder="Digite o KM...", step=100.0)
+                                        dt_bx = st.date_input("Data Real", configuracao.hoje())
+                                        vl_bx = st.number_input("Valor R$", value=None, placeholder="0.00", step=10.0)
+                                        resp_bx = st.text_input("Responsável", value=row['responsavel']) 
+                                        obs_bx = st.text_input("Obs")
                                     
-                                    st.divider()
-                                    reagendar_bx = st.checkbox(f"🔄 Reagendar próxima?")
+                                        st.divider()
+                                        reagendar_bx = st.checkbox(f"🔄 Reagendar próxima?")
                                     
-                                    intervalo_final = None
-                                    if reagendar_bx:
-                                        intervalo_final = st.number_input("Intervalo (KM)", value=None, placeholder="Digite o intervalo...", step=1000.0)
+                                        intervalo_final = None
+                                        if reagendar_bx:
+                                            intervalo_final = st.number_input("Intervalo (KM)", value=None, placeholder="Digite o intervalo...", step=1000.0)
                                     
-                                    if st.form_submit_button("Concluir"):
-                                        if km_real_bx is None:
-                                            st.error("Digite o KM Realizado!")
-                                        else:
-                                            # Se valor for None vira 0.0 para salvar
-                                            val_save = vl_bx if vl_bx is not None else 0.0
-                                            db.update_log_status(row['id'], dt_bx, val_save, obs_bx, resp_bx, km_real_bx)
-                                            
-                                            if reagendar_bx:
-                                                if intervalo_final is None:
-                                                    st.warning("Intervalo não preenchido. Agendamento ignorado.")
-                                                else:
-                                                    nova_meta = km_real_bx + intervalo_final
-                                                    dados_reagendamento = {
-                                                        "placa": placa, "tipo": row['tipo_servico'], "km": "", "data": "",
-                                                        "prox_km": nova_meta, "valor": 0, "obs": "Reagendamento automático na baixa.",
-                                                        "resp": resp_bx, "status": "Agendado"
-                                                    }
-                                                    db.add_log(dados_reagendamento)
-                                                    st.toast(f"✅ Baixado e reagendado para {nova_meta:,.0f} KM!")
+                                        if st.form_submit_button("Concluir"):
+                                            if km_real_bx is None:
+                                                st.error("Digite o KM Realizado!")
                                             else:
-                                                st.toast("✅ O.S. Baixada com sucesso!")
-                                            time.sleep(1); st.rerun()
-
-                            with st.expander("✏️ Editar"):
-                                with st.form(key=f"ed_{row['id']}"):
-                                    e_placa = st.selectbox("Placa", todas_placas, index=todas_placas.index(row['placa']) if row['placa'] in todas_placas else 0)
-                                    idx_serv = 0
-                                    if row['tipo_servico'] in lista_servicos_db:
-                                        idx_serv = lista_servicos_db.index(row['tipo_servico'])
-                                    e_tipo = st.selectbox("Serviço", lista_servicos_db, index=idx_serv)
-                                    e_resp = st.text_input("Resp", value=row['responsavel'])
-                                    e_km = st.number_input("KM Base", value=float(row['km_realizada']) if row['km_realizada'] else 0.0)
-                                    e_prox = st.number_input("Meta KM", value=float(row['proxima_km']) if row['proxima_km'] else 0.0)
-                                    e_val = st.number_input("Valor", value=float(row['valor']) if row['valor'] else 0.0)
-                                    e_obs = st.text_area("Obs", value=row['obs'])
-                                    if st.form_submit_button("Salvar"):
-                                        novos = {'placa':e_placa, 'tipo':e_tipo, 'resp':e_resp, 'km':e_km, 'prox_km':e_prox, 'valor':e_val, 'obs':e_obs}
-                                        db.edit_log_full(row['id'], novos)
-                                        st.rerun()
+                                                # Se valor for None vira 0.0 para salvar
+                                                val_save = vl_bx if vl_bx is not None else 0.0
+                                                if not db.update_log_status(row['id'], dt_bx, val_save, obs_bx, resp_bx, km_real_bx, obs_anterior=row['obs']):
+                                                    st.error("❌ Falha ao salvar a baixa na planilha. Tente novamente.")
+                                                else:
+                                                    if reagendar_bx:
+                                                        if intervalo_final is None:
+                                                            st.warning("Intervalo não preenchido. Agendamento ignorado.")
+                                                        else:
+                                                            nova_meta = km_real_bx + intervalo_final
+                                                            dados_reagendamento = {
+                                                                "placa": placa, "tipo": row['tipo_servico'], "km": "", "data": "",
+                                                                "prox_km": nova_meta, "valor": 0, "obs": "Reagendamento automático na baixa.",
+                                                                "resp": resp_bx, "status": "Agendado"
+                                                            }
+                                                            if db.add_log(dados_reagendamento):
+                                                                _avisar(f"✅ Baixado e reagendado para {nova_meta:,.0f} KM!")
+                                                            else:
+                                                                _avisar("⚠️ O.S. baixada, mas o reagendamento falhou. Lance a próxima manualmente.")
+                                                    else:
+                                                        _avisar("✅ O.S. Baixada com sucesso!")
+                                                    st.rerun()
+
+                                with st.expander("✏️ Editar"):
+                                    with st.form(key=f"ed_{row['id']}"):
+                                        e_placa = st.selectbox("Placa", todas_placas, index=todas_placas.index(row['placa']) if row['placa'] in todas_placas else 0)
+                                        idx_serv = 0
+                                        if row['tipo_servico'] in lista_servicos_db:
+                                            idx_serv = lista_servicos_db.index(row['tipo_servico'])
+                                        e_tipo = st.selectbox("Serviço", lista_servicos_db, index=idx_serv)
+                                        e_resp = st.text_input("Resp", value=row['responsavel'])
+                                        e_km = st.number_input("KM Base", value=0.0 if pd.isna(row['km_realizada']) else float(row['km_realizada']))
+                                        e_prox = st.number_input("Meta KM", value=0.0 if pd.isna(row['proxima_km']) else float(row['proxima_km']))
+                                        e_val = st.number_input("Valor", value=0.0 if pd.isna(row['valor']) else float(row['valor']))
+                                        e_obs = st.text_area("Obs", value=row['obs'])
+                                        if st.form_submit_button("Salvar"):
+                                            novos = {'placa':e_placa, 'tipo':e_tipo, 'resp':e_resp, 'km':e_km, 'prox_km':e_prox, 'valor':e_val, 'obs':e_obs}
+                                            if db.edit_log_full(row['id'], novos):
+                                                st.rerun()
+                                            st.error("❌ Falha ao salvar a edição na planilha. Tente novamente.")
                             
-                            if st.button("🗑️", key=f"del_{row['id']}", help="Excluir"):
-                                db.delete_log(row['id']); st.rerun()
+                                if st.button("🗑️", key=f"del_{row['id']}", help="Excluir"):
+                                    if db.delete_log(row['id']): st.rerun()
+                                    st.error("❌ Falha ao excluir. Tente novamente.")
             else:
                 st.info("Nenhuma pendência.")
 
+    render.fase("pendencias")
+
     # --- ABA 2: NOVO LANÇAMENTO (LIMPO) ---
     with tab_novo:
         st.subheader("Registrar Manutenção")
@@ -519,7 +1116,7 @@ def main():
             intervalo = c2.number_input("Intervalo (KM)", value=None, placeholder="Digite o intervalo...", step=1000.0)
             
             c3, c4, c5 = st.columns(3)
-            dt_reg = c3.date_input("Data do Serviço", datetime.now() - timedelta(hours=3))
+            dt_reg = c3.date_input("Data do Serviço", configuracao.hoje())
             val_reg = c4.number_input("Valor (R$)", value=None, placeholder="0.00", step=10.0)
             resp_reg = c5.text_input("Responsável")
             obs_reg = st.text_area("Observações")
@@ -544,22 +1141,116 @@ def main():
                     km_log = km_base if is_done else ""
                     d1 = {"placa": p_selected, "tipo": s_selected, "km": km_log, "data": dt_reg, 
                           "prox_km": prox_calc, "valor": val_save, "obs": obs_reg, "resp": resp_reg, "status": stt}
-                    db.add_log(d1)
-                    if is_done and do_sched:
+                    ok = db.add_log(d1)
+                    if ok and is_done and do_sched:
                         d2 = {"placa": p_selected, "tipo": s_selected, "km": "", "data": "", 
                               "prox_km": prox_calc, "valor": 0, "obs": "Agendamento automático.", 
                               "resp": "", "status": "Agendado"}
-                        db.add_log(d2)
-                    st.toast("Salvo com sucesso!")
-                    time.sleep(1); st.rerun()
+                        ok = db.add_log(d2)
+                    if ok:
+                        _avisar("✅ Salvo com sucesso!"); st.rerun()
+                    else:
+                        st.error("❌ Falha ao salvar na planilha. Tente novamente.")
+
+        # LANÇAMENTO EM LOTE: campanha em várias placas (ou CSV), gravada num único append
+        with st.expander("📦 Lançamento em lote (campanha)"):
+            l1, l2 = st.columns(2)
+            l_placas = l1.multiselect("Placas", todas_placas, key="lote_placas")
+            l_csv = l2.file_uploader("ou CSV (colunas placa; km; valor)", type=["csv"], key="lote_csv")
+            l3, l4, l5 = st.columns(3)
+            l_serv = l3.selectbox("Serviço", lista_servicos_db, key="lote_serv")
+            l_intervalo = l4.number_input("Intervalo (KM)", value=None, placeholder="Digite o intervalo...", step=1000.0, key="lote_intervalo")
+            l_data = l5.date_input("Data do Serviço", configuracao.hoje(), key="lote_data")
+            l6, l7 = st.columns(2)
+            l_resp = l6.text_input("Responsável", key="lote_resp")
+            l_obs = l7.text_input("Observações", key="lote_obs")
+            lc1, lc2 = st.columns(2)
+            l_done = lc1.checkbox("✅ Já realizadas (Salvar no Histórico)", value=True, key="lote_done")
+            l_sched = lc2.checkbox("🔄 Agendar as próximas?", value=True, key="lote_sched")
+            try:
+                df_csv = pd.read_csv(l_csv, sep=None, engine="python", dtype=str) if l_csv is not None else None
+                tabela = fleet_state.tabela_campanha(l_placas, mapa_km_total, df_csv)
+            except Exception as e:
+                st.error(f"❌ CSV inválido: {e}")
+                tabela = fleet_state.tabela_campanha(l_placas, mapa_km_total)
+            if not tabela.empty:
+                # KM base (atual da frota, ou do CSV) e valor por placa, editáveis antes de salvar
+                tabela = st.data_editor(tabela, key=f"lote_tab_{hash(tuple(tabela['placa']))}", hide_index=True,
+                                        use_container_width=True, disabled=["placa"],
+                                        column_config={"km": st.column_config.NumberColumn("KM base", format="%.0f"),
+                                                       "valor": st.column_config.NumberColumn("Valor (R$)", format="%.2f")})
+                n_lanc = len(tabela) * (2 if l_done and l_sched else 1)
+                if st.button(f"💾 Salvar {n_lanc} lançamento(s)", key="lote_salvar"):
+                    sem_km = tabela[tabela['km'].isna()]['placa'].tolist()
+                    if l_intervalo is None:
+                        st.error("Preencha o Intervalo!")
+                    elif sem_km:
+                        st.error(f"Informe o KM base de: {', '.join(sem_km)}")
+                    else:
+                        linhas = fleet_state.lancamentos_campanha(tabela, l_serv, l_intervalo, l_data, l_resp, l_obs, l_done, l_sched)
+                        if db.add_logs(linhas):
+                            _avisar(f"✅ {len(linhas)} lançamento(s) salvos!"); st.rerun()
+                        else:
+                            st.error("❌ Falha ao salvar o lote. Tente novamente.")
+
+    render.fase("novo_lancamento")
 
     # --- ABA 3: HISTÓRICO ---
     with tab_hist:
-        if not df_logs.empty:
-            h = df_logs[df_logs['status'] == 'Concluido'].sort_values('id', ascending=False)
+        # FILTROS (aplicados no repositório; só a página atual vai para a tela)
+        h1, h2, h3, h4 = st.columns([2, 2, 2, 3])
+        h_placas = h1.multiselect("Placa", todas_placas, key="hist_f_placa")
+        h_servs = h2.multiselect("Serviço", lista_servicos_db, key="hist_f_serv")
+        h_resp = h3.text_input("Responsável", key="hist_f_resp").strip()
+        h_periodo = h4.date_input("Período", value=(), format="DD/MM/YYYY", key="hist_f_periodo")
+        h_periodo = tuple(h_periodo) if isinstance(h_periodo, (list, tuple)) else (h_periodo,)
+        filtros = {
+            "placas": tuple(h_placas), "servicos": tuple(h_servs), "responsavel": h_resp or None,
+            "de": h_periodo[0] if h_periodo else None, "ate": h_periodo[1] if len(h_periodo) > 1 else None,
+        }
+        versao = _versao_historico()
+
+        hp1, hp2, hp3 = st.columns([1, 1, 3])
+        h_por_pagina = hp1.selectbox("Por página", [50, 100, 250, 500], key="hist_por_pagina")
+        h_pagina = st.session_state.get("hist_pagina", 1)
+        h, h_total = _pagina_historico(filtros, h_por_pagina, (h_pagina - 1) * h_por_pagina, versao, df_logs)
+        h_n_paginas = max(1, -(-h_total // h_por_pagina))
+        if h_pagina > h_n_paginas:
+            # Filtro novo com menos páginas: volta para a última (antes de criar o widget)
+            h_pagina = st.session_state["hist_pagina"] = h_n_paginas
+            h, h_total = _pagina_historico(filtros, h_por_pagina, (h_pagina - 1) * h_por_pagina, versao, df_logs)
+        hp2.number_input("Página", min_value=1, max_value=h_n_paginas, step=1, key="hist_pagina")
+        hp3.caption(f"Página {h_pagina} de {h_n_paginas}  |  {h_total} serviço(s) concluído(s)")
+        if not h.empty:
             st.dataframe(h, use_container_width=True, hide_index=True)
         else:
-            st.info("Histórico vazio.")
+            st.info("Nenhum serviço concluído com esses filtros." if h_total == 0 and any(filtros.values()) else "Histórico vazio.")
+
+        # RELATÓRIOS (sobre todo o histórico filtrado, não só a página)
+        if h_total:
+            agg = _agregados_historico(filtros, versao, df_logs)
+            r1, r2, r3 = st.tabs(["💰 Custo por veículo/mês", "🧰 Custo por serviço", "📏 KM entre serviços"])
+            with r1:
+                custo_mes = agg["custo_mes"]
+                if not custo_mes.empty:
+                    st.dataframe(custo_mes.pivot_table(index="placa", columns="mes", values="custo", aggfunc="sum", fill_value=0)
+                                 .sort_index(axis=1, ascending=False), use_container_width=True)
+                    st.caption(f"Total: R$ {custo_mes['custo'].sum():,.2f} em {int(custo_mes['servicos'].sum())} serviço(s) com data")
+                else:
+                    st.info("Sem serviços com data no filtro.")
+            with r2:
+                st.dataframe(agg["custo_servico"], use_container_width=True, hide_index=True,
+                             column_config={"custo": st.column_config.NumberColumn("custo", format="R$ %.2f"),
+                                            "custo_medio": st.column_config.NumberColumn("custo médio", format="R$ %.2f")})
+            with r3:
+                if not agg["km_entre"].empty:
+                    st.dataframe(agg["km_entre"], use_container_width=True, hide_index=True,
+                                 column_config={c: st.column_config.NumberColumn(c, format="%.0f") for c in ("km_medio", "km_min", "km_max")})
+                else:
+                    st.info("São necessários ao menos dois serviços do mesmo tipo no mesmo veículo (com KM) para calcular o intervalo.")
+    render.fase("historico")
+    render.total()
+    _registrar_partida()
 
 if __name__ == "__main__":
     main()
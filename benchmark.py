@@ -0,0 +1,507 @@
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+from gspread.utils import a1_to_rowcol
+
+import fleet_state
+import repositorio
+import write_queue
+
+# Benchmark offline: mede como as cargas e escritas escalam com o tamanho da frota,
+# sem tocar em serviços de produção.
+#   - gerar_frota(): N veículos, M posições por veículo, K manutenções por veículo;
+#   - FakeSpreadsheet: imita a parte do gspread que o app usa, conta chamadas e simula
+#     latência e 429 (com nova tentativa, como faz o sheets_client);
+#   - caminhos SQL (telemetria, posicoes_latest, PostgresRepositorio) num Postgres local
+#     descartável, em um schema próprio apagado no fim: --pg-url ou BENCH_DATABASE_URL
+#     (nunca DATABASE_URL, para não rodar contra produção por engano).
+#
+#   python benchmark.py --tamanhos 50,200,1000 --posicoes 200 --latencia-ms 80 --taxa-429 0.05
+#   python benchmark.py --pg-url postgresql://postgres@localhost/bench --json bench.json
+
+SCHEMA_BENCH = "frota_bench"
+SERVICOS = repositorio.DEFAULT_SERVICES
+
+
+# --- dados sintéticos ---
+def _placa(rng):
+    letras = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    return "".join(rng.choice(letras) for _ in range(3)) + str(rng.randint(0, 9)) + rng.choice(letras) + f"{rng.randint(0, 99):02d}"
+
+
+def gerar_frota(n_veiculos, posicoes_por_veiculo, logs_por_veiculo, seed=42, manuais=0.1):
+    # DataFrames no formato das fontes reais: veiculos, posicoes (posicoes_raw),
+    # manuais (veiculos_manuais) e logs (maintenance_logs, colunas LOG_COLS)
+    rng = random.Random(seed)
+    placas = list(dict.fromkeys(_placa(rng) for _ in range(n_veiculos * 2)))[:n_veiculos]
+    veiculos = pd.DataFrame({"id_sascar": range(1, n_veiculos + 1), "placa": placas})
+
+    agora = datetime.now(timezone.utc).replace(microsecond=0)
+    km_dia = [rng.uniform(80, 600) for _ in placas]
+    km_base = [rng.uniform(20_000, 600_000) for _ in placas]
+    pos = []
+    for i, id_v in enumerate(veiculos["id_sascar"]):
+        for j in range(posicoes_por_veiculo):
+            # Uma posição a cada ~10 min, da mais antiga para a mais nova
+            horas = (posicoes_por_veiculo - j) / 6
+            pos.append((id_v, agora - timedelta(hours=horas), km_base[i] + km_dia[i] * (j / 144),
+                        -23.5 + rng.uniform(-2, 2), -46.6 + rng.uniform(-2, 2)))
+    posicoes = pd.DataFrame(pos, columns=["id_veiculo", "data_hora", "odometro", "latitude", "longitude"])
+
+    n_manuais = int(n_veiculos * manuais)
+    manuais_df = pd.DataFrame({"placa": [f"MAN{i:04d}" for i in range(n_manuais)],
+                               "odometro": [round(rng.uniform(10_000, 300_000)) for _ in range(n_manuais)]})
+
+    logs, log_id = [], 1
+    todas = placas + manuais_df["placa"].tolist()
+    for placa in todas:
+        for k in range(logs_por_veiculo):
+            servico = rng.choice(SERVICOS)
+            km = round(rng.uniform(10_000, 600_000))
+            concluido = k < logs_por_veiculo - 1 or rng.random() < 0.3
+            data = (agora - timedelta(days=rng.randint(0, 720))).date().isoformat()
+            logs.append([log_id, placa, servico, km if concluido else "", data if concluido else "",
+                         km + rng.choice([5_000, 10_000, 20_000, 40_000]), rng.choice(["Oficina A", "Oficina B", "João", ""]),
+                         round(rng.uniform(50, 5_000), 2) if concluido else 0, "", "Concluido" if concluido else "Agendado"])
+            log_id += 1
+    logs_df = pd.DataFrame(logs, columns=repositorio.LOG_COLS)
+    return {"veiculos": veiculos, "posicoes": posicoes, "manuais": manuais_df, "logs": logs_df}
+
+
+def _valores_planilha(df):
+    # Como a API devolve: cabeçalho + linhas, tudo em texto
+    return [list(df.columns)] + [["" if v is None else str(v) for v in linha] for linha in df.itertuples(index=False)]
+
+
+# --- gspread falso ---
+class FakeCell:
+    def __init__(self, row, col, value):
+        self.row, self.col, self.value = row, col, value
+
+
+class FakeWorksheet:
+    def __init__(self, planilha, title, values):
+        self._planilha = planilha
+        self.title = title
+        self._linhas = [list(r) for r in values]
+
+    def _valor(self, row, col):
+        linha = self._linhas[row - 1] if 0 < row <= len(self._linhas) else []
+        return linha[col - 1] if col <= len(linha) else ""
+
+    def _gravar(self, row, col, valor):
+        while len(self._linhas) < row: self._linhas.append([])
+        linha = self._linhas[row - 1]
+        while len(linha) < col: linha.append("")
+        linha[col - 1] = "" if valor is None else str(valor)
+
+    def cell(self, row, col):
+        self._planilha._chamar("cell")
+        return FakeCell(row, col, self._valor(row, col))
+
+    def col_values(self, col):
+        self._planilha._chamar("col_values")
+        vals = [self._valor(r, col) for r in range(1, len(self._linhas) + 1)]
+        while vals and vals[-1] == "": vals.pop()
+        return vals
+
+    def find(self, query, in_column=None):
+        self._planilha._chamar("find")
+        for r, linha in enumerate(self._linhas, start=1):
+            cols = [in_column] if in_column else range(1, len(linha) + 1)
+            for c in cols:
+                if self._valor(r, c) == str(query):
+                    return FakeCell(r, c, str(query))
+        return None
+
+    def update_cell(self, row, col, value):
+        self._planilha._chamar("update_cell")
+        self._gravar(row, col, value)
+
+    def append_rows(self, rows, **kwargs):
+        self._planilha._chamar("append_rows")
+        inicio = len(self._linhas) + 1
+        self._linhas.extend([["" if v is None else str(v) for v in r] for r in rows])
+        fim = len(self._linhas)
+        return {"updates": {"updatedRange": f"{self.title}!A{inicio}:J{fim}", "updatedRows": len(rows)}}
+
+    def append_row(self, row, **kwargs):
+        self._planilha._chamar("append_row")
+        self._linhas.append(["" if v is None else str(v) for v in row])
+        n = len(self._linhas)
+        return {"updates": {"updatedRange": f"{self.title}!A{n}:J{n}", "updatedRows": 1}}
+
+    def batch_update(self, data, **kwargs):
+        self._planilha._chamar("batch_update")
+        for bloco in data:
+            row, col = a1_to_rowcol(bloco["range"].split(":")[0])
+            for dr, linha in enumerate(bloco["values"]):
+                for dc, v in enumerate(linha):
+                    self._gravar(row + dr, col + dc, v)
+
+    def delete_rows(self, start_index, end_index=None):
+        self._planilha._chamar("delete_rows")
+        del self._linhas[start_index - 1:(end_index or start_index)]
+
+
+ESCRITAS = {"update_cell", "append_rows", "append_row", "batch_update", "delete_rows"}
+
+
+class FakeSpreadsheet:
+    # Cada método conta como uma requisição. taxa_429: fração das requisições recusadas
+    # por cota; a recusa é contada e a requisição repetida (mesma política do sheets_client).
+    def __init__(self, abas, latencia_s=0.0, taxa_429=0.0, backoff_s=0.0, seed=0):
+        self._abas = {titulo: FakeWorksheet(self, titulo, valores) for titulo, valores in abas.items()}
+        self.latencia_s = latencia_s
+        self.taxa_429 = taxa_429
+        self.backoff_s = backoff_s
+        self._rng = random.Random(seed)
+        self.chamadas = Counter()
+        self.erros_429 = 0
+        self.revisao = 0  # muda a cada escrita, como o modifiedTime do Drive
+
+    def _chamar(self, metodo):
+        while True:
+            self.chamadas[metodo] += 1
+            if self.latencia_s: time.sleep(self.latencia_s)
+            if self._rng.random() >= self.taxa_429:
+                if metodo in ESCRITAS: self.revisao += 1
+                return
+            self.erros_429 += 1
+            if self.backoff_s: time.sleep(self.backoff_s)
+
+    def total_chamadas(self):
+        return sum(self.chamadas.values())
+
+    def worksheets(self):
+        self._chamar("fetch_sheet_metadata")
+        return list(self._abas.values())
+
+    def worksheet(self, title):
+        self._chamar("fetch_sheet_metadata")
+        return self._abas[title]
+
+    def get_lastUpdateTime(self):
+        self._chamar("get_file_drive_metadata")
+        return f"rev-{self.revisao}"
+
+    def values_batch_get(self, ranges, **kwargs):
+        self._chamar("values_batch_get")
+        out = []
+        for r in ranges:
+            ws = self._abas[r.strip("'").split("!")[0]]
+            out.append({"range": r, "values": [list(linha) for linha in ws._linhas]})
+        return {"valueRanges": out}
+
+
+def planilha_falsa(frota, **opcoes):
+    return FakeSpreadsheet({
+        "veiculos_manuais": _valores_planilha(frota["manuais"]),
+        "maintenance_logs": _valores_planilha(frota["logs"]),
+        "service_types": [["id", "nome"]] + [[str(i), s] for i, s in enumerate(SERVICOS, start=1)],
+    }, **opcoes)
+
+
+# --- medições ---
+def _cronometrar(fn, repeticoes=1):
+    # (mediana em ms, último resultado)
+    tempos, resultado = [], None
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        resultado = fn()
+        tempos.append(1000 * (time.perf_counter() - t0))
+    return statistics.median(tempos), resultado
+
+
+def _memoria_mb(fn):
+    # (pico de alocação Python durante fn, em MB; resultado)
+    tracemalloc.start()
+    try:
+        resultado = fn()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return pico / 2**20, resultado
+
+
+def _tamanho_mb(valor):
+    if isinstance(valor, pd.DataFrame):
+        return valor.memory_usage(deep=True).sum() / 2**20
+    return 0.0
+
+
+def _chamadas(sh, fn):
+    antes = sh.total_chamadas()
+    fn()
+    return sh.total_chamadas() - antes
+
+
+def medir_sheets(frota, latencia_s, taxa_429, repeticoes):
+    sh = planilha_falsa(frota, latencia_s=latencia_s, taxa_429=taxa_429)
+    repo = repositorio.SheetsRepositorio(lambda: sh)
+    out = {}
+
+    carga_ms, dados = _cronometrar(repo.carregar, repeticoes)
+    out["sheets_carga_ms"] = carga_ms
+    out["sheets_carga_chamadas"] = _chamadas(sh, repo.carregar)
+    out["mem_carga_mb"], dados = _memoria_mb(repo.carregar)
+    out["mem_dados_mb"] = sum(_tamanho_mb(v) for v in dados.values())
+    # Revalidação sem mudança: só a sondagem de versão (Drive), em vez de reler as abas
+    out["sheets_sondagem_ms"], _ = _cronometrar(repo.versoes, repeticoes)
+    out["sheets_sondagem_chamadas"] = _chamadas(sh, repo.versoes)
+
+    km = fleet_state.mapa_km_total(frota["veiculos"].assign(odometro=50_000.0), dados["veiculos_manuais"])
+    out["pendencias_ms"], pend = _cronometrar(lambda: fleet_state.calcular_pendencias(dados["maintenance_logs"], km), repeticoes)
+    out["pendencias"] = len(pend)
+    out["historico_ms"], _ = _cronometrar(
+        lambda: fleet_state.agregar_historico(fleet_state.filtrar_historico(dados["maintenance_logs"])), repeticoes)
+
+    # Chamadas por escrita, com o índice de linhas já aquecido pela carga
+    logs = frota["logs"]
+    aberta = logs[logs["status"] != "Concluido"].iloc[len(logs[logs["status"] != "Concluido"]) // 2]
+    baixa = {"log_id": str(aberta["id"]), "valores": {"4": 123_456, "5": "2024-01-01", "7": "Oficina", "8": 300, "9": "baixa", "10": "Concluido"}}
+    escritas = {}
+    escritas["baixa"] = _chamadas(sh, lambda: repo.aplicar("update_log", baixa))
+    novo_id = [None]
+    def incluir():
+        novo_id[0] = repo.reservar_ids(1)[0]
+        linha = [novo_id[0], aberta["placa"], aberta["tipo_servico"], "", "", 150_000, "", 0, "", "Agendado"]
+        repo.aplicar("append_log", {"row": linha})
+    escritas["inclusao_1a"] = _chamadas(sh, incluir)
+    escritas["inclusao"] = _chamadas(sh, incluir)
+    escritas["edicao"] = _chamadas(sh, lambda: repo.aplicar("update_log", {"log_id": str(novo_id[0]), "valores": {"6": 160_000}}))
+    escritas["exclusao"] = _chamadas(sh, lambda: repo.aplicar("delete_log", {"log_id": str(novo_id[0])}))
+    placa_manual = frota["manuais"]["placa"].iloc[-1] if not frota["manuais"].empty else "MAN0000"
+    escritas["km_manual"] = _chamadas(sh, lambda: repo.aplicar("manual_km", {"placa": placa_manual, "km": 99_999}))
+
+    # Campanha em toda a frota: um bloco de ids + um append_rows; baixa em lote: um batchUpdate
+    placas = frota["veiculos"]["placa"].tolist()
+    def campanha():
+        ids = repo.reservar_ids(len(placas))
+        rows = [[i, p, SERVICOS[0], "", "", 200_000, "", 0, "", "Agendado"] for i, p in zip(ids, placas)]
+        repo.aplicar("append_logs", {"rows": rows})
+        return ids
+    escritas[f"campanha_{len(placas)}"] = _chamadas(sh, campanha)
+    ids_campanha = [r[0] for r in sh.worksheet("maintenance_logs")._linhas[-len(placas):]]
+    itens = [{"log_id": str(i), "valores": {"4": 200_000, "5": "2024-01-01", "10": "Concluido"}} for i in ids_campanha]
+    escritas[f"baixa_lote_{len(itens)}"] = _chamadas(sh, lambda: repo.aplicar("update_logs", {"itens": itens}))
+    out["chamadas_por_escrita"] = escritas
+
+    # Write-behind: 10 edições seguidas da mesma O.S. viram uma gravação
+    with tempfile.TemporaryDirectory() as tmp:
+        fila = write_queue.WriteQueue(repo.aplicar, repositorio.coalescer, caminho=os.path.join(tmp, "journal.sqlite"))
+        for i in range(10):
+            fila.enfileirar("update_log", f"log:{aberta['id']}", {"log_id": str(aberta["id"]), "valores": {"8": 100 + i}})
+        out["journal_10_edicoes_chamadas"] = _chamadas(sh, fila.processar)
+    out["sheets_429"] = sh.erros_429
+    return out
+
+
+# --- Postgres local ---
+DDL_TELEMETRIA = [
+    "CREATE TABLE veiculos (id_sascar BIGINT PRIMARY KEY, placa TEXT NOT NULL)",
+    "CREATE TABLE posicoes_raw (id_veiculo BIGINT NOT NULL, data_hora TIMESTAMPTZ NOT NULL,"
+    " odometro DOUBLE PRECISION, latitude DOUBLE PRECISION, longitude DOUBLE PRECISION)",
+    "CREATE INDEX posicoes_raw_veiculo_data_idx ON posicoes_raw (id_veiculo, data_hora DESC)",
+]
+
+
+def _engine_bench(url):
+    # search_path no schema do benchmark: as mesmas consultas do app, sem tocar nas tabelas reais
+    import pg_engine
+    return pg_engine.get_engine(url, connect_args={"options": f"-csearch_path={SCHEMA_BENCH}"})
+
+
+def _copiar(engine, tabela, df):
+    # COPY é ordens de grandeza mais rápido que INSERT para carregar milhões de posições
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cur:
+            cur.copy_expert(f"COPY {tabela} ({', '.join(df.columns)}) FROM STDIN WITH CSV", buf)
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def medir_postgres(frota, url, repeticoes):
+    from sqlalchemy import text
+    import pg_engine
+    import posicoes_latest
+    import telemetria
+
+    engine = _engine_bench(url)
+    with pg_engine.transacao(engine) as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA_BENCH} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA_BENCH}"))
+        for sql in DDL_TELEMETRIA:
+            conn.execute(text(sql))
+    out = {}
+    try:
+        t0 = time.perf_counter()
+        _copiar(engine, "veiculos", frota["veiculos"])
+        _copiar(engine, "posicoes_raw", frota["posicoes"])
+        with pg_engine.transacao(engine) as conn:
+            conn.execute(text("ANALYZE veiculos; ANALYZE posicoes_raw"))
+        out["pg_carga_dados_s"] = time.perf_counter() - t0
+
+        # Sem snapshot: DISTINCT ON sobre posicoes_raw inteiro
+        out["sql_veiculos_raw_ms"], _ = _cronometrar(lambda: telemetria.ler_veiculos(engine), repeticoes)
+        t0 = time.perf_counter()
+        posicoes_latest.bootstrap(engine)
+        out["sql_bootstrap_latest_ms"] = 1000 * (time.perf_counter() - t0)
+        out["sql_veiculos_latest_ms"], df = _cronometrar(lambda: telemetria.ler_veiculos(engine), repeticoes)
+        out["mem_veiculos_mb"] = _tamanho_mb(df)
+
+        # Refresh incremental: uma posição nova por veículo
+        novas = frota["veiculos"][["id_sascar"]].rename(columns={"id_sascar": "id_veiculo"}).assign(
+            data_hora=datetime.now(timezone.utc) + timedelta(minutes=10), odometro=999_999.0, latitude=-23.5, longitude=-46.6)
+        _copiar(engine, "posicoes_raw", novas)
+        t0 = time.perf_counter()
+        posicoes_latest.atualizar(engine, forcar=True)
+        out["sql_refresh_incremental_ms"] = 1000 * (time.perf_counter() - t0)
+        out["sql_sondagem_ms"], _ = _cronometrar(lambda: telemetria.versoes(engine, ("vehicles", "positions")), repeticoes)
+
+        # Repositório em Postgres: importação, carga das pendências, histórico e uma baixa
+        repo = repositorio.PostgresRepositorio(engine)
+        repo.criar_esquema()
+        dados = {"maintenance_logs": frota["logs"], "veiculos_manuais": frota["manuais"], "service_types": list(SERVICOS)}
+        t0 = time.perf_counter()
+        repo.importar(dados)
+        out["pg_importar_ms"] = 1000 * (time.perf_counter() - t0)
+        out["pg_carga_ms"], _ = _cronometrar(repo.carregar, repeticoes)
+        out["pg_sondagem_ms"], _ = _cronometrar(repo.versoes, repeticoes)
+        out["pg_historico_ms"], _ = _cronometrar(lambda: repo.historico(limite=100), repeticoes)
+        out["pg_agregados_ms"], _ = _cronometrar(repo.agregados_historico, repeticoes)
+        aberta = frota["logs"][frota["logs"]["status"] != "Concluido"].iloc[0]
+        out["pg_baixa_ms"], _ = _cronometrar(lambda: repo.aplicar(
+            "update_log", {"log_id": str(aberta["id"]), "valores": {"4": 1, "10": "Concluido"}}), 1)
+    finally:
+        with pg_engine.transacao(engine) as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA_BENCH} CASCADE"))
+    return out
+
+
+# --- relatório ---
+COLUNAS_RELATORIO = [
+    ("veiculos", "veíc."), ("posicoes", "posições"), ("logs", "O.S."),
+    ("sheets_carga_ms", "carga planilha ms"), ("sheets_carga_chamadas", "chamadas"),
+    ("sheets_sondagem_chamadas", "sondagem"), ("mem_carga_mb", "pico MB"), ("pendencias_ms", "pendências ms"), ("historico_ms", "histórico ms"),
+    ("journal_10_edicoes_chamadas", "10 edições→chamadas"),
+    ("sql_veiculos_raw_ms", "SQL raw ms"), ("sql_veiculos_latest_ms", "SQL latest ms"),
+    ("sql_refresh_incremental_ms", "refresh ms"), ("pg_carga_ms", "repo PG ms"),
+]
+
+
+# O que o app.py importa no topo (antes da primeira tela) e os clientes que devem ficar
+# para o primeiro uso do backend
+MODULOS_PARTIDA = ("streamlit", "pandas", "pg_engine", "fleet_state", "snapshot_store", "write_queue", "repositorio", "instrumentacao", "configuracao")
+CLIENTES_PESADOS = ("gspread", "sqlalchemy", "psycopg2")
+
+
+def medir_partida(repeticoes):
+    # Imports de topo do app num interpretador novo (partida a frio), e quais clientes pesados
+    # vieram junto. O tempo total até a primeira tela aparece no painel (span "partida").
+    # Falha no subprocesso (ex.: sem streamlit) devolve None: não derruba o resto.
+    codigo = (
+        "import json, sys, time\n"
+        f"sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})\n"
+        "t0 = time.perf_counter()\n"
+        f"for m in {MODULOS_PARTIDA!r}: __import__(m)\n"
+        "print(json.dumps({'ms': 1000 * (time.perf_counter() - t0),"
+        f" 'clientes': [m for m in {CLIENTES_PESADOS!r} if m in sys.modules]}}))\n"
+    )
+    try:
+        medidas = [json.loads(subprocess.run([sys.executable, "-c", codigo], capture_output=True, text=True, check=True).stdout)
+                   for _ in range(repeticoes)]
+    except (subprocess.CalledProcessError, ValueError) as e:
+        detalhe = (getattr(e, "stderr", "") or str(e)).strip().splitlines()
+        print(f"❌ [DEBUG] Medição de partida falhou: {detalhe[-1] if detalhe else e}")
+        return None
+    return {"partida_imports_ms": statistics.median(m["ms"] for m in medidas), "partida_clientes": medidas[-1]["clientes"]}
+
+
+def _fmt(v):
+    if v is None: return "-"
+    if isinstance(v, float): return f"{v:,.1f}"
+    return f"{v:,}" if isinstance(v, int) else str(v)
+
+
+def imprimir(resultados):
+    cols = [(k, t) for k, t in COLUNAS_RELATORIO if any(k in r for r in resultados)]
+    tabela = [[t for _, t in cols]] + [[_fmt(r.get(k)) for k, _ in cols] for r in resultados]
+    larguras = [max(len(linha[i]) for linha in tabela) for i in range(len(cols))]
+    for n, linha in enumerate(tabela):
+        print("  ".join(c.rjust(w) for c, w in zip(linha, larguras)))
+        if n == 0: print("  ".join("-" * w for w in larguras))
+    print("\nChamadas à API por escrita (planilha):")
+    for r in resultados:
+        escritas = ", ".join(f"{k} {v}" for k, v in r.get("chamadas_por_escrita", {}).items())
+        print(f"  {r['veiculos']:>6} veíc.: {escritas}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline do painel de frota (dados sintéticos, planilha falsa, Postgres local).")
+    parser.add_argument("--tamanhos", default="50,200,1000", help="Tamanhos de frota (nº de veículos), separados por vírgula")
+    parser.add_argument("--posicoes", type=int, default=144, help="Posições por veículo em posicoes_raw")
+    parser.add_argument("--logs", type=int, default=12, help="Manutenções por veículo")
+    parser.add_argument("--latencia-ms", type=float, default=0.0, help="Latência simulada por chamada ao Sheets")
+    parser.add_argument("--taxa-429", type=float, default=0.0, help="Fração das chamadas ao Sheets recusadas por cota")
+    parser.add_argument("--repeticoes", type=int, default=3, help="Repetições por medição (vale a mediana)")
+    parser.add_argument("--pg-url", default=os.getenv("BENCH_DATABASE_URL"), help="Postgres local descartável (padrão: BENCH_DATABASE_URL)")
+    parser.add_argument("--json", help="Grava os resultados neste arquivo")
+    parser.add_argument("--partida", action="store_true", help="Mede também os imports de topo do app num interpretador novo")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    resultados = []
+    for n in [int(x) for x in args.tamanhos.split(",") if x.strip()]:
+        frota = gerar_frota(n, args.posicoes, args.logs, seed=args.seed)
+        r = {"veiculos": n, "posicoes": len(frota["posicoes"]), "logs": len(frota["logs"])}
+        r.update(medir_sheets(frota, args.latencia_ms / 1000, args.taxa_429, args.repeticoes))
+        if args.pg_url:
+            r.update(medir_postgres(frota, args.pg_url, args.repeticoes))
+        resultados.append(r)
+        print(f"✅ {n} veículos medidos")
+
+    print()
+    imprimir(resultados)
+    if not args.pg_url:
+        print("\n(SQL não medido: informe --pg-url ou BENCH_DATABASE_URL)")
+    saida = {"parametros": vars(args), "resultados": resultados}
+    _gravar_json(args.json, saida)
+
+    # Por último e só com --partida: o que já foi medido está impresso e gravado
+    if args.partida:
+        partida = medir_partida(args.repeticoes)
+        if partida is None:
+            print("\nPartida a frio (imports de topo do app): n/d")
+        else:
+            print(f"\nPartida a frio (imports de topo do app): {partida['partida_imports_ms']:,.0f} ms; "
+                  f"clientes carregados: {', '.join(partida['partida_clientes']) or 'nenhum'}")
+        saida["partida"] = partida
+        _gravar_json(args.json, saida)
+
+
+def _gravar_json(caminho, saida):
+    if caminho:
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump(saida, f, ensure_ascii=False, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
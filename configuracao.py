@@ -0,0 +1,144 @@
+import functools
+import json
+import os
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# Configuração compartilhada pelo painel e pelos scripts (exportar_pendencias,
+# posicoes_latest, odometro_diario, repositorio): mesma origem e mesma ordem para
+# todos, para um script nunca ler outro banco ou outra planilha que não a do painel.
+#
+#   URL do Postgres:     argumento -> secrets [database] -> config.toml [database] url -> DATABASE_URL
+#   Backend:             STORAGE_BACKEND -> config.toml [storage] backend -> "sheets"
+#   Conta de serviço:    arquivo JSON (argumento) -> secrets [gcp_service_account]
+#                        -> GCP_CREDENTIALS ou variáveis soltas do .env
+#   Fuso do "dia":       FUSO_ROLLUP (padrão America/Sao_Paulo): rollup diário de odômetro,
+#                        classificação/projeção das pendências e datas padrão dos formulários
+#
+# "secrets" é o .streamlit/secrets.toml; o app passa o st.secrets (que também inclui o
+# do Streamlit Cloud). .env, config.toml e secrets.toml são lidos uma vez por processo.
+
+CAMINHO_CONFIG = "config.toml"
+CAMINHO_SEGREDOS = os.path.join(".streamlit", "secrets.toml")
+FUSO_PADRAO = "America/Sao_Paulo"
+
+
+def _ler_toml(caminho):
+    try:
+        import tomllib
+    except ImportError:
+        import tomli as tomllib
+    with open(caminho, "rb") as f:
+        return tomllib.load(f)
+
+
+@functools.lru_cache(maxsize=None)
+def carregar_env():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+@functools.lru_cache(maxsize=None)
+def config():
+    # config.toml ({} se não existe ou não abre). Tratar como somente leitura: é compartilhado.
+    carregar_env()
+    try:
+        return _ler_toml(CAMINHO_CONFIG)
+    except Exception as e:
+        # Fallback para st.secrets ou env se o arquivo não existir ou falhar
+        print(f"❌ [DEBUG] Error loading config.toml: {e}")
+        return {}
+
+
+@functools.lru_cache(maxsize=None)
+def ler_segredos():
+    # .streamlit/secrets.toml fora do Streamlit ({} se não existe)
+    try:
+        return _ler_toml(CAMINHO_SEGREDOS)
+    except Exception:
+        return {}
+
+
+def _url_dos_segredos(db_sec):
+    if "url" in db_sec:
+        return db_sec["url"]
+    if "host" in db_sec and "user" in db_sec:
+        # Monta URL a partir dos componentes
+        from urllib.parse import quote_plus
+        encoded_pass = quote_plus(db_sec["password"]) if "password" in db_sec else ""
+        return f"postgresql://{db_sec['user']}:{encoded_pass}@{db_sec['host']}:{db_sec.get('port', 5432)}/{db_sec.get('database', 'postgres')}"
+    return None
+
+
+def url_banco(url=None, segredos=None):
+    # URL do Postgres ou None. segredos: mapeamento dos secrets (padrão: o secrets.toml)
+    if url:
+        return url
+    carregar_env()
+    sec = ler_segredos() if segredos is None else segredos
+    return (_url_dos_segredos(sec.get("database", {})) or config().get("database", {}).get("url")
+            or os.getenv("DATABASE_URL"))
+
+
+def opcoes_pool():
+    # config.toml [database] e, por cima, variáveis de ambiente PG_<OPÇÃO> (ex.: PG_POOL_SIZE, PG_MAX_OVERFLOW)
+    db_cfg = config().get("database", {})
+    conversores = {"pool_size": int, "max_overflow": int, "pool_timeout": float, "pool_recycle": int,
+                   "pool_pre_ping": lambda v: str(v).strip().lower() in ("1", "true", "sim", "yes")}
+    opts = {}
+    for nome, conv in conversores.items():
+        valor = os.getenv(f"PG_{nome.upper()}", db_cfg.get(nome))
+        if valor is None or valor == "":
+            continue
+        try:
+            opts[nome] = conv(valor)
+        except (TypeError, ValueError):
+            print(f"❌ [DEBUG] Valor inválido para {nome}: {valor!r}")
+    return opts
+
+
+def backend():
+    # Onde ficam manutenções, KM manual e serviços: "sheets" (padrão) ou "postgres"
+    carregar_env()
+    return os.getenv("STORAGE_BACKEND", config().get("storage", {}).get("backend", "sheets")).strip().lower()
+
+
+def fuso():
+    carregar_env()
+    return os.getenv("FUSO_ROLLUP", FUSO_PADRAO)
+
+
+def agora():
+    # datetime (com fuso) de agora no fuso do rollup
+    return datetime.now(ZoneInfo(fuso()))
+
+
+def hoje():
+    return agora().date()
+
+
+def credenciais_do_ambiente():
+    # Conta de serviço do Google fora dos secrets: GCP_CREDENTIALS (JSON) ou as
+    # variáveis soltas do .env (type, project_id, private_key, ...)
+    carregar_env()
+    env_json = os.getenv("GCP_CREDENTIALS")
+    if env_json:
+        return json.loads(env_json)
+    if os.getenv("private_key"):
+        campos = ["type", "project_id", "private_key_id", "private_key", "client_email", "client_id", "auth_uri",
+                  "token_uri", "auth_provider_x509_cert_url", "client_x509_cert_url", "universe_domain"]
+        creds = {c: os.getenv(c) for c in campos}
+        creds["private_key"] = creds["private_key"].replace("\\n", "\n")
+        return creds
+    return None
+
+
+def credenciais_google(caminho=None, segredos=None):
+    # dict da conta de serviço ou None. GCP_CREDENTIALS com JSON inválido levanta ValueError.
+    if caminho:
+        with open(caminho, encoding="utf-8") as f:
+            return json.load(f)
+    sec = ler_segredos() if segredos is None else segredos
+    if sec.get("gcp_service_account"):
+        return dict(sec["gcp_service_account"])
+    return credenciais_do_ambiente()
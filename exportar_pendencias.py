@@ -0,0 +1,229 @@
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+import configuracao
+import fleet_state
+import pg_engine
+import repositorio
+import telemetria
+
+# Pendências da frota inteira sem Streamlit, para relatórios/alertas em cron ou para
+# outros sistemas (sem raspar a tela). Mesmas fontes do painel (telemetria no Postgres,
+# repositório na planilha ou no Postgres, conforme [storage] backend / STORAGE_BACKEND),
+# resolvidas pelo mesmo configuracao do painel, e mesmas regras (fleet_state): KM atual,
+# km_restante, status e data prevista.
+#
+# Uso:
+#   python exportar_pendencias.py                                  # JSON no stdout
+#   python exportar_pendencias.py -f csv -o pendencias.csv --status VENCIDO ATENÇÃO
+#   python exportar_pendencias.py -f parquet -o pendencias.parquet
+#   python exportar_pendencias.py --alerta                         # código 2 se houver VENCIDO
+#   python exportar_pendencias.py --servir 8502                    # GET /pendencias?formato=csv&status=VENCIDO
+
+FORMATOS = {
+    "json": "application/json; charset=utf-8",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+COLUNAS = [
+    "id", "placa", "tipo_servico", "responsavel", "status_prazo", "km_atual", "meta_km", "km_restante",
+    "km_dia", "dias_restantes", "data_prevista", "obs",
+]
+# Colunas de texto: o gspread converte célula com cara de número ("500", "123"), e a
+# coluna fica com int e str misturados, o que o Parquet (pyarrow) recusa
+COLUNAS_TEXTO = ["id", "placa", "tipo_servico", "responsavel", "obs"]
+# Por quanto tempo o endpoint HTTP reaproveita o último cálculo
+TTL_SERVIDOR_S = float(os.getenv("PENDENCIAS_TTL_S", "60"))
+
+
+class Fontes:
+    # Conexões resolvidas uma vez por processo (engine, planilha e repositório)
+    def __init__(self, db_url=None, planilha="frota_db", credenciais=None, backend="sheets"):
+        self.engine = pg_engine.get_engine(db_url, **configuracao.opcoes_pool()) if db_url else None
+        self._planilha_nome = planilha
+        self._credenciais = credenciais
+        self._planilha = None
+        self._lock = threading.Lock()
+        if backend == "postgres":
+            if self.engine is None:
+                raise RuntimeError("STORAGE_BACKEND=postgres exige DATABASE_URL")
+            self.repo = repositorio.PostgresRepositorio(self.engine)
+        else:
+            self.repo = repositorio.SheetsRepositorio(self._conectar, lambda: self.engine)
+
+    def _conectar(self):
+        with self._lock:
+            if self._planilha is None:
+                if not self._credenciais:
+                    raise RuntimeError("Credenciais do Google não encontradas (--credenciais, secrets.toml, GCP_CREDENTIALS ou .env)")
+                import gspread
+                import sheets_client
+                gc = gspread.service_account_from_dict(self._credenciais, http_client=sheets_client.QuotaHTTPClient)
+                self._planilha = gc.open(self._planilha_nome)
+            return self._planilha
+
+
+def calcular(fontes, limite_atencao=fleet_state.LIMITE_ATENCAO_KM, hoje=None):
+    # DataFrame com as pendências de toda a frota (colunas COLUNAS), da mais urgente para a menos
+    tarefas = {"repositorio": lambda: fontes.repo.carregar(("veiculos_manuais", "maintenance_logs"))}
+    if fontes.engine is not None:
+        tarefas["veiculos"] = lambda: telemetria.ler_veiculos(fontes.engine)
+        tarefas["uso"] = lambda: telemetria.ler_uso_diario(fontes.engine)
+    with ThreadPoolExecutor(max_workers=len(tarefas)) as pool:
+        futuros = {nome: pool.submit(fn) for nome, fn in tarefas.items()}
+        dados = {nome: fut.result() for nome, fut in futuros.items()}
+
+    df_veiculos = dados.get("veiculos", pd.DataFrame())
+    repo = dados["repositorio"]
+    km_por_placa = fleet_state.mapa_km_total(df_veiculos, repo.get("veiculos_manuais"))
+    pend = fleet_state.calcular_pendencias(repo.get("maintenance_logs"), km_por_placa, limite_atencao)
+    if pend.empty:
+        return pd.DataFrame(columns=COLUNAS)
+    hoje = hoje or configuracao.hoje()
+    pend = fleet_state.projetar_vencimento(pend, fleet_state.mapa_km_dia(df_veiculos, dados.get("uso")), hoje)
+    pend = pend.assign(placa=pend["placa"].astype(str), status_prazo=pend["status_prazo"].astype(str))
+    return pend.reindex(columns=COLUNAS).reset_index(drop=True)
+
+
+def filtrar(pend, status=None, placas=None, servicos=None, responsaveis=None):
+    return fleet_state.filtrar_pendencias(pend, status=status, placas=placas, servicos=servicos, responsaveis=responsaveis)
+
+
+def _texto(v):
+    # 500 / 500.0 -> "500"; vazio -> ""
+    if pd.isna(v):
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+
+def serializar(pend, formato):
+    # bytes no formato pedido. JSON traz também o resumo por status.
+    pend = pend.assign(**{c: pend[c].map(_texto) for c in COLUNAS_TEXTO if c in pend.columns})
+    if formato == "parquet":
+        buf = io.BytesIO()
+        pend.to_parquet(buf, index=False)  # precisa de pyarrow (já vem com o Streamlit)
+        return buf.getvalue()
+    texto = pend.assign(data_prevista=pd.to_datetime(pend["data_prevista"]).dt.strftime("%Y-%m-%d"))
+    if formato == "csv":
+        return texto.to_csv(index=False).encode("utf-8")
+    resumo = pend["status_prazo"].value_counts().reindex(fleet_state.NIVEIS_STATUS, fill_value=0)
+    return json.dumps({
+        "gerado_em": configuracao.agora().isoformat(timespec="seconds"),
+        "total": len(pend),
+        "resumo": {nivel: int(n) for nivel, n in resumo.items()},
+        "pendencias": json.loads(texto.to_json(orient="records", force_ascii=False)),
+    }, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def servir(fontes, porta, host="127.0.0.1", ttl_s=TTL_SERVIDOR_S, limite_atencao=fleet_state.LIMITE_ATENCAO_KM):
+    # Endpoint HTTP local: GET /pendencias?formato=json|csv|parquet&status=..&placa=..&servico=..&responsavel=..
+    # O cálculo é guardado por ttl_s segundos: vários consumidores não multiplicam as leituras.
+    cache = {"pend": None, "em": 0.0}
+    lock = threading.Lock()
+
+    def pendencias():
+        with lock:
+            if cache["pend"] is None or time.monotonic() - cache["em"] >= ttl_s:
+                cache["pend"], cache["em"] = calcular(fontes, limite_atencao), time.monotonic()
+            return cache["pend"]
+
+    class Handler(BaseHTTPRequestHandler):
+        def _responder(self, codigo, corpo, tipo):
+            self.send_response(codigo)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/saude":
+                return self._responder(200, b'{"ok": true}', FORMATOS["json"])
+            if url.path != "/pendencias":
+                return self._responder(404, b'{"erro": "use /pendencias"}', FORMATOS["json"])
+            q = parse_qs(url.query)
+            formato = q.get("formato", ["json"])[0]
+            if formato not in FORMATOS:
+                return self._responder(400, b'{"erro": "formato: json, csv ou parquet"}', FORMATOS["json"])
+            try:
+                pend = filtrar(pendencias(), status=q.get("status"), placas=q.get("placa"),
+                               servicos=q.get("servico"), responsaveis=q.get("responsavel"))
+                corpo = serializar(pend, formato)
+            except Exception as e:
+                print(f"❌ [DEBUG] Falha ao calcular as pendências: {e}", file=sys.stderr)
+                return self._responder(503, json.dumps({"erro": str(e)}, ensure_ascii=False).encode("utf-8"), FORMATOS["json"])
+            self._responder(200, corpo, FORMATOS[formato])
+
+        def log_message(self, fmt, *args):
+            print(f"[{self.log_date_time_string()}] {fmt % args}", file=sys.stderr)
+
+    servidor = ThreadingHTTPServer((host, porta), Handler)
+    print(f"✅ Servindo em http://{host}:{porta}/pendencias", file=sys.stderr)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta as pendências de manutenção da frota inteira (sem Streamlit).")
+    parser.add_argument("-f", "--formato", choices=list(FORMATOS), default="json")
+    parser.add_argument("-o", "--saida", help="Arquivo de saída (padrão: stdout)")
+    parser.add_argument("--status", nargs="+", choices=fleet_state.NIVEIS_STATUS, help="Só estes status")
+    parser.add_argument("--placa", nargs="+", help="Só estas placas")
+    parser.add_argument("--servico", nargs="+", help="Só estes tipos de serviço")
+    parser.add_argument("--responsavel", nargs="+", help="Só estes responsáveis")
+    parser.add_argument("--limite-atencao", type=float, default=fleet_state.LIMITE_ATENCAO_KM,
+                        help=f"KM restante abaixo do qual a O.S. fica em ATENÇÃO (padrão {fleet_state.LIMITE_ATENCAO_KM})")
+    parser.add_argument("--alerta", action="store_true", help="Sai com código 2 se houver O.S. VENCIDA no resultado")
+    parser.add_argument("--servir", type=int, metavar="PORTA", help="Sobe o endpoint HTTP local em vez de exportar")
+    parser.add_argument("--host", default="127.0.0.1", help="Endereço do endpoint (padrão: só local)")
+    parser.add_argument("--url", help="URL do Postgres (padrão: secrets.toml, config.toml ou DATABASE_URL)")
+    parser.add_argument("--planilha", default="frota_db", help="Nome da planilha no Google Drive")
+    parser.add_argument("--credenciais", help="JSON da conta de serviço (padrão: .streamlit/secrets.toml, GCP_CREDENTIALS ou .env)")
+    args = parser.parse_args(argv)
+
+    backend = configuracao.backend()
+    try:
+        fontes = Fontes(configuracao.url_banco(args.url), args.planilha,
+                        configuracao.credenciais_google(args.credenciais) if backend != "postgres" else None, backend)
+    except (RuntimeError, ValueError, OSError) as e:
+        parser.error(str(e))
+
+    if args.servir:
+        # Relido aqui: o .env só é carregado depois do import
+        ttl_s = float(os.getenv("PENDENCIAS_TTL_S", TTL_SERVIDOR_S))
+        servir(fontes, args.servir, args.host, ttl_s, limite_atencao=args.limite_atencao)
+        return 0
+
+    t0 = time.perf_counter()
+    pend = filtrar(calcular(fontes, args.limite_atencao), status=args.status, placas=args.placa,
+                   servicos=args.servico, responsaveis=args.responsavel)
+    corpo = serializar(pend, args.formato)
+    if args.saida:
+        with open(args.saida, "wb") as f:
+            f.write(corpo)
+    else:
+        sys.stdout.buffer.write(corpo)
+        sys.stdout.flush()
+    vencidas = int((pend["status_prazo"] == fleet_state.VENCIDO).sum())
+    print(f"✅ {len(pend)} pendência(s), {vencidas} vencida(s), em {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+    return 2 if args.alerta and vencidas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
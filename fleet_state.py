@@ -0,0 +1,254 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+# Estado da frota (KM atual por placa e situação das O.S. pendentes) calculado só
+# com operações vetorizadas do pandas/NumPy. Não depende do Streamlit: o painel,
+# scripts e relatórios usam as mesmas regras.
+
+LIMITE_ATENCAO_KM = 3000
+# Previsão de vencimento (pelo KM/dia da telemetria) dentro deste prazo gera alerta
+LIMITE_ALERTA_DIAS = 15
+
+VENCIDO = "VENCIDO"
+ATENCAO = "ATENÇÃO"
+NO_PRAZO = "NO PRAZO"
+NIVEIS_STATUS = [VENCIDO, ATENCAO, NO_PRAZO]
+
+COLUNAS_NUMERICAS_LOG = ["km_realizada", "proxima_km", "valor"]
+
+
+def _numerico(serie):
+    return pd.to_numeric(serie, errors="coerce").astype("float64")
+
+
+def mapa_km_total(df_v_sascar, df_v_manual):
+    # Series placa -> KM atual. Telemetria primeiro; cadastro manual sobrescreve.
+    partes = []
+    for df in (df_v_sascar, df_v_manual):
+        if df is None or df.empty or "placa" not in df.columns or "odometro" not in df.columns:
+            continue
+        km = pd.DataFrame({"placa": df["placa"].astype(str), "odometro": _numerico(df["odometro"])})
+        partes.append(km.dropna(subset=["odometro"]))
+    if not partes:
+        return pd.Series(dtype="float64", name="odometro").rename_axis("placa")
+    # keep="last": em placas repetidas vale a última ocorrência, e o manual vem depois
+    km = pd.concat(partes, ignore_index=True).drop_duplicates("placa", keep="last")
+    return km.set_index("placa")["odometro"].sort_index()
+
+
+def tipar_logs(df_logs):
+    # Colunas numéricas como float (vazio -> NaN) e placa como categoria
+    df = df_logs.copy()
+    for col in COLUNAS_NUMERICAS_LOG:
+        if col in df.columns:
+            df[col] = _numerico(df[col])
+    if "placa" in df.columns:
+        df["placa"] = df["placa"].astype(str).astype("category")
+    return df
+
+
+def classificar(km_restante, limite_atencao=LIMITE_ATENCAO_KM):
+    restante = np.asarray(km_restante, dtype="float64")
+    status = np.select(
+        [restante < 0, restante < limite_atencao],
+        [VENCIDO, ATENCAO],
+        default=NO_PRAZO,
+    )
+    return pd.Categorical(status, categories=NIVEIS_STATUS, ordered=True)
+
+
+def calcular_pendencias(df_logs, km_por_placa, limite_atencao=LIMITE_ATENCAO_KM):
+    # Uma linha por O.S. não concluída, com km_atual, meta_km, km_restante e status,
+    # ordenada da mais urgente para a menos urgente.
+    if df_logs is None or df_logs.empty or "status" not in df_logs.columns:
+        return pd.DataFrame()
+    pend = df_logs[df_logs["status"] != "Concluido"]
+    if pend.empty:
+        return pd.DataFrame()
+    pend = tipar_logs(pend)
+
+    km_atual = pend["placa"].astype(str).map(km_por_placa).fillna(0.0).to_numpy(dtype="float64")
+
+    meta = pend["proxima_km"].to_numpy()
+    pend = pend.assign(
+        km_atual=km_atual,
+        # Sem meta: ordena por último, mas conta como meta 0 (igual aos cards antigos)
+        _ordem=meta - km_atual,
+        meta_km=np.nan_to_num(meta, nan=0.0),
+    )
+    pend["km_restante"] = pend["meta_km"] - pend["km_atual"]
+    pend["status_prazo"] = classificar(pend["km_restante"], limite_atencao)
+    pend = pend.sort_values("_ordem", kind="stable", na_position="last").drop(columns="_ordem")
+    return pend
+
+
+def mapa_km_dia(df_veiculos, df_uso):
+    # Series placa -> KM rodado por dia (média da janela do odometro_diario)
+    vazio = pd.Series(dtype="float64", name="km_dia").rename_axis("placa")
+    if df_veiculos is None or df_uso is None or df_veiculos.empty or df_uso.empty:
+        return vazio
+    if not {"id_veiculo", "placa"} <= set(df_veiculos.columns) or not {"id_veiculo", "km_dia"} <= set(df_uso.columns):
+        return vazio
+    uso = pd.DataFrame({"id_veiculo": _numerico(df_uso["id_veiculo"]), "km_dia": _numerico(df_uso["km_dia"])})
+    veic = pd.DataFrame({"id_veiculo": _numerico(df_veiculos["id_veiculo"]), "placa": df_veiculos["placa"].astype(str)})
+    km = veic.merge(uso, on="id_veiculo").dropna(subset=["km_dia"])
+    km = km[km["km_dia"] > 0].drop_duplicates("placa", keep="last")
+    return km.set_index("placa")["km_dia"].sort_index()
+
+
+def projetar_vencimento(pendencias, km_dia_por_placa, hoje=None):
+    # Acrescenta km_dia, dias_restantes e data_prevista (NaT sem telemetria de uso).
+    # Vencidas ficam com data no passado: quando a meta foi ultrapassada, pela média.
+    if pendencias is None or pendencias.empty:
+        return pendencias
+    hoje = pd.Timestamp(hoje or date.today()).normalize()
+    km_dia = pendencias["placa"].astype(str).map(km_dia_por_placa).to_numpy(dtype="float64")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dias = np.where(km_dia > 0, pendencias["km_restante"].to_numpy(dtype="float64") / km_dia, np.nan)
+    dias = np.floor(dias)
+    return pendencias.assign(
+        km_dia=km_dia,
+        dias_restantes=dias,
+        data_prevista=hoje + pd.to_timedelta(dias, unit="D"),
+    )
+
+
+def filtrar_pendencias(pendencias, status=None, placas=None, servicos=None, responsaveis=None):
+    # Filtros vazios/None não restringem nada
+    if pendencias is None or pendencias.empty:
+        return pendencias
+    mascara = np.ones(len(pendencias), dtype=bool)
+    for col, valores in (("status_prazo", status), ("placa", placas),
+                         ("tipo_servico", servicos), ("responsavel", responsaveis)):
+        if valores:
+            mascara &= pendencias[col].astype(str).isin([str(v) for v in valores]).to_numpy()
+    return pendencias[mascara]
+
+
+def resumo_status(pendencias):
+    # Contagem de O.S. por status (inclui níveis zerados)
+    if pendencias is None or pendencias.empty:
+        return pd.Series(0, index=NIVEIS_STATUS, dtype="int64")
+    return pendencias["status_prazo"].value_counts().reindex(NIVEIS_STATUS, fill_value=0)
+
+
+# --- Histórico (O.S. concluídas) ---
+# Mesmas regras da consulta SQL do PostgresRepositorio, para quando o repositório é a
+# planilha e o histórico já está em memória. Colunas dos agregados iguais às do SQL.
+COLUNAS_CUSTO_MES = ["placa", "mes", "servicos", "custo"]
+COLUNAS_CUSTO_SERVICO = ["tipo_servico", "servicos", "custo", "custo_medio"]
+COLUNAS_KM_ENTRE = ["placa", "tipo_servico", "intervalos", "km_medio", "km_min", "km_max"]
+
+
+def datas_servico(serie):
+    # "2024-05-31" (gravado pelo app) ou "31/05/2024" (digitado à mão) -> datetime64 (NaT se inválida)
+    texto = serie.astype(str).str.strip()
+    iso = pd.to_datetime(texto, format="%Y-%m-%d", errors="coerce")
+    br = pd.to_datetime(texto, format="%d/%m/%Y", errors="coerce")
+    return iso.fillna(br)
+
+
+def filtrar_historico(df_logs, placas=None, servicos=None, responsavel=None, de=None, ate=None):
+    # O.S. concluídas que passam nos filtros, mais recentes primeiro (data, depois id).
+    # responsavel: trecho do nome, sem diferenciar maiúsculas; de/ate: datas inclusivas.
+    if df_logs is None or df_logs.empty or "status" not in df_logs.columns:
+        return pd.DataFrame(columns=df_logs.columns if df_logs is not None else [])
+    hist = df_logs[df_logs["status"].astype(str) == "Concluido"]
+    datas = datas_servico(hist["data_realizada"])
+    mascara = np.ones(len(hist), dtype=bool)
+    for col, valores in (("placa", placas), ("tipo_servico", servicos)):
+        if valores:
+            mascara &= hist[col].astype(str).isin([str(v) for v in valores]).to_numpy()
+    if responsavel:
+        mascara &= hist["responsavel"].astype(str).str.contains(responsavel, case=False, regex=False).to_numpy()
+    if de is not None:
+        mascara &= (datas >= pd.Timestamp(de)).to_numpy()
+    if ate is not None:
+        mascara &= (datas <= pd.Timestamp(ate)).to_numpy()
+    ordem = pd.DataFrame({"data": datas, "id": _numerico(hist["id"])})[mascara]
+    ordem = ordem.sort_values(["data", "id"], ascending=False, na_position="first", kind="stable")
+    return hist.loc[ordem.index]
+
+
+def agregar_historico(hist):
+    # {"custo_mes", "custo_servico", "km_entre"} sobre o histórico já filtrado
+    if hist is None or hist.empty:
+        return {
+            "custo_mes": pd.DataFrame(columns=COLUNAS_CUSTO_MES),
+            "custo_servico": pd.DataFrame(columns=COLUNAS_CUSTO_SERVICO),
+            "km_entre": pd.DataFrame(columns=COLUNAS_KM_ENTRE),
+        }
+    base = pd.DataFrame({
+        "placa": hist["placa"].astype(str),
+        "tipo_servico": hist["tipo_servico"].astype(str),
+        "data": datas_servico(hist["data_realizada"]),
+        "km": _numerico(hist["km_realizada"]),
+        "valor": _numerico(hist["valor"]),
+    })
+
+    com_data = base.dropna(subset=["data"]).assign(mes=lambda d: d["data"].dt.strftime("%Y-%m"))
+    custo_mes = (com_data.groupby(["placa", "mes"], sort=False)
+                 .agg(servicos=("valor", "size"), custo=("valor", "sum")).reset_index()
+                 .sort_values(["mes", "placa"], ascending=[False, True], ignore_index=True))
+
+    custo_servico = (base.groupby("tipo_servico", sort=False)
+                     .agg(servicos=("valor", "size"), custo=("valor", "sum"), custo_medio=("valor", "mean")).reset_index()
+                     .sort_values(["custo", "tipo_servico"], ascending=[False, True], ignore_index=True))
+
+    # KM entre serviços do mesmo tipo no mesmo veículo: diferença entre realizações consecutivas
+    km = base[base["km"] > 0].sort_values(["placa", "tipo_servico", "km"], kind="stable")
+    km = km.assign(delta=km.groupby(["placa", "tipo_servico"])["km"].diff())
+    km = km[km["delta"] > 0]
+    km_entre = (km.groupby(["placa", "tipo_servico"])
+                .agg(intervalos=("delta", "size"), km_medio=("delta", "mean"), km_min=("delta", "min"), km_max=("delta", "max"))
+                .reset_index())
+    return {"custo_mes": custo_mes[COLUNAS_CUSTO_MES], "custo_servico": custo_servico[COLUNAS_CUSTO_SERVICO],
+            "km_entre": km_entre[COLUNAS_KM_ENTRE]}
+
+
+# --- Lançamentos em lote (campanhas de serviço) ---
+def _numero_br(serie):
+    # "1.234,56" / "1234,56" / "120.000" / "1234.56" -> float (NaN se inválido)
+    texto = serie.astype(str).str.strip()
+    milhar = texto.str.contains(",", regex=False) | texto.str.fullmatch(r"\d{1,3}(\.\d{3})+")
+    texto = texto.where(~milhar, texto.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    return _numerico(texto)
+
+
+def tabela_campanha(placas, km_por_placa, df_csv=None):
+    # DataFrame placa, km, valor de uma campanha: as placas escolhidas e/ou as linhas de um
+    # CSV (coluna placa e, opcionais, km e valor). KM ausente = KM atual da frota (NaN se
+    # a placa não tem leitura); valor ausente = 0.
+    partes = [pd.DataFrame({"placa": [str(p) for p in placas or []]})]
+    if df_csv is not None and not df_csv.empty:
+        csv = df_csv.rename(columns=lambda c: str(c).strip().lower())
+        if "placa" not in csv.columns:
+            raise ValueError("O CSV precisa de uma coluna 'placa'.")
+        csv = csv[[c for c in ("placa", "km", "valor") if c in csv.columns]].copy()
+        csv["placa"] = csv["placa"].astype(str).str.strip()
+        for col in ("km", "valor"):
+            if col in csv.columns: csv[col] = _numero_br(csv[col])
+        partes.append(csv[csv["placa"] != ""])
+    tabela = pd.concat(partes, ignore_index=True).drop_duplicates("placa", keep="last")
+    for col in ("km", "valor"):
+        if col not in tabela.columns: tabela[col] = np.nan
+    tabela["km"] = _numerico(tabela["km"]).fillna(tabela["placa"].map(km_por_placa))
+    tabela["valor"] = _numerico(tabela["valor"]).fillna(0.0)
+    return tabela[["placa", "km", "valor"]].reset_index(drop=True)
+
+
+def lancamentos_campanha(tabela, servico, intervalo, data, resp="", obs="", concluida=True, agendar=True):
+    # Lançamentos (dicts no formato de FleetDatabase.add_log) da campanha, na mesma regra do
+    # formulário individual: o serviço (feito ou só agendado) e, se feito, o próximo agendamento
+    linhas = []
+    for r in tabela.itertuples(index=False):
+        prox = float(r.km) + intervalo
+        linhas.append({"placa": r.placa, "tipo": servico, "km": float(r.km) if concluida else "", "data": data,
+                       "prox_km": prox, "valor": 0.0 if pd.isna(r.valor) else float(r.valor), "obs": obs, "resp": resp,
+                       "status": "Concluido" if concluida else "Agendado"})
+        if concluida and agendar:
+            linhas.append({"placa": r.placa, "tipo": servico, "km": "", "data": "", "prox_km": prox, "valor": 0,
+                           "obs": "Agendamento automático.", "resp": "", "status": "Agendado"})
+    return linhas
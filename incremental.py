@@ -0,0 +1,133 @@
+import argparse
+import threading
+import time
+
+from sqlalchemy import text
+
+import pg_engine
+
+# Tabelas derivadas de posicoes_raw mantidas por watermark (posicoes_latest e
+# odometro_diario). Cada uma tem sua tabela de controle, com o maior data_hora já
+# processado, e sua chave de advisory lock. O que muda entre elas é só a faixa:
+# aplicar(conn, desde) processa as posições de "desde" em diante (None = tudo) e
+# devolve (linhas afetadas, data_hora máximo processado ou None se não havia nada).
+#
+#   bootstrap  -> cria tabelas/índices e processa o histórico inteiro
+#   atualizar  -> só o que chegou desde o watermark (menos a folga), no máximo uma vez
+#                 a cada intervalo_minimo_s por processo e uma réplica por vez
+
+DDL_CONTROLE = """
+    CREATE TABLE IF NOT EXISTS {tabela} (
+        nome          TEXT PRIMARY KEY,
+        watermark     TIMESTAMPTZ,
+        atualizado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+
+SQL_WATERMARK = """
+    INSERT INTO {tabela} (nome, watermark) VALUES (:nome, :ate)
+    ON CONFLICT (nome) DO UPDATE SET
+        watermark = GREATEST({tabela}.watermark, EXCLUDED.watermark),
+        atualizado_em = now()
+"""
+
+# Necessário para as faixas serem uma varredura por data_hora, não da tabela toda.
+# Fica fora do bootstrap transacional: em posicoes_raw (grande, recebendo o coletor) é
+# criado CONCURRENTLY, fora de transação, para não travar os inserts durante a construção.
+INDICE_RAW = "posicoes_raw_data_hora_idx"
+
+
+def garantir_indice_raw(engine):
+    # Cria o índice de posicoes_raw só se ainda não existe válido (bootstrap seguinte não
+    # faz nada). Um CONCURRENTLY interrompido deixa o índice inválido: é refeito.
+    with engine.connect() as conn:
+        valido = conn.execute(text(
+            "SELECT i.indisvalid FROM pg_index i WHERE i.indexrelid = to_regclass(:nome)"
+        ), {"nome": INDICE_RAW}).scalar()
+    if valido:
+        return False
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if valido is False:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {INDICE_RAW}"))
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDICE_RAW} ON posicoes_raw (data_hora)"))
+    return True
+
+
+class Incremental:
+    def __init__(self, nome, lock_key, ddl, aplicar, intervalo_minimo_s, nao_inicializado):
+        self.nome = nome
+        self.controle = f"{nome}_controle"
+        self.lock_key = lock_key
+        self.ddl = list(ddl) + [DDL_CONTROLE.format(tabela=self.controle)]
+        self.aplicar = aplicar
+        self.intervalo_minimo_s = intervalo_minimo_s
+        self.nao_inicializado = nao_inicializado
+        self._ultima_execucao = {}
+        self._lock = threading.Lock()
+
+    def _processar(self, conn, desde=None):
+        n, ate = self.aplicar(conn, desde)
+        if ate is not None:
+            conn.execute(text(SQL_WATERMARK.format(tabela=self.controle)), {"nome": self.nome, "ate": ate})
+        return n
+
+    def bootstrap(self, engine):
+        # Processa o histórico inteiro (única vez, ou para reconciliar). Pode demorar em bases grandes.
+        garantir_indice_raw(engine)
+        with engine.begin() as conn:
+            for ddl in self.ddl:
+                conn.execute(text(ddl))
+            conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": self.lock_key})
+            n = self._processar(conn)
+        with self._lock:
+            self._ultima_execucao[id(engine)] = time.monotonic()
+        return n
+
+    def get_watermark(self, conn):
+        if conn.execute(text("SELECT to_regclass(:t)"), {"t": self.controle}).scalar() is None:
+            return None
+        return conn.execute(
+            text(f"SELECT watermark FROM {self.controle} WHERE nome = :nome"), {"nome": self.nome}
+        ).scalar()
+
+    def atualizar(self, engine, folga, forcar=False):
+        agora = time.monotonic()
+        with self._lock:
+            ultima = self._ultima_execucao.get(id(engine))
+        if not forcar and ultima is not None and agora - ultima < self.intervalo_minimo_s:
+            return 0
+
+        with engine.begin() as conn:
+            wm = self.get_watermark(conn)
+            if wm is None:
+                raise self.nao_inicializado(f"{self.nome} ainda não foi criado: rode `python {self.nome}.py bootstrap`")
+            # Outra sessão/réplica já está atualizando: o que está gravado serve
+            if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:k)"), {"k": self.lock_key}).scalar():
+                return 0
+            n = self._processar(conn, desde=wm - folga)
+
+        with self._lock:
+            self._ultima_execucao[id(engine)] = agora
+        return n
+
+    def main(self, descricao, unidade, atualizar, argv=None):
+        # CLI comum: bootstrap | refresh (atualizar = a função do módulo, com a folga dele)
+        parser = argparse.ArgumentParser(description=descricao)
+        parser.add_argument("comando", choices=["bootstrap", "refresh"])
+        parser.add_argument("--url", help="URL do Postgres (padrão: secrets.toml, config.toml ou DATABASE_URL)")
+        args = parser.parse_args(argv)
+
+        import configuracao
+        db_url = configuracao.url_banco(args.url)
+        if not db_url:
+            parser.error("DATABASE_URL não encontrada (--url, secrets.toml, config.toml ou env)")
+
+        engine = pg_engine.get_engine(db_url, **configuracao.opcoes_pool())
+        t0 = time.perf_counter()
+        if args.comando == "bootstrap":
+            n = self.bootstrap(engine)
+        else:
+            n = atualizar(engine, forcar=True)
+        with engine.connect() as conn:
+            wm = self.get_watermark(conn)
+        print(f"✅ {args.comando}: {n} {unidade} em {time.perf_counter() - t0:.1f}s (watermark: {wm})")
@@ -0,0 +1,211 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Medições do processo para o painel de desempenho (e para exportar):
+#   - span(nome, **rotulos): duração de um trecho (carga de fonte, SQL, chamada ao
+#     Sheets, fase de renderização);
+#   - contar(nome, **rotulos): contadores (acertos/faltas de cache, erros);
+#   - valor(nome, v, **rotulos): último valor observado (linhas por fonte).
+# Guarda os totais desde o início e um histórico circular das últimas medições, de
+# onde saem os percentis. Exporta em JSON ou no formato texto do Prometheus.
+# Sem dependências: pg_engine, sheets_client e o app importam à vontade.
+
+HISTORICO_PADRAO = 5000
+PREFIXO = "frota"
+
+_lock = threading.Lock()
+_historico = None  # deque de (epoch, nome, rotulos, duracao_s), criado na primeira medição
+_spans = {}       # (nome, rotulos) -> [contagem, soma_s, max_s, erros]
+_contadores = {}  # (nome, rotulos) -> n
+_valores = {}     # (nome, rotulos) -> (valor, epoch)
+_inicio = time.time()
+
+
+def historico_max():
+    # INSTRUMENTACAO_HISTORICO lido na hora (depois do .env), não no import
+    import configuracao
+    configuracao.carregar_env()
+    try:
+        return max(1, int(os.getenv("INSTRUMENTACAO_HISTORICO", HISTORICO_PADRAO)))
+    except ValueError:
+        print(f"❌ [DEBUG] INSTRUMENTACAO_HISTORICO inválido: {os.getenv('INSTRUMENTACAO_HISTORICO')!r}")
+        return HISTORICO_PADRAO
+
+
+def _garantir_historico():
+    # Chamar com _lock
+    global _historico
+    if _historico is None:
+        _historico = deque(maxlen=historico_max())
+    return _historico
+
+
+def _chave(nome, rotulos):
+    return nome, tuple(sorted((k, str(v)) for k, v in rotulos.items()))
+
+
+def registrar_span(nome, duracao_s, erro=False, **rotulos):
+    chave = _chave(nome, rotulos)
+    with _lock:
+        agg = _spans.setdefault(chave, [0, 0.0, 0.0, 0])
+        agg[0] += 1
+        agg[1] += duracao_s
+        agg[2] = max(agg[2], duracao_s)
+        agg[3] += 1 if erro else 0
+        _garantir_historico().append((time.time(), chave[0], chave[1], duracao_s))
+
+
+@contextmanager
+def span(nome, **rotulos):
+    t0 = time.perf_counter()
+    erro = False
+    try:
+        yield
+    except BaseException:
+        erro = True
+        raise
+    finally:
+        registrar_span(nome, time.perf_counter() - t0, erro=erro, **rotulos)
+
+
+def cronometrar(fn, nome, **rotulos):
+    # fn embrulhada num span (para mandar a um pool de threads)
+    def medida(*args, **kwargs):
+        with span(nome, **rotulos):
+            return fn(*args, **kwargs)
+    return medida
+
+
+class Cronometro:
+    # Fases em sequência sem reindentar o código: cada fase() fecha o trecho desde a anterior
+    def __init__(self, nome, **rotulos):
+        self.nome = nome
+        self.rotulos = rotulos
+        self._t0 = self._ultimo = time.perf_counter()
+
+    def fase(self, fase):
+        agora = time.perf_counter()
+        registrar_span(self.nome, agora - self._ultimo, fase=fase, **self.rotulos)
+        self._ultimo = agora
+
+    def total(self, fase="total"):
+        registrar_span(self.nome, time.perf_counter() - self._t0, fase=fase, **self.rotulos)
+
+
+def contar(nome, n=1, **rotulos):
+    chave = _chave(nome, rotulos)
+    with _lock:
+        _contadores[chave] = _contadores.get(chave, 0) + n
+
+
+def valor(nome, v, **rotulos):
+    chave = _chave(nome, rotulos)
+    with _lock:
+        _valores[chave] = (v, time.time())
+
+
+def _percentil(ordenados, p):
+    if not ordenados: return 0.0
+    return ordenados[min(len(ordenados) - 1, int(round(p * (len(ordenados) - 1))))]
+
+
+def resumo_spans():
+    # Uma linha por (span, rótulos): totais desde o início e p50/p95 do histórico recente
+    with _lock:
+        spans = {k: list(v) for k, v in _spans.items()}
+        historico = list(_historico or ())
+    recentes = {}
+    for _, nome, rotulos, d in historico:
+        recentes.setdefault((nome, rotulos), []).append(d)
+    linhas = []
+    for (nome, rotulos), (n, soma, maximo, erros) in sorted(spans.items()):
+        ds = sorted(recentes.get((nome, rotulos), []))
+        linhas.append({
+            "span": nome, "rotulos": dict(rotulos), "contagem": n, "erros": erros,
+            "total_s": soma, "media_ms": 1000 * soma / n if n else 0.0, "max_ms": 1000 * maximo,
+            "p50_ms": 1000 * _percentil(ds, 0.5), "p95_ms": 1000 * _percentil(ds, 0.95),
+        })
+    return linhas
+
+
+def contadores():
+    with _lock:
+        return [{"nome": n, "rotulos": dict(r), "valor": v} for (n, r), v in sorted(_contadores.items())]
+
+
+def valores():
+    with _lock:
+        return [{"nome": n, "rotulos": dict(r), "valor": v, "em": t} for (n, r), (v, t) in sorted(_valores.items())]
+
+
+def historico(ultimos=None):
+    with _lock:
+        itens = list(_historico or ())
+    if ultimos: itens = itens[-ultimos:]
+    return [{"em": t, "span": n, "rotulos": dict(r), "duracao_ms": 1000 * d} for t, n, r, d in itens]
+
+
+def exportar_json(extras=None, ultimos=None):
+    # extras: {grupo: {métrica: número}} de outras fontes (pool do Postgres, cota do Sheets)
+    return json.dumps({
+        "inicio": _inicio, "agora": time.time(),
+        "spans": resumo_spans(), "contadores": contadores(), "valores": valores(),
+        "extras": extras or {}, "historico": historico(ultimos),
+    }, ensure_ascii=False, default=str, indent=2)
+
+
+def _escapar(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _rotulos_prom(rotulos):
+    if not rotulos: return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in sorted(rotulos.items())) + "}"
+
+
+def _nome_prom(nome):
+    return "".join(c if c.isalnum() else "_" for c in nome)
+
+
+def exportar_prometheus(extras=None):
+    # Uma família (# TYPE) por métrica, com as séries de cada combinação de rótulos
+    familias = {}  # nome -> (tipo, [linhas])
+
+    def serie(nome, tipo, rotulos, numero):
+        familias.setdefault(nome, (tipo, []))[1].append(f"{nome}{_rotulos_prom(rotulos)} {numero}")
+
+    for s in resumo_spans():
+        rot = {"span": s["span"], **s["rotulos"]}
+        nome = f"{PREFIXO}_span_segundos"
+        for q, campo in (("0.5", "p50_ms"), ("0.95", "p95_ms")):
+            serie(nome, "summary", {**rot, "quantile": q}, f"{s[campo] / 1000:.6f}")
+        familias[nome][1].append(f"{nome}_sum{_rotulos_prom(rot)} {s['total_s']:.6f}")
+        familias[nome][1].append(f"{nome}_count{_rotulos_prom(rot)} {s['contagem']}")
+        serie(f"{PREFIXO}_span_erros_total", "counter", rot, s["erros"])
+    for c in contadores():
+        serie(f"{PREFIXO}_{_nome_prom(c['nome'])}_total", "counter", c["rotulos"], c["valor"])
+    for v in valores():
+        serie(f"{PREFIXO}_{_nome_prom(v['nome'])}", "gauge", v["rotulos"], v["valor"])
+    for grupo, metricas in (extras or {}).items():
+        for metrica, numero in metricas.items():
+            if isinstance(numero, bool) or not isinstance(numero, (int, float)): continue
+            serie(f"{PREFIXO}_{_nome_prom(grupo)}_{_nome_prom(metrica)}", "gauge", {}, numero)
+
+    linhas = []
+    for nome, (tipo, series) in familias.items():
+        linhas.append(f"# TYPE {nome} {tipo}")
+        linhas.extend(series)
+    return "\n".join(linhas) + "\n"
+
+
+def zerar():
+    global _historico
+    with _lock:
+        _historico = None  # recriado com o limite atual
+        _spans.clear()
+        _contadores.clear()
+        _valores.clear()
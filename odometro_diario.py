@@ -0,0 +1,124 @@
+import os
+from datetime import timedelta
+
+import pandas as pd
+from sqlalchemy import text
+
+import configuracao
+import incremental
+import pg_engine
+
+# Rollup diário do odômetro por veículo, mantido de forma incremental a partir de
+# posicoes_raw (mesmo watermark/lock/CLI do posicoes_latest, em incremental).
+#
+#   odometro_diario           -> 1 linha por (id_veiculo, dia): menor/maior odômetro do dia
+#   odometro_diario_controle  -> watermark: maior data_hora de posicoes_raw já processada
+#
+# Cada atualização recalcula só os dias tocados desde o watermark (menos a folga para
+# posições atrasadas): lê no máximo o dia corrente mais o que chegou, nunca a tabela
+# toda. Como o dia inteiro é recalculado, o upsert substitui a linha e reprocessar é
+# inofensivo. O "dia" segue o fuso FUSO_ROLLUP (configuracao.fuso, padrão
+# America/Sao_Paulo), o mesmo do "hoje" das pendências.
+#
+# Uso:
+#   python odometro_diario.py bootstrap   # cria tabelas/índices e agrega todo o histórico
+#   python odometro_diario.py refresh     # só os dias tocados desde o watermark
+
+NOME_ROLLUP = "odometro_diario"
+FOLGA_PADRAO = timedelta(minutes=int(os.getenv("ODOMETRO_DIARIO_FOLGA_MIN", "60")))
+INTERVALO_MINIMO_S = float(os.getenv("ODOMETRO_DIARIO_INTERVALO_S", "300"))
+JANELA_DIAS = int(os.getenv("ODOMETRO_JANELA_DIAS", "30"))
+# Chave arbitrária para o advisory lock (a do posicoes_latest é 702_314_001)
+LOCK_KEY = 702_314_002
+
+
+class RollupNaoInicializado(RuntimeError):
+    pass
+
+
+DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS odometro_diario (
+        id_veiculo  BIGINT NOT NULL,
+        dia         DATE NOT NULL,
+        km_min      DOUBLE PRECISION NOT NULL,
+        km_max      DOUBLE PRECISION NOT NULL,
+        primeira_em TIMESTAMPTZ NOT NULL,
+        ultima_em   TIMESTAMPTZ NOT NULL,
+        n_posicoes  INTEGER NOT NULL,
+        PRIMARY KEY (id_veiculo, dia)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS odometro_diario_dia_idx ON odometro_diario (dia)",
+]
+
+SQL_AGREGAR = """
+    INSERT INTO odometro_diario (id_veiculo, dia, km_min, km_max, primeira_em, ultima_em, n_posicoes)
+    SELECT id_veiculo, data_hora::date, min(odometro), max(odometro), min(data_hora), max(data_hora), count(*)
+    FROM posicoes_raw
+    WHERE data_hora <= :ate AND odometro > 0 {filtro_desde}
+    GROUP BY id_veiculo, data_hora::date
+    ON CONFLICT (id_veiculo, dia) DO UPDATE SET
+        km_min      = EXCLUDED.km_min,
+        km_max      = EXCLUDED.km_max,
+        primeira_em = EXCLUDED.primeira_em,
+        ultima_em   = EXCLUDED.ultima_em,
+        n_posicoes  = EXCLUDED.n_posicoes
+"""
+
+# KM/dia de cada veículo na janela: do primeiro dia com dado até hoje (dias parado contam).
+# "Hoje" no mesmo fuso dos dias do rollup, não no da sessão.
+SQL_TAXA = """
+    SELECT id_veiculo,
+           (max(km_max) - min(km_min)) / (((now() AT TIME ZONE :fuso)::date - min(dia)) + 1) AS km_dia,
+           count(*) AS dias_com_dado,
+           max(dia) AS ultimo_dia
+    FROM odometro_diario
+    WHERE dia >= (now() AT TIME ZONE :fuso)::date - CAST(:janela AS integer)
+    GROUP BY id_veiculo
+"""
+
+
+def _aplicar_faixa(conn, desde=None):
+    # Dia conforme o fuso configurado (vale só para esta transação)
+    conn.execute(text("SELECT set_config('TimeZone', :fuso, true)"), {"fuso": configuracao.fuso()})
+    # Recalcula desde o início do dia de "desde": o dia inteiro, não só as posições novas
+    filtro = " AND data_hora >= date_trunc('day', :desde)" if desde is not None else ""
+    params = {"desde": desde} if desde is not None else {}
+    filtro_max = " WHERE data_hora > :desde" if desde is not None else ""
+    ate = conn.execute(text(f"SELECT max(data_hora) FROM posicoes_raw{filtro_max}"), params).scalar()
+    if ate is None:
+        return 0, None
+    res = conn.execute(text(SQL_AGREGAR.format(filtro_desde=filtro)), {**params, "ate": ate})
+    return res.rowcount, ate
+
+
+_incremental = incremental.Incremental(NOME_ROLLUP, LOCK_KEY, DDL, _aplicar_faixa, INTERVALO_MINIMO_S, RollupNaoInicializado)
+
+
+def bootstrap(engine):
+    # Agrega o histórico inteiro (única vez, ou para reconciliar). Pode demorar em bases grandes.
+    return _incremental.bootstrap(engine)
+
+
+def get_watermark(conn):
+    return _incremental.get_watermark(conn)
+
+
+def atualizar(engine, folga=FOLGA_PADRAO, forcar=False):
+    # Refresh incremental. Retorna quantas linhas (veículo, dia) foram recalculadas.
+    return _incremental.atualizar(engine, folga, forcar)
+
+
+def taxa_uso(engine, janela_dias=JANELA_DIAS):
+    # DataFrame id_veiculo, km_dia, dias_com_dado, ultimo_dia (só a tabela pequena do rollup)
+    with pg_engine.conectar(engine) as conn:
+        return pd.read_sql_query(text(SQL_TAXA), conn, params={"janela": janela_dias, "fuso": configuracao.fuso()})
+
+
+def main(argv=None):
+    _incremental.main("Mantém o rollup diário de odômetro por veículo (odometro_diario).", "dias-veículo recalculados", atualizar, argv)
+
+
+if __name__ == "__main__":
+    main()
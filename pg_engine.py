@@ -0,0 +1,179 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import instrumentacao
+
+# Engine único por processo (por URL). Fica fora do app.py de propósito:
+# o Streamlit reexecuta o script principal a cada rerun, mas módulos
+# importados permanecem em sys.modules, então o pool sobrevive entre
+# reruns e é compartilhado por todas as sessões.
+#
+# SQLAlchemy (e o driver) só são importados na criação do primeiro engine:
+# importar o módulo não custa nada a quem ainda não usa o Postgres.
+
+POOL_DEFAULTS = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_timeout": 30,
+    "pool_recycle": 1800,
+    "pool_pre_ping": True,
+}
+
+_lock = threading.Lock()
+_engines = {}
+_stats = {}
+
+
+def _novo_stats():
+    return {
+        "conexoes_abertas": 0,   # conexões físicas criadas (handshake TCP+TLS+auth)
+        "conexoes_invalidas": 0,  # descartadas pelo pre-ping ou por erro
+        "checkouts": 0,
+        "esperas": 0,
+        "espera_total_s": 0.0,
+        "espera_max_s": 0.0,
+        "timeouts": 0,
+    }
+
+
+def _registrar_eventos(engine, stats):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, conn_record):
+        with _lock:
+            stats["conexoes_abertas"] += 1
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_conn, conn_record, conn_proxy):
+        with _lock:
+            stats["checkouts"] += 1
+
+    @event.listens_for(engine, "invalidate")
+    def _on_invalidate(dbapi_conn, conn_record, exception):
+        with _lock:
+            stats["conexoes_invalidas"] += 1
+
+    # Tempo de cada consulta, para o painel de desempenho (instrumentacao)
+    @event.listens_for(engine, "before_cursor_execute")
+    def _antes_sql(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_sql_inicio", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _depois_sql(conn, cursor, statement, parameters, context, executemany):
+        inicio = conn.info.get("_sql_inicio")
+        if inicio:
+            instrumentacao.registrar_span("sql", time.perf_counter() - inicio.pop(), consulta=rotulo_sql(statement))
+
+    @event.listens_for(engine, "handle_error")
+    def _erro_sql(contexto):
+        inicio = contexto.connection.info.get("_sql_inicio") if contexto.connection is not None else None
+        if inicio:
+            instrumentacao.registrar_span("sql", time.perf_counter() - inicio.pop(), erro=True,
+                                          consulta=rotulo_sql(contexto.statement or ""))
+
+
+def rotulo_sql(statement):
+    # Rótulo curto e de baixa cardinalidade: comando + primeira tabela ("SELECT veiculos")
+    comando = (statement.split(None, 1) or ["?"])[0].upper()
+    m = re.search(r"\b(?:FROM|INTO|UPDATE|TABLE|EXISTS)\s+([A-Za-z_][\w.]*)", statement, re.IGNORECASE)
+    return f"{comando} {m.group(1)}" if m else comando
+
+
+def get_engine(db_url, **pool_opts):
+    # Reaproveita o engine já criado para a URL; as opções de pool só valem
+    # na primeira criação.
+    engine = _engines.get(db_url)
+    if engine is not None:
+        return engine
+    with _lock:
+        engine = _engines.get(db_url)
+        if engine is None:
+            from sqlalchemy import create_engine
+            opts = {**POOL_DEFAULTS, **{k: v for k, v in pool_opts.items() if v is not None}}
+            engine = create_engine(db_url, **opts)
+            stats = _novo_stats()
+            _registrar_eventos(engine, stats)
+            _engines[db_url] = engine
+            _stats[id(engine)] = stats
+    return engine
+
+
+def engine_existente(db_url):
+    # O engine da URL se já foi criado, sem criar (nem importar o SQLAlchemy)
+    return _engines.get(db_url)
+
+
+@contextmanager
+def conectar(engine):
+    # Igual a engine.connect(), mas mede quanto tempo se esperou por uma
+    # conexão livre do pool.
+    from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+    stats = _stats.get(id(engine))
+    t0 = time.perf_counter()
+    try:
+        conn = engine.connect()
+    except PoolTimeoutError:
+        if stats is not None:
+            with _lock:
+                stats["timeouts"] += 1
+        raise
+    espera = time.perf_counter() - t0
+    if stats is not None:
+        with _lock:
+            stats["esperas"] += 1
+            stats["espera_total_s"] += espera
+            stats["espera_max_s"] = max(stats["espera_max_s"], espera)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+@contextmanager
+def transacao(engine):
+    # Igual a engine.begin() (commit no fim, rollback em exceção), medindo a espera do pool
+    with conectar(engine) as conn, conn.begin():
+        yield conn
+
+
+def contadores_escrita(conn, tabelas):
+    # {tabela: linhas inseridas+alteradas+excluídas} segundo o pg_stat_user_tables: serve de
+    # versão barata da tabela (sem varrê-la). O servidor publica as estatísticas com algum
+    # atraso (~1s, mais sob carga); tabela inexistente fica de fora.
+    from sqlalchemy import text
+    res = conn.execute(text(
+        "SELECT relname, n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_user_tables"
+        " WHERE relid IN (SELECT to_regclass(t) FROM unnest(CAST(:tabelas AS text[])) AS t)"
+    ), {"tabelas": list(tabelas)})
+    return dict(res.fetchall())
+
+
+def pool_stats(engine):
+    if engine is None:
+        return {}
+    pool = engine.pool
+    info = {"pool": type(pool).__name__}
+    for nome in ("size", "checkedin", "checkedout", "overflow"):
+        fn = getattr(pool, nome, None)
+        if callable(fn):
+            info[nome] = fn()
+    if "overflow" in info:
+        # QueuePool conta o overflow a partir de -pool_size; só interessa o que passou do pool
+        info["overflow"] = max(0, info["overflow"])
+    stats = _stats.get(id(engine), {})
+    with _lock:
+        info.update(stats)
+    esperas = info.get("esperas", 0)
+    info["espera_media_ms"] = round(1000 * info.get("espera_total_s", 0.0) / esperas, 2) if esperas else 0.0
+    return info
+
+
+def dispose_all():
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _stats.clear()
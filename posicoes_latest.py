@@ -0,0 +1,109 @@
+import os
+from datetime import timedelta
+
+from sqlalchemy import text
+
+import incremental
+
+# Snapshot "última posição por veículo" mantido de forma incremental.
+#
+#   posicoes_latest           -> 1 linha por id_veiculo (mesmos tipos de posicoes_raw)
+#   posicoes_latest_controle  -> watermark: maior data_hora de posicoes_raw já processada
+#
+# Cada atualização só lê as posições com data_hora acima do watermark (menos uma
+# folga para posições que chegam atrasadas), então o custo depende do volume novo
+# e não do histórico inteiro. O upsert só sobrescreve se a posição for mais nova,
+# por isso reprocessar a folga é inofensivo. Watermark, lock e CLI: incremental.
+#
+# Uso:
+#   python posicoes_latest.py bootstrap   # cria tabelas/índices e faz a carga completa
+#   python posicoes_latest.py refresh     # processa só o que chegou desde o watermark
+
+NOME_SNAPSHOT = "posicoes_latest"
+FOLGA_PADRAO = timedelta(minutes=int(os.getenv("POSICOES_LATEST_FOLGA_MIN", "60")))
+INTERVALO_MINIMO_S = float(os.getenv("POSICOES_LATEST_INTERVALO_S", "30"))
+# Chave arbitrária para o advisory lock: evita duas réplicas atualizando ao mesmo tempo
+LOCK_KEY = 702_314_001
+
+
+class SnapshotNaoInicializado(RuntimeError):
+    pass
+
+
+DDL = [
+    # Herda os tipos de posicoes_raw sem precisar conhecê-los aqui
+    """
+    CREATE TABLE IF NOT EXISTS posicoes_latest AS
+    SELECT id_veiculo, data_hora, odometro, latitude, longitude
+    FROM posicoes_raw
+    WITH NO DATA
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS posicoes_latest_id_veiculo_key ON posicoes_latest (id_veiculo)",
+]
+
+SQL_UPSERT = """
+    INSERT INTO posicoes_latest (id_veiculo, data_hora, odometro, latitude, longitude)
+    {origem}
+    ON CONFLICT (id_veiculo) DO UPDATE SET
+        data_hora = EXCLUDED.data_hora,
+        odometro  = EXCLUDED.odometro,
+        latitude  = EXCLUDED.latitude,
+        longitude = EXCLUDED.longitude
+    WHERE posicoes_latest.data_hora IS NULL OR posicoes_latest.data_hora <= EXCLUDED.data_hora
+"""
+
+SQL_ORIGEM_RAW = """
+    SELECT DISTINCT ON (id_veiculo) id_veiculo, data_hora, odometro, latitude, longitude
+    FROM posicoes_raw
+    WHERE data_hora <= :ate {filtro_desde}
+    ORDER BY id_veiculo, data_hora DESC
+"""
+
+
+def _aplicar_faixa(conn, desde=None):
+    # Fecha a faixa em "ate" antes do upsert: o que chegar durante a execução
+    # fica para a próxima rodada, e o watermark não pula posições.
+    filtro = " AND data_hora > :desde" if desde is not None else ""
+    params = {"desde": desde} if desde is not None else {}
+    ate = conn.execute(text(f"SELECT max(data_hora) FROM posicoes_raw WHERE true{filtro}"), params).scalar()
+    if ate is None:
+        return 0, None
+    origem = SQL_ORIGEM_RAW.format(filtro_desde=filtro)
+    res = conn.execute(text(SQL_UPSERT.format(origem=origem)), {**params, "ate": ate})
+    return res.rowcount, ate
+
+
+_incremental = incremental.Incremental(NOME_SNAPSHOT, LOCK_KEY, DDL, _aplicar_faixa, INTERVALO_MINIMO_S, SnapshotNaoInicializado)
+
+
+def bootstrap(engine):
+    # Carga completa (única vez, ou para reconciliar). Pode demorar em bases grandes.
+    return _incremental.bootstrap(engine)
+
+
+def get_watermark(conn):
+    return _incremental.get_watermark(conn)
+
+
+def atualizar(engine, folga=FOLGA_PADRAO, forcar=False):
+    # Refresh incremental. Retorna quantos veículos tiveram a posição atualizada.
+    return _incremental.atualizar(engine, folga, forcar)
+
+
+def upsert_posicoes(engine, registros):
+    # Caminho de escrita direta para o coletor: ao gravar em posicoes_raw, pode
+    # já manter o snapshot. registros = [{id_veiculo, data_hora, odometro, latitude, longitude}]
+    if not registros:
+        return 0
+    origem = "VALUES (:id_veiculo, :data_hora, :odometro, :latitude, :longitude)"
+    with engine.begin() as conn:
+        conn.execute(text(SQL_UPSERT.format(origem=origem)), list(registros))
+    return len(registros)
+
+
+def main(argv=None):
+    _incremental.main("Mantém o snapshot posicoes_latest (última posição por veículo).", "veículos atualizados", atualizar, argv)
+
+
+if __name__ == "__main__":
+    main()
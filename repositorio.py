@@ -0,0 +1,685 @@
+import argparse
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import pandas as pd
+
+import pg_engine
+from write_queue import NAO_COALESCE
+
+# Onde moram manutenções (maintenance_logs), KM manual (veiculos_manuais) e tipos de
+# serviço (service_types). Telemetria (veiculos/posicoes_raw) é sempre Postgres e fica
+# no FleetDatabase. Duas implementações:
+#   - SheetsRepositorio: a planilha frota_db (padrão);
+#   - PostgresRepositorio: tabelas indexadas no mesmo banco da telemetria, escrita em
+#     transação. Migração: python repositorio.py importar
+#
+# Nenhuma das duas depende do Streamlit; o app escolhe pelo [storage] backend do
+# config.toml ou STORAGE_BACKEND.
+#
+# gspread e sqlalchemy são importados só no primeiro uso do backend correspondente:
+# importar este módulo (app, scripts) não carrega o cliente que não vai ser usado.
+
+LOG_COLS = ["id", "placa", "tipo_servico", "km_realizada", "data_realizada", "proxima_km", "responsavel", "valor", "obs", "status"]
+DEFAULT_SERVICES = ["Troca de Óleo Motor", "Troca de Óleo Cambio e Diferencial", "Pneus", "Freios", "Correia", "Filtros", "Suspensão", "Elétrica", "Outros"]
+ABAS = ("veiculos_manuais", "maintenance_logs", "service_types")
+SEQ_IDS = "maintenance_logs_id_seq"
+
+
+class Repositorio(ABC):
+    # carregar(): {nome: DataFrame}, service_types como lista. maintenance_logs traz pelo
+    # menos todas as O.S. em aberto; o histórico completo é de historico().
+    # Falha de acesso levanta exceção (quem chama decide se degrada).
+    @abstractmethod
+    def carregar(self, nomes=ABAS):
+        ...
+
+    # Grava uma operação do journal (write_queue): True = gravada, False = não há o que
+    # gravar (linha não existe), exceção = falha transitória.
+    @abstractmethod
+    def aplicar(self, operacao, payload, replay=False):
+        ...
+
+    # n ids novos para maintenance_logs: únicos e crescentes, não necessariamente consecutivos
+    @abstractmethod
+    def reservar_ids(self, n):
+        ...
+
+    # Dos ids pedidos, os que não existem em maintenance_logs (como str, na ordem pedida)
+    @abstractmethod
+    def logs_inexistentes(self, ids):
+        ...
+
+    # Histórico de O.S. concluídas, filtrado e paginado no backend: (DataFrame com LOG_COLS,
+    # mais recente primeiro; total de linhas que passam nos filtros). filtros: placas,
+    # servicos, responsavel, de, ate (ver fleet_state.filtrar_historico). None = o backend
+    # não filtra no servidor: aí o app usa o fleet_state sobre o maintenance_logs carregado.
+    def historico(self, filtros=None, limite=None, deslocamento=0):
+        return None
+
+    # {nome: versão} de cada aba pedida, consulta barata que muda quando o conteúdo muda:
+    # a recarga periódica só relê o que mudou. None = backend sem versão (relê sempre).
+    def versoes(self, nomes=ABAS):
+        return None
+
+    # Custo por veículo/mês, custo por tipo de serviço e KM entre serviços do histórico
+    # filtrado ({"custo_mes", "custo_servico", "km_entre"}, colunas do fleet_state), ou None.
+    def agregados_historico(self, filtros=None):
+        return None
+
+
+# Operações do journal e payloads (ver Repositorio.aplicar):
+#   manual_km {placa, km} | append_log {row} | update_log {log_id, valores: {coluna: valor}}
+#   | delete_log {log_id} | append_logs {rows} | update_logs {itens: [{log_id, valores}]}
+# Os dois últimos são lotes (campanhas de serviço): uma chamada à planilha / uma transação.
+def coalescer(op_a, payload_a, op_b, payload_b):
+    # Junta duas operações seguidas na mesma linha (mesma chave do journal) numa só
+    if op_a == op_b == "manual_km":
+        return op_b, payload_b
+    if op_b == "delete_log":
+        # Linha incluída e excluída antes de chegar à planilha: nada a gravar
+        return None if op_a == "append_log" else (op_b, payload_b)
+    if op_b == "update_log":
+        if op_a == "update_log":
+            return op_a, {**payload_a, "valores": {**payload_a["valores"], **payload_b["valores"]}}
+        if op_a == "append_log":
+            row = list(payload_a["row"])
+            for c, v in payload_b["valores"].items():
+                row[int(c) - 1] = v
+            return op_a, {**payload_a, "row": row}
+    return NAO_COALESCE
+
+
+# --- Google Sheets ---
+class LogRowIndex:
+    # Índice id -> linha da planilha maintenance_logs, montado a partir da coluna de ids
+    # já carregada. Evita o ws.find() (varredura no servidor) em cada escrita.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._linhas = {}
+
+    def reconstruir(self, ids, primeira_linha=2):
+        with self._lock:
+            self._linhas = {str(i): primeira_linha + pos for pos, i in enumerate(ids) if str(i) != ""}
+
+    def linha(self, log_id):
+        with self._lock:
+            return self._linhas.get(str(log_id))
+
+    def registrar(self, log_id, linha):
+        with self._lock:
+            self._linhas[str(log_id)] = linha
+
+    def remover(self, log_id):
+        # ws.delete_rows desloca para cima tudo que estava abaixo da linha removida
+        with self._lock:
+            linha = self._linhas.pop(str(log_id), None)
+            if linha is None: return
+            for k, v in self._linhas.items():
+                if v > linha: self._linhas[k] = v - 1
+
+    def __len__(self):
+        return len(self._linhas)
+
+
+def _max_id(valores):
+    ids = [int(x) for x in valores if str(x).isdigit()]
+    return max(ids) if ids else 0
+
+
+class LogIdAllocator:
+    # Gera ids de maintenance_logs sem baixar a coluna de ids a cada inserção.
+    # Com Postgres configurado usa uma SEQUENCE (nextval é atômico entre sessões e réplicas,
+    # mas pode pular números: ids únicos e crescentes, não consecutivos). Só sem Postgres
+    # usa um contador local do processo, que é seguro apenas com uma instância do app.
+    SEQ = SEQ_IDS
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._piso = 0       # maior id já visto na planilha
+        self._proximo = None  # contador local (fallback)
+
+    def observar(self, ids):
+        # Chamado a cada carga de maintenance_logs: mantém o piso sem leitura extra
+        with self._lock:
+            self._piso = max(self._piso, _max_id(ids))
+
+    def reservar(self, n, engine, ler_ids_planilha):
+        # Devolve n ids novos, únicos e crescentes, na ordem de uso. ler_ids_planilha() só é
+        # chamado na primeira vez (criar a sequence ou semear o contador local).
+        # Com Postgres configurado a falha da sequence sobe: cair no contador local ali
+        # arriscaria ids repetidos entre réplicas.
+        if engine is not None:
+            try:
+                return self._reservar_pg(n, engine, ler_ids_planilha)
+            except Exception as e:
+                print(f"❌ [DEBUG] Sequence de ids indisponível com Postgres configurado: {e}")
+                raise RuntimeError(f"Sequence de ids indisponível (contador local desativado com Postgres): {e}") from e
+        return self._reservar_local(n, ler_ids_planilha)
+
+    def _reservar_pg(self, n, engine, ler_ids_planilha):
+        with engine.begin() as conn:
+            if conn.execute(_sql("SELECT to_regclass(:s)"), {"s": self.SEQ}).scalar() is None:
+                self.observar(ler_ids_planilha())
+                conn.execute(_sql(f"CREATE SEQUENCE IF NOT EXISTS {self.SEQ} START WITH {self._piso + 1}"))
+            sql_ids = _sql(f"SELECT nextval('{self.SEQ}') FROM generate_series(1, :n)")
+            ids = sorted(r[0] for r in conn.execute(sql_ids, {"n": n}))
+            if ids[0] <= self._piso:
+                # Alguém gravou ids direto na planilha: avança a sequence para depois deles
+                conn.execute(_sql(f"SELECT setval('{self.SEQ}', :piso) WHERE (SELECT last_value FROM {self.SEQ}) < :piso"), {"piso": self._piso})
+                ids = sorted(r[0] for r in conn.execute(sql_ids, {"n": n}))
+        self.observar(ids)
+        return ids
+
+    def _reservar_local(self, n, ler_ids_planilha):
+        with self._lock:
+            if self._proximo is None:
+                self._piso = max(self._piso, _max_id(ler_ids_planilha()))
+            self._proximo = max(self._proximo or 0, self._piso + 1)
+            ids = list(range(self._proximo, self._proximo + n))
+            self._proximo += n
+            self._piso = max(self._piso, ids[-1])
+        return ids
+
+
+def _sql(consulta):
+    from sqlalchemy import text
+    return text(consulta)
+
+
+def valores_para_df(values):
+    # Mesmo resultado de ws.get_all_records(): 1ª linha é o cabeçalho, números convertidos
+    from gspread.utils import numericise_all
+    if not values: return pd.DataFrame()
+    header = values[0]
+    rows = [numericise_all(list(r[:len(header)]) + [""] * (len(header) - len(r))) for r in values[1:]]
+    return pd.DataFrame(rows, columns=header)
+
+
+def valores_para_servicos(values):
+    # Equivalente a ws.col_values(2) sem o cabeçalho
+    vals = [r[1] if len(r) > 1 else "" for r in values]
+    while vals and vals[-1] == "": vals.pop()
+    return vals[1:] if len(vals) > 1 else list(DEFAULT_SERVICES)
+
+
+def completar_logs(df):
+    if df.empty: df = pd.DataFrame(columns=LOG_COLS)
+    for col in LOG_COLS:
+        if col not in df.columns: df[col] = ""
+    return df
+
+
+class SheetsRepositorio(Repositorio):
+    # conectar(): Spreadsheet do gspread (ou None); engine(): engine do Postgres (ou None),
+    # usado só pela sequence de ids.
+    def __init__(self, conectar, engine=None):
+        self._conectar = conectar
+        self._engine = engine or (lambda: None)
+        self._lock = threading.Lock()
+        self._abas = None
+        self.index = LogRowIndex()
+        self.ids = LogIdAllocator()
+
+    def _planilha(self):
+        sh = self._conectar()
+        if not sh: raise RuntimeError("Google Sheets indisponível")
+        return sh
+
+    def _aba(self, title):
+        # Uma única leitura de metadados resolve todas as abas; os handles ficam guardados.
+        # Novas tentativas/backoff em 429 e 5xx ficam a cargo do sheets_client.
+        sh = self._planilha()
+        with self._lock:
+            abas = self._abas
+        if abas is None:
+            try:
+                abas = {ws.title: ws for ws in sh.worksheets()}
+                with self._lock:
+                    self._abas = abas
+            except Exception as e:
+                print(f"❌ [DEBUG] Falha ao ler metadados da planilha: {e}")
+                abas = {}
+        if title in abas: return abas[title]
+        # Aba criada depois (ou metadados falharam): busca direta e renova na próxima
+        ws = sh.worksheet(title)
+        with self._lock:
+            self._abas = None
+        return ws
+
+    def _localizar_log(self, ws, log_id):
+        # Linha do log pelo índice em memória, conferida com a leitura de UMA célula.
+        # Se a planilha mudou por fora (outra sessão inseriu/apagou), reconstrói pela coluna A.
+        row = self.index.linha(log_id)
+        if row and str(ws.cell(row, 1).value) == str(log_id):
+            return row
+        self.index.reconstruir(ws.col_values(1)[1:])
+        return self.index.linha(log_id)
+
+    def versoes(self, nomes=ABAS):
+        # modifiedTime do arquivo no Drive: uma chamada para a planilha toda (qualquer aba
+        # editada, inclusive por nós, muda a versão de todas)
+        modificada = self._planilha().get_lastUpdateTime()
+        return {nome: modificada for nome in nomes}
+
+    def carregar(self, nomes=ABAS):
+        # Lê todas as abas pedidas em UMA chamada (values:batchGet) e monta os DataFrames localmente
+        resp = self._planilha().values_batch_get([f"'{nome}'" for nome in nomes])
+        out = {}
+        for nome, vr in zip(nomes, resp.get("valueRanges", [])):
+            values = vr.get("values", [])
+            if nome == "service_types":
+                out[nome] = valores_para_servicos(values)
+                continue
+            df = valores_para_df(values)
+            if nome == "maintenance_logs":
+                ids = [r[0] if r else "" for r in values[1:]]
+                self.index.reconstruir(ids)
+                self.ids.observar(ids)
+                df = completar_logs(df)
+            out[nome] = df
+        return out
+
+    def reservar_ids(self, n):
+        return self.ids.reservar(n, self._engine(), lambda: self._aba("maintenance_logs").col_values(1)[1:])
+
+    def logs_inexistentes(self, ids):
+        # Uma leitura da coluna de ids, que também renova o índice de linhas
+        self.index.reconstruir(self._aba("maintenance_logs").col_values(1)[1:])
+        return [str(i) for i in ids if not self.index.linha(i)]
+
+    def _ranges_linha(self, row, valores_por_coluna):
+        # Colunas consecutivas da linha viram um único range do values:batchUpdate
+        from gspread.utils import rowcol_to_a1
+        blocos = []
+        for col in sorted(valores_por_coluna):
+            if blocos and col == blocos[-1][0] + len(blocos[-1][1]):
+                blocos[-1][1].append(valores_por_coluna[col])
+            else:
+                blocos.append((col, [valores_por_coluna[col]]))
+        return [{"range": f"{rowcol_to_a1(row, c)}:{rowcol_to_a1(row, c + len(v) - 1)}", "values": [v]} for c, v in blocos]
+
+    def _update_row(self, ws, row, valores_por_coluna):
+        # Grava várias células da linha em UMA chamada (values:batchUpdate).
+        # USER_ENTERED = mesmo efeito do update_cell.
+        ws.batch_update(self._ranges_linha(row, valores_por_coluna), value_input_option="USER_ENTERED")
+
+    def _registrar_append(self, resp, ids):
+        # A resposta traz o range gravado (ex.: "maintenance_logs!A57:J58"): linhas consecutivas
+        m = re.search(r"![A-Z]+(\d+)", (resp or {}).get("updates", {}).get("updatedRange", ""))
+        if m:
+            for k, log_id in enumerate(ids):
+                self.index.registrar(log_id, int(m.group(1)) + k)
+
+    def aplicar(self, operacao, payload, replay=False):
+        if operacao == "manual_km":
+            ws = self._aba("veiculos_manuais")
+            cell = ws.find(payload["placa"], in_column=1)
+            if cell:
+                ws.update_cell(cell.row, 2, payload["km"])
+            else:
+                ws.append_row([payload["placa"], payload["km"]])
+            return True
+
+        ws = self._aba("maintenance_logs")
+        if operacao == "append_log":
+            row = payload["row"]
+            # Reexecução depois de queda: a linha pode ter entrado antes da confirmação no journal
+            if replay and self._localizar_log(ws, row[0]): return True
+            self._registrar_append(ws.append_row(row), [row[0]])
+            return True
+
+        if operacao == "append_logs":
+            rows = payload["rows"]
+            if replay:
+                # Parte do lote pode ter entrado antes da queda: confere a coluna de ids uma vez
+                self.index.reconstruir(ws.col_values(1)[1:])
+                rows = [r for r in rows if not self.index.linha(r[0])]
+                if not rows: return True
+            self._registrar_append(ws.append_rows(rows), [r[0] for r in rows])
+            return True
+
+        if operacao == "update_logs":
+            # Uma leitura da coluna de ids (em vez de conferir célula por O.S.) e um único batchUpdate
+            faltando = self.logs_inexistentes([item["log_id"] for item in payload["itens"]])
+            data = []
+            for item in payload["itens"]:
+                if str(item["log_id"]) in faltando: continue
+                row = self.index.linha(item["log_id"])
+                data.extend(self._ranges_linha(row, {int(c): v for c, v in item["valores"].items()}))
+            if faltando:
+                print(f"❌ [DEBUG] O.S. {', '.join(faltando)} não encontrada(s) na planilha ({operacao})")
+            if not data: return False
+            ws.batch_update(data, value_input_option="USER_ENTERED")
+            return True
+
+        row = self._localizar_log(ws, payload["log_id"])
+        if not row:
+            print(f"❌ [DEBUG] O.S. {payload['log_id']} não encontrada na planilha ({operacao})")
+            return False
+        if operacao == "update_log":
+            self._update_row(ws, row, {int(c): v for c, v in payload["valores"].items()})
+        elif operacao == "delete_log":
+            ws.delete_rows(row)
+            self.index.remover(payload["log_id"])
+        else:
+            raise ValueError(f"Operação desconhecida: {operacao}")
+        return True
+
+
+# --- Postgres ---
+SQL_ESQUEMA = [
+    """CREATE TABLE IF NOT EXISTS maintenance_logs (
+        id BIGINT PRIMARY KEY,
+        placa TEXT NOT NULL,
+        tipo_servico TEXT NOT NULL DEFAULT '',
+        km_realizada DOUBLE PRECISION,
+        data_realizada DATE,
+        proxima_km DOUBLE PRECISION,
+        responsavel TEXT NOT NULL DEFAULT '',
+        valor NUMERIC(12, 2),
+        obs TEXT NOT NULL DEFAULT '',
+        status TEXT NOT NULL DEFAULT 'Agendado'
+    )""",
+    "CREATE INDEX IF NOT EXISTS maintenance_logs_placa_idx ON maintenance_logs (placa)",
+    # Pendências: índice parcial só com as O.S. em aberto (o que o painel lê a cada carga)
+    "CREATE INDEX IF NOT EXISTS maintenance_logs_abertas_idx ON maintenance_logs (placa, id) WHERE status <> 'Concluido'",
+    "CREATE INDEX IF NOT EXISTS maintenance_logs_status_data_idx ON maintenance_logs (status, data_realizada DESC, id DESC)",
+    "CREATE TABLE IF NOT EXISTS veiculos_manuais (placa TEXT PRIMARY KEY, odometro DOUBLE PRECISION)",
+    "CREATE TABLE IF NOT EXISTS service_types (id SERIAL PRIMARY KEY, nome TEXT NOT NULL UNIQUE)",
+    f"CREATE SEQUENCE IF NOT EXISTS {SEQ_IDS}",
+]
+
+# Colunas de maintenance_logs em ordem (1 = id), como os números de coluna do journal
+SQL_COLS_LOG = ", ".join(LOG_COLS)
+SQL_SELECT_LOG = (
+    "SELECT id, placa, tipo_servico, km_realizada, to_char(data_realizada, 'YYYY-MM-DD') AS data_realizada,"
+    " proxima_km, responsavel, valor::float8 AS valor, obs, status FROM maintenance_logs"
+)
+
+
+# Agregados do histórico: mesmas colunas de fleet_state.agregar_historico
+SQL_CUSTO_MES = """
+    SELECT placa, to_char(data_realizada, 'YYYY-MM') AS mes, count(*) AS servicos,
+           coalesce(sum(valor), 0)::float8 AS custo
+    FROM maintenance_logs WHERE {filtro} AND data_realizada IS NOT NULL
+    GROUP BY 1, 2 ORDER BY mes DESC, placa
+"""
+SQL_CUSTO_SERVICO = """
+    SELECT tipo_servico, count(*) AS servicos, coalesce(sum(valor), 0)::float8 AS custo,
+           avg(valor)::float8 AS custo_medio
+    FROM maintenance_logs WHERE {filtro}
+    GROUP BY 1 ORDER BY custo DESC, tipo_servico
+"""
+SQL_KM_ENTRE = """
+    SELECT placa, tipo_servico, count(*) AS intervalos, avg(delta) AS km_medio,
+           min(delta) AS km_min, max(delta) AS km_max
+    FROM (
+        SELECT placa, tipo_servico,
+               km_realizada - lag(km_realizada) OVER (PARTITION BY placa, tipo_servico ORDER BY km_realizada) AS delta
+        FROM maintenance_logs WHERE {filtro} AND km_realizada > 0
+    ) t
+    WHERE delta > 0
+    GROUP BY 1, 2 ORDER BY placa, tipo_servico
+"""
+
+
+def _filtro_historico(filtros):
+    # WHERE das O.S. concluídas + parâmetros; segue o índice (status, data_realizada, id)
+    filtros = filtros or {}
+    condicoes, params = ["status = 'Concluido'"], {}
+    for chave, coluna in (("placas", "placa"), ("servicos", "tipo_servico")):
+        if filtros.get(chave):
+            condicoes.append(f"{coluna} = ANY(:{chave})")
+            params[chave] = [str(v) for v in filtros[chave]]
+    if filtros.get("responsavel"):
+        trecho = re.sub(r"([\\%_])", r"\\\1", str(filtros["responsavel"]))
+        condicoes.append("responsavel ILIKE :responsavel")
+        params["responsavel"] = f"%{trecho}%"
+    for chave, operador in (("de", ">="), ("ate", "<=")):
+        if filtros.get(chave) is not None:
+            condicoes.append(f"data_realizada {operador} :{chave}")
+            params[chave] = filtros[chave]
+    return " AND ".join(condicoes), params
+
+
+def _numero(v):
+    if v is None or (isinstance(v, str) and v.strip() == ""): return None
+    try:
+        n = float(str(v).replace(",", ".")) if isinstance(v, str) else float(v)
+    except (TypeError, ValueError):
+        return None
+    return None if pd.isna(n) else n
+
+
+def _data(v):
+    # Planilha: "2024-05-31" (gravado pelo app) ou "31/05/2024" (digitado à mão)
+    if v is None or str(v).strip() == "": return None
+    texto = str(v).strip()
+    d = pd.to_datetime(texto, errors="coerce", dayfirst=not re.match(r"\d{4}-", texto))
+    return None if pd.isna(d) else d.date()
+
+
+def _texto(v):
+    return "" if v is None or (not isinstance(v, str) and pd.isna(v)) else str(v)
+
+
+# Conversão de cada coluna de maintenance_logs para o tipo da tabela
+CONVERSORES_LOG = {
+    "id": lambda v: int(float(v)), "placa": _texto, "tipo_servico": _texto, "km_realizada": _numero,
+    "data_realizada": _data, "proxima_km": _numero, "responsavel": _texto, "valor": _numero,
+    "obs": _texto, "status": lambda v: _texto(v) or "Agendado",
+}
+
+
+def _registro_log(valores):
+    # valores: {coluna: valor cru (planilha/formulário)} -> {coluna: valor tipado}
+    return {col: CONVERSORES_LOG[col](v) for col, v in valores.items()}
+
+
+def _df_logs(linhas, colunas):
+    df = pd.DataFrame(linhas, columns=colunas)
+    for col in ("placa", "tipo_servico", "responsavel", "obs", "status", "data_realizada"):
+        df[col] = df[col].fillna("")
+    return completar_logs(df)
+
+
+def _logs_existentes(conn, ids):
+    # Conjunto dos ids (int) de maintenance_logs que existem, entre os pedidos
+    if not ids: return set()
+    return {r[0] for r in conn.execute(_sql("SELECT id FROM maintenance_logs WHERE id = ANY(:ids)"), {"ids": list(ids)})}
+
+
+class PostgresRepositorio(Repositorio):
+    def __init__(self, engine):
+        self.engine = engine
+
+    def criar_esquema(self):
+        with pg_engine.transacao(self.engine) as conn:
+            for sql in SQL_ESQUEMA:
+                conn.execute(_sql(sql))
+            self._acertar_sequence(conn)
+
+    def _acertar_sequence(self, conn):
+        # Depois de importar (ou de ids gravados por fora), a sequence segue o maior id
+        conn.execute(_sql(
+            f"SELECT setval('{SEQ_IDS}', m) FROM (SELECT max(id) AS m FROM maintenance_logs) s"
+            f" WHERE m IS NOT NULL AND m >= (SELECT last_value FROM {SEQ_IDS})"
+        ))
+
+    def carregar(self, nomes=ABAS):
+        out = {}
+        with pg_engine.conectar(self.engine) as conn:
+            for nome in nomes:
+                if nome == "maintenance_logs":
+                    res = conn.execute(_sql(f"{SQL_SELECT_LOG} WHERE status <> 'Concluido' ORDER BY id"))
+                    out[nome] = _df_logs(res.fetchall(), list(res.keys()))
+                elif nome == "veiculos_manuais":
+                    res = conn.execute(_sql("SELECT placa, odometro FROM veiculos_manuais ORDER BY placa"))
+                    out[nome] = pd.DataFrame(res.fetchall(), columns=list(res.keys()))
+                elif nome == "service_types":
+                    servicos = [r[0] for r in conn.execute(_sql("SELECT nome FROM service_types ORDER BY id"))]
+                    out[nome] = servicos or list(DEFAULT_SERVICES)
+        return out
+
+    def versoes(self, nomes=ABAS):
+        # Contadores de escrita do pg_stat (atraso de ~1s; a idade máxima do cache cobre o resto)
+        with pg_engine.conectar(self.engine) as conn:
+            escritas = pg_engine.contadores_escrita(conn, nomes)
+        return {nome: escritas.get(nome) for nome in nomes}
+
+    def historico(self, filtros=None, limite=None, deslocamento=0):
+        filtro, params = _filtro_historico(filtros)
+        pagina = " LIMIT :limite OFFSET :deslocamento" if limite is not None else ""
+        with pg_engine.conectar(self.engine) as conn:
+            res = conn.execute(
+                _sql(f"{SQL_SELECT_LOG} WHERE {filtro} ORDER BY data_realizada DESC, id DESC{pagina}"),
+                {**params, "limite": limite, "deslocamento": deslocamento},
+            )
+            df = _df_logs(res.fetchall(), list(res.keys()))
+            if limite is None or (deslocamento == 0 and len(df) < limite):
+                return df, len(df)
+            total = conn.execute(_sql(f"SELECT count(*) FROM maintenance_logs WHERE {filtro}"), params).scalar()
+        return df, total
+
+    def agregados_historico(self, filtros=None):
+        filtro, params = _filtro_historico(filtros)
+        out = {}
+        with pg_engine.conectar(self.engine) as conn:
+            for nome, sql in (("custo_mes", SQL_CUSTO_MES), ("custo_servico", SQL_CUSTO_SERVICO),
+                              ("km_entre", SQL_KM_ENTRE)):
+                res = conn.execute(_sql(sql.format(filtro=filtro)), params)
+                out[nome] = pd.DataFrame(res.fetchall(), columns=list(res.keys()))
+        return out
+
+    def logs_inexistentes(self, ids):
+        with pg_engine.conectar(self.engine) as conn:
+            existentes = _logs_existentes(conn, [int(float(i)) for i in ids])
+        return [str(i) for i in ids if int(float(i)) not in existentes]
+
+    def reservar_ids(self, n):
+        with pg_engine.transacao(self.engine) as conn:
+            res = conn.execute(_sql(f"SELECT nextval('{SEQ_IDS}') FROM generate_series(1, :n)"), {"n": n})
+            return sorted(r[0] for r in res)
+
+    def aplicar(self, operacao, payload, replay=False):
+        # Cada operação numa transação; append/KM são upserts, então reexecutar é seguro
+        with pg_engine.transacao(self.engine) as conn:
+            if operacao == "manual_km":
+                conn.execute(_sql(
+                    "INSERT INTO veiculos_manuais (placa, odometro) VALUES (:placa, :km)"
+                    " ON CONFLICT (placa) DO UPDATE SET odometro = excluded.odometro"
+                ), {"placa": str(payload["placa"]), "km": _numero(payload["km"])})
+                return True
+            if operacao == "append_log":
+                reg = _registro_log(dict(zip(LOG_COLS, payload["row"])))
+                conn.execute(_sql(
+                    f"INSERT INTO maintenance_logs ({SQL_COLS_LOG}) VALUES ({', '.join(':' + c for c in LOG_COLS)})"
+                    " ON CONFLICT (id) DO NOTHING"
+                ), reg)
+                return True
+            if operacao == "append_logs":
+                regs = [_registro_log(dict(zip(LOG_COLS, row))) for row in payload["rows"]]
+                conn.execute(_sql(
+                    f"INSERT INTO maintenance_logs ({SQL_COLS_LOG}) VALUES ({', '.join(':' + c for c in LOG_COLS)})"
+                    " ON CONFLICT (id) DO NOTHING"
+                ), regs)
+                return True
+            if operacao == "update_logs":
+                # Um executemany por conjunto de colunas (numa baixa em lote, normalmente um só)
+                grupos = {}
+                for item in payload["itens"]:
+                    reg = _registro_log({LOG_COLS[int(c) - 1]: v for c, v in item["valores"].items()})
+                    grupos.setdefault(tuple(reg), []).append({**reg, "_id": int(float(item["log_id"]))})
+                # rowcount não é confiável em executemany: confere as O.S. existentes antes
+                existentes = _logs_existentes(conn, [r["_id"] for regs in grupos.values() for r in regs])
+                for cols, regs in grupos.items():
+                    sets = ", ".join(f"{col} = :{col}" for col in cols)
+                    conn.execute(_sql(f"UPDATE maintenance_logs SET {sets} WHERE id = :_id"), regs)
+                faltando = [str(item["log_id"]) for item in payload["itens"] if int(float(item["log_id"])) not in existentes]
+                if faltando:
+                    print(f"❌ [DEBUG] O.S. {', '.join(faltando)} não encontrada(s) no Postgres ({operacao})")
+                return bool(existentes)
+            log_id = int(float(payload["log_id"]))
+            if operacao == "update_log":
+                reg = _registro_log({LOG_COLS[int(c) - 1]: v for c, v in payload["valores"].items()})
+                sets = ", ".join(f"{col} = :{col}" for col in reg)
+                n = conn.execute(_sql(f"UPDATE maintenance_logs SET {sets} WHERE id = :_id"), {**reg, "_id": log_id}).rowcount
+            elif operacao == "delete_log":
+                n = conn.execute(_sql("DELETE FROM maintenance_logs WHERE id = :_id"), {"_id": log_id}).rowcount
+                # Reexecução: a exclusão pode ter sido confirmada antes da queda
+                n = n or replay
+            else:
+                raise ValueError(f"Operação desconhecida: {operacao}")
+        if not n:
+            print(f"❌ [DEBUG] O.S. {log_id} não encontrada no Postgres ({operacao})")
+        return bool(n)
+
+    def importar(self, dados, substituir=False):
+        # dados: saída de SheetsRepositorio.carregar(). Tudo numa transação: ou entra a
+        # planilha inteira, ou nada. substituir=True apaga antes o que já estava nas tabelas.
+        logs = dados.get("maintenance_logs", pd.DataFrame())
+        logs = logs[logs["id"].astype(str).str.strip() != ""] if not logs.empty else logs
+        registros = [_registro_log({c: r.get(c, "") for c in LOG_COLS}) for r in logs.to_dict("records")]
+        manuais = dados.get("veiculos_manuais", pd.DataFrame())
+        km_manual = [{"placa": str(r["placa"]), "km": _numero(r.get("odometro"))}
+                     for r in manuais.to_dict("records") if str(r.get("placa", "")).strip()]
+        servicos = [{"nome": s} for s in dict.fromkeys(dados.get("service_types") or []) if str(s).strip()]
+
+        with pg_engine.transacao(self.engine) as conn:
+            if substituir:
+                conn.execute(_sql("TRUNCATE maintenance_logs, veiculos_manuais, service_types RESTART IDENTITY"))
+            if registros:
+                conn.execute(_sql(
+                    f"INSERT INTO maintenance_logs ({SQL_COLS_LOG}) VALUES ({', '.join(':' + c for c in LOG_COLS)})"
+                    f" ON CONFLICT (id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in LOG_COLS[1:])}"
+                ), registros)
+            if km_manual:
+                conn.execute(_sql(
+                    "INSERT INTO veiculos_manuais (placa, odometro) VALUES (:placa, :km)"
+                    " ON CONFLICT (placa) DO UPDATE SET odometro = excluded.odometro"
+                ), km_manual)
+            if servicos:
+                conn.execute(_sql("INSERT INTO service_types (nome) VALUES (:nome) ON CONFLICT (nome) DO NOTHING"), servicos)
+            self._acertar_sequence(conn)
+        return {"maintenance_logs": len(registros), "veiculos_manuais": len(km_manual), "service_types": len(servicos)}
+
+
+# --- migração planilha -> Postgres ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migra manutenções, KM manual e serviços da planilha para o Postgres.")
+    parser.add_argument("comando", choices=["esquema", "importar"])
+    parser.add_argument("--url", help="URL do Postgres (padrão: secrets.toml, config.toml ou DATABASE_URL)")
+    parser.add_argument("--planilha", default="frota_db", help="Nome da planilha no Google Drive")
+    parser.add_argument("--credenciais", help="JSON da conta de serviço (padrão: .streamlit/secrets.toml, GCP_CREDENTIALS ou .env)")
+    parser.add_argument("--substituir", action="store_true", help="Apaga o que já estiver nas tabelas antes de importar")
+    args = parser.parse_args(argv)
+
+    import configuracao
+    db_url = configuracao.url_banco(args.url)
+    if not db_url:
+        parser.error("DATABASE_URL não encontrada (--url, secrets.toml, config.toml ou env)")
+    repo_pg = PostgresRepositorio(pg_engine.get_engine(db_url, **configuracao.opcoes_pool()))
+    repo_pg.criar_esquema()
+    if args.comando == "esquema":
+        print("✅ Tabelas e índices criados")
+        return
+
+    creds = configuracao.credenciais_google(args.credenciais)
+    if not creds:
+        parser.error("Credenciais do Google não encontradas (--credenciais, secrets.toml, GCP_CREDENTIALS ou .env)")
+    import gspread
+    import sheets_client
+    gc = gspread.service_account_from_dict(creds, http_client=sheets_client.QuotaHTTPClient)
+    sh = gc.open(args.planilha)
+    t0 = time.perf_counter()
+    dados = SheetsRepositorio(lambda: sh).carregar()
+    contagem = repo_pg.importar(dados, substituir=args.substituir)
+    resumo = ", ".join(f"{n} {nome}" for nome, n in contagem.items())
+    print(f"✅ Importado em {time.perf_counter() - t0:.1f}s: {resumo}")
+
+
+if __name__ == "__main__":
+    main()
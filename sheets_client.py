@@ -0,0 +1,113 @@
+import os
+import random
+import threading
+import time
+from http import HTTPStatus
+
+from gspread.exceptions import APIError
+from gspread.http_client import HTTPClient
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout as RequestsTimeout
+
+import instrumentacao
+
+# Todo o tráfego do gspread passa por QuotaHTTPClient (ver FleetDatabase._get_connection):
+#   - token bucket único por processo, dimensionado pela cota por minuto do Google,
+#     compartilhado por todas as sessões do Streamlit;
+#   - backoff exponencial com jitter em 429/408/5xx e falhas de rede;
+#   - contadores de chamadas, novas tentativas e tempo segurado pelo limitador;
+#   - duração de cada requisição (span "sheets" em instrumentacao).
+
+QUOTA_POR_MINUTO = float(os.getenv("SHEETS_QUOTA_POR_MIN", "60"))
+RAJADA = float(os.getenv("SHEETS_RAJADA", "10"))
+MAX_TENTATIVAS = int(os.getenv("SHEETS_MAX_TENTATIVAS", "6"))
+BACKOFF_BASE_S = 1.0
+BACKOFF_MAX_S = 32.0
+
+# Erros em que o Google recusou a requisição sem processá-la
+_RECUSADAS = {HTTPStatus.TOO_MANY_REQUESTS, HTTPStatus.REQUEST_TIMEOUT}
+
+
+class TokenBucket:
+    def __init__(self, por_minuto, capacidade):
+        self.taxa = por_minuto / 60.0
+        self.capacidade = max(1.0, capacidade)
+        self._tokens = self.capacidade
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def adquirir(self):
+        # Bloqueia até haver uma ficha; devolve quanto tempo esperou
+        esperado = 0.0
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._tokens = min(self.capacidade, self._tokens + (agora - self._ultimo) * self.taxa)
+                self._ultimo = agora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return esperado
+                falta = (1 - self._tokens) / self.taxa
+            time.sleep(falta)
+            esperado += falta
+
+
+_limitador = TokenBucket(QUOTA_POR_MINUTO, RAJADA)
+_stats_lock = threading.Lock()
+_stats = {
+    "chamadas": 0,         # requisições efetivamente enviadas (inclui novas tentativas)
+    "novas_tentativas": 0,
+    "erros_429": 0,
+    "erros_5xx": 0,
+    "falhas": 0,           # desistiu depois de MAX_TENTATIVAS ou erro não retentável
+    "espera_limitador_s": 0.0,
+    "espera_backoff_s": 0.0,
+}
+
+
+def _somar(**valores):
+    with _stats_lock:
+        for k, v in valores.items():
+            _stats[k] += v
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _retentavel(err, metodo):
+    code = getattr(err, "code", None)
+    # A Drive API responde 403 quando a cota estoura
+    erros = getattr(err, "error", {}).get("errors") or [{}]
+    if code in _RECUSADAS or (code == HTTPStatus.FORBIDDEN and erros[0].get("domain") == "usageLimits"):
+        return True
+    # 5xx e falha de rede podem ter chegado a executar: só repete o que é idempotente.
+    # POST (append, delete_rows) repetido poderia duplicar linha ou apagar a vizinha.
+    if str(metodo).lower() not in ("get", "put"):
+        return False
+    return isinstance(err, (RequestsConnectionError, RequestsTimeout)) or (isinstance(code, int) and code >= 500)
+
+
+class QuotaHTTPClient(HTTPClient):
+    def request(self, *args, **kwargs):
+        metodo = args[0] if args else kwargs.get("method")
+        tentativa = 0
+        while True:
+            _somar(chamadas=1, espera_limitador_s=_limitador.adquirir())
+            try:
+                with instrumentacao.span("sheets", metodo=str(metodo).upper()):
+                    return super().request(*args, **kwargs)
+            except (APIError, RequestsConnectionError, RequestsTimeout) as err:
+                code = getattr(err, "code", None)
+                if code == HTTPStatus.TOO_MANY_REQUESTS:
+                    _somar(erros_429=1)
+                elif isinstance(code, int) and code >= 500:
+                    _somar(erros_5xx=1)
+                tentativa += 1
+                if tentativa >= MAX_TENTATIVAS or not _retentavel(err, metodo):
+                    _somar(falhas=1)
+                    raise
+                # "Full jitter": espalha as novas tentativas das várias sessões
+                espera = random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** tentativa))
+                _somar(novas_tentativas=1, espera_backoff_s=espera)
+                time.sleep(espera)
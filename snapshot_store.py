@@ -0,0 +1,82 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+# Cópia em disco do último conjunto de dados bom (uma linha por fonte), para o
+# painel abrir na hora depois de deploy/restart enquanto os dados são
+# revalidados em segundo plano. SQLite dá escrita atômica mesmo com várias
+# réplicas no mesmo volume; o valor vai em pickle porque as abas da planilha
+# têm colunas com tipos misturados (int e "") que precisam voltar iguais.
+# O arquivo é gerado e lido só por este app.
+
+CAMINHO_PADRAO = os.path.join(".cache", "frota_snapshot.sqlite")
+
+_lock = threading.Lock()
+
+
+def _conectar(caminho):
+    pasta = os.path.dirname(caminho)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+    conn = sqlite3.connect(caminho, timeout=10)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS snapshot ("
+        " nome TEXT PRIMARY KEY, salvo_em REAL NOT NULL, dados BLOB NOT NULL)"
+    )
+    return conn
+
+
+def caminho_padrao():
+    # SNAPSHOT_PATH lido na hora da chamada, não no import: o .env só é carregado depois
+    return os.getenv("SNAPSHOT_PATH", CAMINHO_PADRAO)
+
+
+def salvar(valores, caminho=None):
+    # valores: {nome: DataFrame/lista}. Falha de disco não pode derrubar o painel.
+    caminho = caminho or caminho_padrao()
+    if not valores:
+        return False
+    agora = time.time()
+    linhas = [(nome, agora, pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)) for nome, valor in valores.items()]
+    try:
+        with _lock:
+            conn = _conectar(caminho)
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO snapshot (nome, salvo_em, dados) VALUES (?, ?, ?) "
+                        "ON CONFLICT(nome) DO UPDATE SET salvo_em = excluded.salvo_em, dados = excluded.dados",
+                        linhas,
+                    )
+            finally:
+                conn.close()
+        return True
+    except Exception as e:
+        print(f"❌ [DEBUG] Falha ao gravar snapshot em {caminho}: {e}")
+        return False
+
+
+def carregar(caminho=None):
+    # {nome: (valor, salvo_em)}; vazio se ainda não há snapshot
+    caminho = caminho or caminho_padrao()
+    if not os.path.exists(caminho):
+        return {}
+    try:
+        with _lock:
+            conn = _conectar(caminho)
+            try:
+                linhas = conn.execute("SELECT nome, salvo_em, dados FROM snapshot").fetchall()
+            finally:
+                conn.close()
+    except Exception as e:
+        print(f"❌ [DEBUG] Falha ao ler snapshot em {caminho}: {e}")
+        return {}
+    out = {}
+    for nome, salvo_em, dados in linhas:
+        try:
+            out[nome] = (pickle.loads(dados), salvo_em)
+        except Exception as e:
+            print(f"❌ [DEBUG] Snapshot de {nome} ilegível, ignorando: {e}")
+    return out
@@ -0,0 +1,89 @@
+import pandas as pd
+
+import odometro_diario
+import pg_engine
+import posicoes_latest
+
+# Leituras da telemetria (veiculos, última posição e KM/dia de cada um) no Postgres, sem
+# Streamlit: o painel (FleetDatabase.get_dataframe), o benchmark e scripts usam as
+# mesmas consultas.
+
+SQL_ULTIMA_POSICAO_RAW = """(
+                        SELECT DISTINCT ON (id_veiculo) id_veiculo, data_hora, odometro, latitude, longitude
+                        FROM posicoes_raw
+                        ORDER BY id_veiculo, data_hora DESC
+                    )"""
+
+
+def fonte_ultima_posicao(engine):
+    # Lê do snapshot posicoes_latest (atualizado só com as posições novas).
+    # Sem bootstrap, cai no DISTINCT ON sobre posicoes_raw inteiro.
+    try:
+        posicoes_latest.atualizar(engine)
+        return "posicoes_latest"
+    except posicoes_latest.SnapshotNaoInicializado as e:
+        print(f"⚠️ [DEBUG] {e}")
+    except Exception as e:
+        print(f"❌ [DEBUG] Falha ao atualizar posicoes_latest, usando posicoes_raw: {e}")
+    return SQL_ULTIMA_POSICAO_RAW
+
+
+def ler_veiculos(engine):
+    # Query com JOIN para pegar o último odômetro
+    query = f"""
+        SELECT v.id_sascar as id_veiculo, v.placa, p.odometro 
+        FROM veiculos v
+        LEFT JOIN {fonte_ultima_posicao(engine)} p ON v.id_sascar = p.id_veiculo
+    """
+    with pg_engine.conectar(engine) as conn:
+        return pd.read_sql_query(query, conn)
+
+
+def ler_posicoes(engine):
+    query = f"""
+        SELECT 
+            id_veiculo, 
+            data_hora as timestamp, 
+            odometro, 
+            latitude, 
+            longitude 
+        FROM {fonte_ultima_posicao(engine)} p
+    """
+    with pg_engine.conectar(engine) as conn:
+        return pd.read_sql_query(query, conn)
+
+
+def ler_uso_diario(engine):
+    # KM/dia por veículo (odometro_diario); vazio se o rollup ainda não foi criado
+    try:
+        odometro_diario.atualizar(engine)
+    except odometro_diario.RollupNaoInicializado as e:
+        print(f"⚠️ [DEBUG] {e}")
+        return pd.DataFrame(columns=["id_veiculo", "km_dia", "dias_com_dado", "ultimo_dia"])
+    except Exception as e:
+        print(f"❌ [DEBUG] Falha ao atualizar odometro_diario, usando o rollup como está: {e}")
+    return odometro_diario.taxa_uso(engine)
+
+
+def versoes(engine, nomes=("vehicles", "positions", "km_dia")):
+    # Versão barata de cada fonte, para só recarregar o que mudou (None = desconhecida,
+    # recarrega). É a do que a próxima leitura vai enxergar: roda antes o refresh incremental
+    # (com o mesmo intervalo mínimo) e usa o watermark de posicoes_latest / odometro_diario.
+    # Veículos mudam com a última posição ou com escrita na tabela veiculos.
+    nomes = set(nomes)
+    for modulo, fontes in ((posicoes_latest, {"vehicles", "positions"}), (odometro_diario, {"km_dia"})):
+        if nomes & fontes:
+            try:
+                modulo.atualizar(engine)
+            except Exception as e:
+                print(f"⚠️ [DEBUG] Sem refresh de {modulo.__name__} na sondagem: {e}")
+    with pg_engine.conectar(engine) as conn:
+        wm_posicoes = posicoes_latest.get_watermark(conn)
+        wm_km_dia = odometro_diario.get_watermark(conn) if "km_dia" in nomes else None
+        escritas = pg_engine.contadores_escrita(conn, ["veiculos"]) if "vehicles" in nomes else {}
+    out = {
+        "positions": wm_posicoes,
+        "vehicles": (wm_posicoes, escritas["veiculos"]) if wm_posicoes is not None and "veiculos" in escritas else None,
+        "km_dia": wm_km_dia,
+    }
+    return {nome: out[nome] for nome in nomes if nome in out}
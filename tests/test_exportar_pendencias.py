@@ -0,0 +1,36 @@
+import io
+import json
+from datetime import date
+
+import pandas as pd
+
+import exportar_pendencias
+
+
+def _pendencias_mistas():
+    # Como vem da planilha: célula numérica vira int no meio das de texto
+    return pd.DataFrame({
+        "id": [1, "2"], "placa": ["ABC1D23", 1234], "tipo_servico": ["Freios", "Pneus"],
+        "responsavel": ["João", 123], "status_prazo": ["VENCIDO", "NO PRAZO"],
+        "km_atual": [1000.0, 2000.0], "meta_km": [900.0, 5000.0], "km_restante": [-100.0, 3000.0],
+        "km_dia": [50.0, float("nan")], "dias_restantes": [-2.0, float("nan")],
+        "data_prevista": [date(2026, 1, 1), None], "obs": [500, None],
+    }).reindex(columns=exportar_pendencias.COLUNAS)
+
+
+def test_parquet_ida_e_volta_com_tipos_misturados():
+    corpo = exportar_pendencias.serializar(_pendencias_mistas(), "parquet")
+    lido = pd.read_parquet(io.BytesIO(corpo))
+    assert lido["responsavel"].tolist() == ["João", "123"]
+    assert lido["obs"].tolist() == ["500", ""]
+    assert lido["placa"].tolist() == ["ABC1D23", "1234"]
+    assert lido["km_restante"].tolist() == [-100.0, 3000.0]
+
+
+def test_json_e_csv_com_tipos_misturados():
+    dados = json.loads(exportar_pendencias.serializar(_pendencias_mistas(), "json"))
+    assert dados["total"] == 2
+    assert dados["pendencias"][1]["responsavel"] == "123"
+    assert dados["pendencias"][0]["data_prevista"] == "2026-01-01"
+    csv = pd.read_csv(io.BytesIO(exportar_pendencias.serializar(_pendencias_mistas(), "csv")), dtype=str)
+    assert csv["obs"].tolist()[0] == "500"
@@ -0,0 +1,100 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import fleet_state
+import repositorio
+from write_queue import NAO_COALESCE
+
+
+def _logs(linhas):
+    return pd.DataFrame(linhas, columns=repositorio.LOG_COLS)
+
+
+def test_classificar_limites():
+    status = fleet_state.classificar([-1, 0, 2999, 3000, np.nan])
+    assert list(status) == [fleet_state.VENCIDO, fleet_state.ATENCAO, fleet_state.ATENCAO,
+                            fleet_state.NO_PRAZO, fleet_state.NO_PRAZO]
+    assert list(status.categories) == fleet_state.NIVEIS_STATUS
+
+
+def test_classificar_vazio():
+    assert len(fleet_state.classificar([])) == 0
+
+
+def test_calcular_pendencias_sem_logs():
+    assert fleet_state.calcular_pendencias(None, pd.Series(dtype="float64")).empty
+    assert fleet_state.calcular_pendencias(pd.DataFrame(), pd.Series(dtype="float64")).empty
+    assert fleet_state.calcular_pendencias(_logs([]), pd.Series(dtype="float64")).empty
+
+
+def test_calcular_pendencias_so_concluidas():
+    logs = _logs([[1, "AAA1A11", "Freios", 1000, "2026-01-01", 5000, "", 0, "", "Concluido"]])
+    assert fleet_state.calcular_pendencias(logs, pd.Series({"AAA1A11": 2000.0})).empty
+
+
+def test_calcular_pendencias_sem_km_e_sem_meta():
+    # Placa sem leitura de KM conta como 0; O.S. sem meta vai para o fim com meta 0
+    logs = _logs([
+        [1, "SEMKM00", "Pneus", "", "", 4000, "", "", "", "Agendado"],
+        [2, "AAA1A11", "Freios", "", "", "", "", "", "", "Agendado"],
+        [3, "AAA1A11", "Óleo", "", "", 10500, "", "", "", "Agendado"],
+    ])
+    pend = fleet_state.calcular_pendencias(logs, pd.Series({"AAA1A11": 11000.0}))
+    assert pend["id"].tolist() == [3, 1, 2]
+    assert pend["km_atual"].tolist() == [11000.0, 0.0, 11000.0]
+    assert pend["meta_km"].tolist() == [10500.0, 4000.0, 0.0]
+    assert list(pend["status_prazo"]) == [fleet_state.VENCIDO, fleet_state.NO_PRAZO, fleet_state.VENCIDO]
+
+
+def test_projetar_vencimento_vazio():
+    vazio = pd.DataFrame()
+    assert fleet_state.projetar_vencimento(vazio, pd.Series(dtype="float64")) is vazio
+    assert fleet_state.projetar_vencimento(None, pd.Series(dtype="float64")) is None
+
+
+def test_projetar_vencimento_sem_uso_ou_uso_zero():
+    pend = pd.DataFrame({"placa": ["PARADO0", "SEMUSO0", "RODA000", "VENCID0"],
+                         "km_restante": [1000.0, 1000.0, 1000.0, -100.0]})
+    km_dia = pd.Series({"PARADO0": 0.0, "RODA000": 300.0, "VENCID0": 50.0})
+    proj = fleet_state.projetar_vencimento(pend, km_dia, hoje=date(2026, 1, 10))
+    assert np.isnan(proj["dias_restantes"].iloc[0]) and pd.isna(proj["data_prevista"].iloc[0])
+    assert np.isnan(proj["dias_restantes"].iloc[1]) and pd.isna(proj["data_prevista"].iloc[1])
+    assert proj["dias_restantes"].iloc[2] == 3
+    assert proj["data_prevista"].iloc[2] == pd.Timestamp("2026-01-13")
+    # Vencida: data no passado
+    assert proj["data_prevista"].iloc[3] == pd.Timestamp("2026-01-08")
+
+
+def test_mapa_km_dia_ignora_uso_zero():
+    veiculos = pd.DataFrame({"id_veiculo": [1, 2], "placa": ["AAA1A11", "BBB2B22"]})
+    uso = pd.DataFrame({"id_veiculo": [1, 2], "km_dia": [0.0, 120.5]})
+    assert fleet_state.mapa_km_dia(veiculos, uso).to_dict() == {"BBB2B22": 120.5}
+    assert fleet_state.mapa_km_dia(veiculos, pd.DataFrame()).empty
+
+
+def test_coalescer_km_manual_fica_o_ultimo():
+    assert repositorio.coalescer("manual_km", {"placa": "A", "km": 1}, "manual_km", {"placa": "A", "km": 2}) == \
+        ("manual_km", {"placa": "A", "km": 2})
+
+
+def test_coalescer_inclusao_e_exclusao_se_anulam():
+    assert repositorio.coalescer("append_log", {"row": [7]}, "delete_log", {"log_id": "7"}) is None
+    assert repositorio.coalescer("update_log", {"log_id": "7", "valores": {}}, "delete_log", {"log_id": "7"}) == \
+        ("delete_log", {"log_id": "7"})
+
+
+def test_coalescer_edicoes():
+    a = {"log_id": "7", "valores": {"4": 100, "9": "x"}}
+    b = {"log_id": "7", "valores": {"9": "y"}}
+    assert repositorio.coalescer("update_log", a, "update_log", b) == \
+        ("update_log", {"log_id": "7", "valores": {"4": 100, "9": "y"}})
+    op, payload = repositorio.coalescer("append_log", {"row": [7, "AAA1A11", "Freios"]}, "update_log",
+                                        {"log_id": "7", "valores": {"3": "Pneus"}})
+    assert (op, payload["row"]) == ("append_log", [7, "AAA1A11", "Pneus"])
+
+
+def test_coalescer_lotes_nao_juntam():
+    assert repositorio.coalescer("append_logs", {"rows": []}, "update_logs", {"itens": []}) is NAO_COALESCE
+    assert repositorio.coalescer("delete_log", {"log_id": "7"}, "append_log", {"row": [7]}) is NAO_COALESCE
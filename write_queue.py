@@ -0,0 +1,262 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Fila de escrita (write-behind) com journal local durável.
+#
+# A tela grava a operação no journal (SQLite, só INSERT) e segue; um worker em
+# segundo plano reaplica as operações pendentes na ordem em que entraram, junta
+# edições consecutivas da mesma linha numa só e insiste até conseguir. Se o
+# processo cair, as pendentes continuam no arquivo e são reaplicadas na volta.
+#
+# A fila não conhece a planilha: quem cria passa
+#   aplicar(operacao, payload, replay) -> True (gravou) / False (erro permanente)
+#       e levanta exceção em erro transitório (rede, cota);
+#   coalescer(op_a, payload_a, op_b, payload_b) -> (op, payload) combinados,
+#       None se as duas se anulam, ou NAO_COALESCE.
+#
+# Um worker por arquivo de journal: réplicas devem usar arquivos separados
+# (JOURNAL_PATH).
+
+CAMINHO_PADRAO = os.path.join(".cache", "frota_journal.sqlite")
+NAO_COALESCE = object()
+
+PENDENTE = "pendente"
+OK = "ok"
+ERRO = "erro"
+
+
+def caminho_padrao():
+    # JOURNAL_PATH lido na hora da chamada, não no import: o .env só é carregado depois
+    return os.getenv("JOURNAL_PATH", CAMINHO_PADRAO)
+
+
+class WriteQueue:
+    def __init__(self, aplicar, coalescer=None, caminho=None, max_tentativas=8, backoff_max_s=60.0):
+        self.caminho = caminho or caminho_padrao()
+        self._aplicar = aplicar
+        self._coalescer = coalescer
+        self.max_tentativas = max_tentativas
+        self.backoff_max_s = backoff_max_s
+        self._inicio = time.time()
+        self._acordar = threading.Event()
+        self._lock = threading.Lock()
+        self._falhas_seguidas = 0
+        self._proxima_tentativa = 0.0
+        self._thread = None
+        self._criar_tabela()
+
+    # --- journal ---
+    def _conectar(self):
+        pasta = os.path.dirname(self.caminho)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        conn = sqlite3.connect(self.caminho, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _criar_tabela(self):
+        conn = self._conectar()
+        try:
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS journal ("
+                    " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+                    " criado_em REAL NOT NULL,"
+                    " operacao TEXT NOT NULL,"
+                    " chave TEXT NOT NULL,"
+                    " payload TEXT NOT NULL,"
+                    " status TEXT NOT NULL DEFAULT 'pendente',"
+                    " tentativas INTEGER NOT NULL DEFAULT 0,"
+                    " ultimo_erro TEXT,"
+                    " concluido_em REAL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS journal_status_idx ON journal (status, seq)")
+        finally:
+            conn.close()
+
+    def enfileirar(self, operacao, chave, payload):
+        conn = self._conectar()
+        try:
+            with conn:
+                cur = conn.execute(
+                    "INSERT INTO journal (criado_em, operacao, chave, payload) VALUES (?, ?, ?, ?)",
+                    (time.time(), operacao, chave, json.dumps(payload, default=str)),
+                )
+                seq = cur.lastrowid
+        finally:
+            conn.close()
+        self._acordar.set()
+        return seq
+
+    def _listar(self, status):
+        conn = self._conectar()
+        try:
+            linhas = conn.execute(
+                "SELECT seq, criado_em, operacao, chave, payload, tentativas, ultimo_erro"
+                " FROM journal WHERE status = ? ORDER BY seq",
+                (status,),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            {"seq": seq, "criado_em": criado_em, "operacao": op, "chave": chave,
+             "payload": json.loads(payload), "tentativas": tentativas, "ultimo_erro": erro}
+            for seq, criado_em, op, chave, payload, tentativas, erro in linhas
+        ]
+
+    def pendentes(self):
+        return self._listar(PENDENTE)
+
+    def erros(self):
+        return self._listar(ERRO)
+
+    def _marcar(self, seqs, status=None, erro=None, somar_tentativa=False):
+        conn = self._conectar()
+        try:
+            with conn:
+                for seq in seqs:
+                    conn.execute(
+                        "UPDATE journal SET status = COALESCE(?, status), ultimo_erro = COALESCE(?, ultimo_erro),"
+                        " tentativas = tentativas + ?, concluido_em = CASE WHEN ? = 'ok' THEN ? ELSE concluido_em END"
+                        " WHERE seq = ?",
+                        (status, erro, 1 if somar_tentativa else 0, status, time.time(), seq),
+                    )
+        finally:
+            conn.close()
+
+    def tentar_de_novo(self, seq=None):
+        # Devolve para a fila uma (ou todas) as operações que falharam de vez
+        conn = self._conectar()
+        try:
+            with conn:
+                if seq is None:
+                    conn.execute("UPDATE journal SET status = ?, tentativas = 0 WHERE status = ?", (PENDENTE, ERRO))
+                else:
+                    conn.execute("UPDATE journal SET status = ?, tentativas = 0 WHERE seq = ?", (PENDENTE, seq))
+        finally:
+            conn.close()
+        with self._lock:
+            self._falhas_seguidas = 0
+            self._proxima_tentativa = 0.0
+        self._acordar.set()
+
+    def descartar(self, seq):
+        self._marcar([seq], status="descartado")
+
+    def compactar(self, manter_s=86400):
+        # Remove do arquivo o que já foi gravado há mais de um dia
+        conn = self._conectar()
+        try:
+            with conn:
+                conn.execute("DELETE FROM journal WHERE status IN (?, 'descartado') AND criado_em < ?",
+                             (OK, time.time() - manter_s))
+        finally:
+            conn.close()
+
+    def resumo(self):
+        conn = self._conectar()
+        try:
+            contagem = dict(conn.execute("SELECT status, count(*) FROM journal GROUP BY status").fetchall())
+            ultimo = conn.execute(
+                "SELECT ultimo_erro FROM journal WHERE status = ? AND ultimo_erro IS NOT NULL ORDER BY seq DESC LIMIT 1",
+                (PENDENTE,),
+            ).fetchone()
+        finally:
+            conn.close()
+        with self._lock:
+            espera = max(0.0, self._proxima_tentativa - time.monotonic())
+        return {
+            "pendentes": contagem.get(PENDENTE, 0),
+            "erros": contagem.get(ERRO, 0),
+            "ultimo_erro": ultimo[0] if ultimo else None,
+            "proxima_tentativa_s": espera,
+        }
+
+    # --- worker ---
+    def _agrupar(self, entradas):
+        # Junta entradas consecutivas da mesma chave. op None = operações que se anularam.
+        grupos, i = [], 0
+        while i < len(entradas):
+            e = entradas[i]
+            grupo = {"seqs": [e["seq"]], "chave": e["chave"], "op": e["operacao"], "payload": e["payload"],
+                     "tentativas": e["tentativas"], "replay": e["tentativas"] > 0 or e["criado_em"] < self._inicio}
+            j = i + 1
+            while grupo["op"] is not None and self._coalescer and j < len(entradas) and entradas[j]["chave"] == e["chave"]:
+                prox = entradas[j]
+                r = self._coalescer(grupo["op"], grupo["payload"], prox["operacao"], prox["payload"])
+                if r is NAO_COALESCE:
+                    break
+                grupo["seqs"].append(prox["seq"])
+                grupo["tentativas"] = max(grupo["tentativas"], prox["tentativas"])
+                grupo["replay"] = grupo["replay"] or prox["tentativas"] > 0 or prox["criado_em"] < self._inicio
+                grupo["op"], grupo["payload"] = r if r is not None else (None, None)
+                j += 1
+            grupos.append(grupo)
+            i = j
+        return grupos
+
+    def processar(self):
+        # Uma passada pela fila, em ordem. Falha transitória (exceção) interrompe a passada;
+        # recusa (False) só segura as operações seguintes da mesma chave.
+        gravadas, bloqueadas, recusou = 0, set(), False
+        for g in self._agrupar(self.pendentes()):
+            if g["chave"] in bloqueadas:
+                continue
+            if g["op"] is None:
+                self._marcar(g["seqs"], status=OK)
+                continue
+            try:
+                ok = self._aplicar(g["op"], g["payload"], g["replay"])
+            except Exception as e:
+                self._marcar(g["seqs"], erro=str(e) or type(e).__name__, somar_tentativa=True)
+                self._agendar_nova_tentativa()
+                return gravadas
+            if ok:
+                self._marcar(g["seqs"], status=OK)
+                gravadas += len(g["seqs"])
+                continue
+            # Recusada (ex.: linha já não existe): desiste depois de max_tentativas
+            desistir = g["tentativas"] + 1 >= self.max_tentativas
+            self._marcar(g["seqs"], status=ERRO if desistir else None, erro="operação recusada", somar_tentativa=True)
+            bloqueadas.add(g["chave"])
+            recusou = recusou or not desistir
+        if recusou:
+            self._agendar_nova_tentativa()
+        else:
+            with self._lock:
+                self._falhas_seguidas = 0
+                self._proxima_tentativa = 0.0
+        return gravadas
+
+    def _agendar_nova_tentativa(self):
+        with self._lock:
+            self._falhas_seguidas += 1
+            espera = min(self.backoff_max_s, 2 ** self._falhas_seguidas)
+            self._proxima_tentativa = time.monotonic() + espera
+
+    def _loop(self):
+        ultima_compactacao = 0.0
+        while True:
+            with self._lock:
+                espera = self._proxima_tentativa - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+            try:
+                self.processar()
+                if time.monotonic() - ultima_compactacao > 3600:
+                    self.compactar()
+                    ultima_compactacao = time.monotonic()
+            except Exception as e:
+                print(f"❌ [DEBUG] Worker do journal: {e}")
+                self._agendar_nova_tentativa()
+            self._acordar.wait(timeout=5)
+            self._acordar.clear()
+
+    def iniciar(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name="journal-worker", daemon=True)
+            self._thread.start()
+        return self